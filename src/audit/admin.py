@@ -0,0 +1,23 @@
+from django.contrib import admin
+
+from audit.models import AuditEntry
+from base.pagination import EstimatedCountPaginator
+
+
+@admin.register(AuditEntry)
+class AuditEntryAdmin(admin.ModelAdmin):
+    list_display = ("id", "created_at", "actor", "action", "method", "object_id", "status_code", "ip")
+    list_select_related = ("actor",)
+    list_filter = ("method",)
+    search_fields = ("=action", "=actor__username")
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,44 @@
+import tempfile
+
+from django.test import override_settings
+from django.utils import timezone
+
+from audit import buffer
+from audit.models import AuditEntry
+from base.benchmarks import register, best_of, speedup
+
+
+def entries(count):
+    now = timezone.now()
+    return [
+        {"action": "wallets_replenish", "method": "POST", "path": "/api/v1/staking/wallets/replenish/",
+         "status_code": 200, "created_at": now}
+        for _ in range(count)
+    ]
+
+
+@register("audit.record")
+def audit_record(options):
+    count = options["rows"]
+
+    def inline():
+        with override_settings(AUDIT_ASYNC=False):
+            for entry in entries(count):
+                buffer.record(**entry)
+
+    def buffered():
+        with tempfile.TemporaryDirectory() as spill_dir:
+            audit_buffer = buffer.AuditBuffer(count, 500, 60, spill_dir)
+            for entry in entries(count):
+                audit_buffer.add(entry)
+            audit_buffer.close()
+
+    inline_time = best_of(inline, options["repeat"])
+    buffered_time = best_of(buffered, options["repeat"])
+    return [
+        ("entries", count),
+        ("stored", AuditEntry.objects.count()),
+        ("inline INSERT per entry (entries/s)", f"{count / inline_time:.0f}"),
+        ("buffered, batches of 500 (entries/s)", f"{count / buffered_time:.0f}"),
+        ("speedup", speedup(inline_time, buffered_time)),
+    ]
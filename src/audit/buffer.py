@@ -0,0 +1,179 @@
+"""
+Buffered audit log.
+
+Every state-changing request is audited (see `audit.middleware`), but an INSERT per request
+would add a write to every hot endpoint. Entries are appended to an in-process buffer instead
+and a background thread stores them with one `bulk_create` every AUDIT_FLUSH_INTERVAL seconds,
+or as soon as AUDIT_BATCH_SIZE entries are waiting.
+
+A batch that cannot be written (the database is locked or down) is spilled to a fsynced JSON
+lines file in AUDIT_SPILL_DIR and replayed by the next successful flush, or by
+`manage.py replay_audit_spill`. When AUDIT_BUFFER_SIZE entries are waiting the request thread
+spills the buffer itself, so nothing is lost. With AUDIT_LOSSY the entries that do not fit are
+dropped and counted in `AuditBuffer.dropped` instead: the loss is bounded by the buffer size and
+the request path never touches the disk. The buffer is flushed when the process exits.
+
+With AUDIT_ASYNC disabled every entry is written inline, for tests running in a transaction.
+"""
+import atexit
+import fcntl
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from pathlib import Path
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DatabaseError, close_old_connections
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from audit.models import AuditEntry
+
+
+def write(entries):
+    AuditEntry.objects.bulk_create([AuditEntry(**entry) for entry in entries])
+
+
+def spill(entries, spill_dir):
+    """Durably append `entries` to a new file of `spill_dir`."""
+    spill_dir = Path(spill_dir)
+    spill_dir.mkdir(parents=True, exist_ok=True)
+    path = spill_dir / f"{time.time_ns()}-{os.getpid()}-{uuid.uuid4().hex[:8]}.jsonl"
+    temporary = path.with_suffix(".tmp")
+    with open(temporary, "w") as file:
+        for entry in entries:
+            file.write(json.dumps(entry, cls=DjangoJSONEncoder) + "\n")
+        file.flush()
+        os.fsync(file.fileno())
+    # Renamed only once complete, so a replay never reads a half written file
+    os.replace(temporary, path)
+
+
+def replay(spill_dir):
+    """Write the spilled entries to the database and delete their files. Returns the number of entries."""
+    written = 0
+    for path in sorted(Path(spill_dir).glob("*.jsonl")):
+        with open(path) as file:
+            try:
+                fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue  # being replayed by another process
+            try:
+                if os.stat(path).st_ino != os.fstat(file.fileno()).st_ino:
+                    continue
+            except FileNotFoundError:
+                continue  # replayed and deleted by another process while this one waited
+            entries = [json.loads(line) for line in file if line.strip()]
+            for entry in entries:
+                entry["created_at"] = parse_datetime(entry["created_at"])
+            write(entries)
+            path.unlink()
+        written += len(entries)
+    return written
+
+
+class AuditBuffer:
+    def __init__(self, max_size, batch_size, flush_interval, spill_dir, lossy=False):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spill_dir = spill_dir
+        self.lossy = lossy
+        self.dropped = 0
+        self.pid = os.getpid()
+        self._entries = deque()
+        self._wakeup = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="audit-flush", daemon=True)
+        self._thread.start()
+
+    def add(self, entry):
+        overflow = None
+        with self._wakeup:
+            if self._closed:
+                overflow = [entry]
+            elif len(self._entries) >= self.max_size:
+                if self.lossy:
+                    self.dropped += 1
+                    return
+                overflow = self._take(len(self._entries)) + [entry]
+            else:
+                self._entries.append(entry)
+                if len(self._entries) >= self.batch_size:
+                    self._wakeup.notify()
+        if overflow:
+            spill(overflow, self.spill_dir)
+
+    def _take(self, count):
+        return [self._entries.popleft() for _ in range(min(count, len(self._entries)))]
+
+    def _run(self):
+        while True:
+            with self._wakeup:
+                if not self._closed and len(self._entries) < self.batch_size:
+                    self._wakeup.wait(self.flush_interval)
+                if self._closed:
+                    return
+            self.flush()
+
+    def flush(self):
+        """Write the spilled and the buffered entries, spill them again when the database is busy."""
+        with self._flush_lock:
+            try:
+                try:
+                    replay(self.spill_dir)
+                except DatabaseError:
+                    pass  # the files stay for the next flush
+                while True:
+                    with self._wakeup:
+                        batch = self._take(self.batch_size)
+                    if not batch:
+                        return
+                    try:
+                        write(batch)
+                    except DatabaseError:
+                        spill(batch, self.spill_dir)
+            finally:
+                close_old_connections()
+
+    def close(self):
+        """Stop the flush thread and flush what is left, entries added afterwards are spilled."""
+        if self.pid != os.getpid():
+            return  # the copy of the buffer of the parent process in a forked worker
+        with self._wakeup:
+            self._closed = True
+            self._wakeup.notify()
+        self._thread.join()
+        self.flush()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    global _buffer
+    # A forked worker does not inherit the flush thread of its parent
+    if _buffer is None or _buffer.pid != os.getpid():
+        with _buffer_lock:
+            if _buffer is None or _buffer.pid != os.getpid():
+                _buffer = AuditBuffer(
+                    settings.AUDIT_BUFFER_SIZE, settings.AUDIT_BATCH_SIZE, settings.AUDIT_FLUSH_INTERVAL,
+                    settings.AUDIT_SPILL_DIR, settings.AUDIT_LOSSY,
+                )
+                atexit.register(_buffer.close)
+    return _buffer
+
+
+def record(**entry):
+    """Audit an action, the keyword arguments are `AuditEntry` fields."""
+    entry.setdefault("created_at", timezone.now())
+    if not settings.AUDIT_ASYNC:
+        write([entry])
+        return
+    get_buffer().add(entry)
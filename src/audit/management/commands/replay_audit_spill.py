@@ -0,0 +1,12 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from audit.buffer import replay
+
+
+class Command(BaseCommand):
+    help = "Write the audit entries spilled to AUDIT_SPILL_DIR while the database was busy"
+
+    def handle(self, *args, **options):
+        written = replay(settings.AUDIT_SPILL_DIR)
+        self.stdout.write(self.style.SUCCESS(f"Replayed {written} audit entries"))
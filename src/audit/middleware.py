@@ -0,0 +1,31 @@
+from audit.buffer import record
+
+AUDITED_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+
+class AuditMiddleware:
+    """
+    Audits every state-changing request, including the rejected ones, after the view ran.
+
+    Runs after the view, so users authenticated by DRF (JWT) are known as well: DRF copies the
+    authenticated user onto the Django request.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        match = request.resolver_match
+        if request.method in AUDITED_METHODS and match:
+            user = getattr(request, "user", None)
+            record(
+                actor_id=user.pk if user is not None and user.is_authenticated else None,
+                action=(match.url_name or match.view_name)[:100],
+                method=request.method,
+                path=request.path[:255],
+                object_id=str(match.kwargs.get("pk", match.kwargs.get("object_id", "")))[:64],
+                status_code=response.status_code,
+                ip=request.META.get("REMOTE_ADDR"),
+            )
+        return response
@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.db import models
+
+
+class AuditEntry(models.Model):
+    # No database constraint: entries are written after the request, possibly after the actor
+    # was deleted, and must outlive the user they describe
+    actor = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.DO_NOTHING, db_constraint=False,
+        null=True, blank=True, related_name="+",
+    )
+    action = models.CharField(max_length=100)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=255)
+    object_id = models.CharField(max_length=64, blank=True)
+    status_code = models.PositiveSmallIntegerField()
+    ip = models.GenericIPAddressField(null=True, blank=True)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        verbose_name_plural = "Audit entries"
+        indexes = [
+            models.Index(fields=["actor", "id"], name="audit_actor_id_idx"),
+            models.Index(fields=["created_at"], name="audit_created_at_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.created_at:%Y-%m-%d %H:%M:%S} {self.actor_id} {self.action}"
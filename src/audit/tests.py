@@ -0,0 +1,89 @@
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+from django.db import OperationalError
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from audit import buffer
+from audit.models import AuditEntry
+from users.models import User
+
+
+def entry(action):
+    return {"action": action, "method": "POST", "path": "/", "status_code": 200, "created_at": timezone.now()}
+
+
+class AuditBufferTestCase(TestCase):
+    def setUp(self):
+        spill_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(spill_dir.cleanup)
+        self.spill_dir = Path(spill_dir.name)
+
+    def make_buffer(self, lossy=False):
+        # Flushed only by the test: the interval is never reached and batches never fill up
+        audit_buffer = buffer.AuditBuffer(3, 100, 60, self.spill_dir, lossy)
+        self.addCleanup(audit_buffer.close)
+        return audit_buffer
+
+    def test_full_buffer_spills_and_replays_in_order(self):
+        audit_buffer = self.make_buffer()
+        for index in range(5):
+            audit_buffer.add(entry(f"action{index}"))
+        self.assertEqual(len(list(self.spill_dir.glob("*.jsonl"))), 1)
+
+        audit_buffer.flush()
+        self.assertEqual(list(self.spill_dir.glob("*.jsonl")), [])
+        self.assertEqual(
+            list(AuditEntry.objects.order_by("pk").values_list("action", flat=True)),
+            [f"action{index}" for index in range(5)],
+        )
+
+    def test_lossy_buffer_drops_what_does_not_fit(self):
+        audit_buffer = self.make_buffer(lossy=True)
+        for index in range(5):
+            audit_buffer.add(entry(f"action{index}"))
+        audit_buffer.close()
+
+        self.assertEqual(audit_buffer.dropped, 2)
+        self.assertEqual(list(self.spill_dir.glob("*.jsonl")), [])
+        self.assertEqual(AuditEntry.objects.count(), 3)
+
+    def test_busy_database_spills_until_the_next_flush(self):
+        audit_buffer = self.make_buffer()
+        audit_buffer.add(entry("action"))
+        with mock.patch.object(buffer, "write", side_effect=OperationalError("database is locked")):
+            audit_buffer.flush()
+        self.assertEqual(AuditEntry.objects.count(), 0)
+
+        audit_buffer.flush()
+        self.assertEqual(AuditEntry.objects.get().action, "action")
+        self.assertEqual(list(self.spill_dir.glob("*.jsonl")), [])
+
+    def test_entries_added_after_close_are_spilled(self):
+        audit_buffer = self.make_buffer()
+        audit_buffer.close()
+        audit_buffer.add(entry("late"))
+
+        self.assertEqual(buffer.replay(self.spill_dir), 1)
+        self.assertEqual(AuditEntry.objects.get().action, "late")
+
+
+@override_settings(ALLOWED_HOSTS=["testserver"], AUDIT_ASYNC=False)
+class AuditMiddlewareTestCase(TestCase):
+    def test_state_changing_requests_are_audited(self):
+        user = User.objects.create(username="staker", email="staker@example.com")
+        client = APIClient()
+        client.force_authenticate(user)
+        client.get(reverse("positions"))
+        client.post(reverse("wallets_replenish"), {"amount": "10"}, format="json")
+        client.post(reverse("positions_decrease", kwargs={"pk": 404}), {"amount": "10"}, format="json")
+
+        entries = list(AuditEntry.objects.order_by("pk"))
+        self.assertEqual([entry.action for entry in entries], ["wallets_replenish", "positions_decrease"])
+        self.assertEqual({entry.actor_id for entry in entries}, {user.pk})
+        self.assertEqual(entries[1].object_id, "404")
+        self.assertGreaterEqual(entries[1].status_code, 400)
@@ -9,9 +9,15 @@ https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 
 import os
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
+from base.warmup import warmup
+
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'base.settings.dev')
 
 application = get_asgi_application()
+
+if settings.WARMUP_ON_BOOT:
+    warmup()
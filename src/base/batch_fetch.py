@@ -0,0 +1,49 @@
+"""
+Batch retrieval by primary keys: `<resource>/by-ids/?ids=1,2,3`.
+
+Detail views mixing in `BatchFetchMixin` answer a request without a `pk` with the objects of
+`?ids=` (at most BATCH_FETCH_MAX_IDS of them), loaded by one `IN` query on `batch_queryset()`,
+where views filter out the objects the user may not see. The response lists the objects found
+in the order of the ids, and the ids that were not found or are not visible in `missing`.
+"""
+from django.conf import settings
+from rest_framework import status
+from rest_framework.exceptions import ParseError
+from rest_framework.response import Response
+
+IDS_PARAM = "ids"
+MAX_ID = 2 ** 63 - 1  # largest value of a BIGINT primary key, larger ids overflow the query parameters
+
+
+class InvalidIds(ParseError):
+    pass
+
+
+def requested_ids(request):
+    """The distinct ids of `?ids=`, in the order given."""
+    value = request.query_params.get(IDS_PARAM, "")
+    try:
+        ids = list(dict.fromkeys(int(pk) for pk in value.split(",") if pk.strip()))
+    except ValueError:
+        raise InvalidIds("ids must be a comma separated list of integers")
+    if any(not 1 <= pk <= MAX_ID for pk in ids):
+        raise InvalidIds(f"ids must be between 1 and {MAX_ID}")
+    if not ids:
+        raise InvalidIds("ids is required")
+    if len(ids) > settings.BATCH_FETCH_MAX_IDS:
+        raise InvalidIds(f"At most {settings.BATCH_FETCH_MAX_IDS} ids can be fetched at once")
+    return ids
+
+
+class BatchFetchMixin:
+    def batch_queryset(self):
+        return self.get_queryset()
+
+    def get_batch(self, request):
+        ids = requested_ids(request)
+        found = {obj.pk: obj for obj in self.filter_queryset(self.batch_queryset().filter(pk__in=ids))}
+        serializer = self.get_serializer([found[pk] for pk in ids if pk in found], many=True)
+        return Response(
+            {"results": serializer.data, "missing": [pk for pk in ids if pk not in found]},
+            status=status.HTTP_200_OK,
+        )
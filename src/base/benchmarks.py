@@ -0,0 +1,38 @@
+"""
+Registry of micro-benchmarks.
+
+Apps declare benchmarks in a `benchmarks.py` module with the `register` decorator, they are
+collected by `autodiscover` and run by the `run_benchmarks` management command against a
+throwaway test database. A benchmark receives the `options` dict of the command and returns
+a list of `(label, value)` rows to print.
+"""
+import time
+
+from django.utils.module_loading import autodiscover_modules
+
+registry = {}
+
+
+def register(name):
+    def decorator(func):
+        registry[name] = func
+        return func
+    return decorator
+
+
+def autodiscover():
+    autodiscover_modules("benchmarks")
+
+
+def best_of(func, repeat=5):
+    """Return the best wall-clock time of `repeat` runs of `func` in seconds."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def speedup(baseline, candidate):
+    return f"{baseline / candidate:.2f}x" if candidate else "n/a"
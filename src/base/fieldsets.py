@@ -0,0 +1,84 @@
+"""
+Sparse fieldsets: `?fields=id,amount` on list and detail endpoints.
+
+Views mixing in `SparseFieldsetMixin` drop the fields that were not requested from their
+serializer and load only the columns the requested fields are read from (`QuerySet.only`).
+The fields a client can ask for are whitelisted per serializer by `Meta.sparse_fields`; fields
+that are not read from a column of the same name (method fields, annotations) name the columns
+they need in `Meta.sparse_field_sources`, without it the queryset is not narrowed.
+"""
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+from rest_framework.exceptions import ParseError
+
+FIELDS_PARAM = "fields"
+
+
+class InvalidFields(ParseError):
+    pass
+
+
+def requested_fields(request, serializer_class):
+    """The field names of `?fields=`, None when the parameter is not given."""
+    value = request.query_params.get(FIELDS_PARAM)
+    if value is None:
+        return None
+    fields = [name.strip() for name in value.split(",") if name.strip()]
+    allowed = serializer_class.Meta.sparse_fields
+    unknown = [name for name in fields if name not in allowed]
+    if unknown or not fields:
+        raise InvalidFields(f"Unknown fields: {', '.join(unknown) or '(none given)'}. Allowed: {', '.join(allowed)}")
+    return fields
+
+
+def narrow(serializer, fields):
+    target = serializer.child if isinstance(serializer, serializers.ListSerializer) else serializer
+    for name in list(target.fields):
+        if name not in fields:
+            target.fields.pop(name)
+    return serializer
+
+
+def project(queryset, serializer_class, fields):
+    """`queryset` loading only the columns `fields` are read from (and the primary key)."""
+    sources = getattr(serializer_class.Meta, "sparse_field_sources", {})
+    serializer_fields = serializer_class().fields
+    columns = []
+    for name in fields:
+        if name in sources:
+            columns += sources[name]
+            continue
+        try:
+            model_field = queryset.model._meta.get_field(serializer_fields[name].source)
+        except FieldDoesNotExist:
+            return queryset
+        if not model_field.concrete:
+            return queryset
+        columns.append(model_field.name)
+    return queryset.only(*columns)
+
+
+class SparseFieldsetMixin:
+    """For generic views: narrows `get_serializer`, `filter_queryset` and cached snapshots to `?fields=`."""
+
+    def sparse_fields(self):
+        if not hasattr(self, "_sparse_fields"):
+            self._sparse_fields = requested_fields(self.request, self.get_serializer_class())
+        return self._sparse_fields
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        fields = self.sparse_fields()
+        return serializer if fields is None else narrow(serializer, fields)
+
+    def filter_queryset(self, queryset):
+        return self.project(super().filter_queryset(queryset))
+
+    def project(self, queryset):
+        fields = self.sparse_fields()
+        return queryset if fields is None else project(queryset, self.get_serializer_class(), fields)
+
+    def narrow_data(self, data):
+        """Narrow an already serialized item, e.g. a cached snapshot."""
+        fields = self.sparse_fields()
+        return data if fields is None else {name: value for name, value in data.items() if name in fields}
@@ -0,0 +1,287 @@
+"""
+Prometheus metrics without a client library.
+
+Counters and histograms are declared at module level and updated without locks: every thread
+increments its own dict of samples, the dicts are only summed when the metrics are read. The
+samples of threads that exited are folded into a process total, so short-lived threads (the
+compounding workers) neither grow the per-thread registry nor lose their counts.
+
+With several worker processes (gunicorn, management commands) METRICS_DIR must point to a
+directory shared by them and emptied on deploy: each process dumps its samples to its own file
+there every METRICS_DUMP_INTERVAL seconds and at exit, and `/metrics` adds up the files of all
+processes, including the ones that exited since. Without METRICS_DIR only the samples of the
+process serving the scrape are exported.
+
+Values that are cheaper to read from the database than to track (pool TVL) are exported by
+collectors registered with `register_collector`, called at scrape time.
+
+`/metrics` answers the addresses of METRICS_ALLOWED_IPS, and requests bearing METRICS_TOKEN.
+"""
+import atexit
+import hmac
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float("inf"))
+
+metrics = {}
+collectors = []
+
+_local = threading.local()
+_thread_samples = {}  # {thread: its sample dict} of the threads that may still be running
+_exited_samples = {}  # the samples of the threads that exited, summed
+_reap_lock = threading.Lock()
+_process_id = None  # name of the file of this process in METRICS_DIR
+_dumper_pid = None
+_dumper_lock = threading.Lock()
+
+
+def samples():
+    """The sample dict of the current thread: {(metric, labels): value}."""
+    thread_samples = getattr(_local, "samples", None)
+    if thread_samples is None:
+        reap()
+        thread_samples = _local.samples = {}
+        _thread_samples[threading.current_thread()] = thread_samples
+        start_dumper()
+    return thread_samples
+
+
+def reap():
+    """Fold the samples of the threads that exited into `_exited_samples`, they cannot change any more."""
+    with _reap_lock:
+        for thread, thread_samples in list(_thread_samples.items()):
+            if not thread.is_alive():
+                for key, value in thread_samples.items():
+                    merge(_exited_samples, key, value)
+                del _thread_samples[thread]
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        metrics[name] = self
+
+    def key(self, labels):
+        return self.name, tuple(str(labels[label]) for label in self.labelnames)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        thread_samples = samples()
+        key = self.key(labels)
+        thread_samples[key] = thread_samples.get(key, 0) + amount
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        thread_samples = samples()
+        key = self.key(labels)
+        # [count per bucket (not cumulative)..., sum]
+        sample = thread_samples.get(key)
+        if sample is None:
+            sample = thread_samples[key] = [0] * (len(self.buckets) + 1)
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                sample[index] += 1
+                break
+        sample[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+
+def register_collector(collector):
+    """`collector()` returns [(name, kind, documentation, [(labels dict, value), ...]), ...]."""
+    collectors.append(collector)
+    return collector
+
+
+def merge(into, key, value):
+    if isinstance(value, list):
+        current = into.get(key)
+        into[key] = value[:] if current is None else [a + b for a, b in zip(current, value)]
+    else:
+        into[key] = into.get(key, 0) + value
+
+
+def process_samples():
+    """The samples of this process, summed over its threads."""
+    reap()
+    with _reap_lock:
+        total = {key: value[:] if isinstance(value, list) else value for key, value in _exited_samples.items()}
+        live = list(_thread_samples.values())
+    for thread_samples in live:
+        for key, value in thread_samples.copy().items():
+            merge(total, key, value[:] if isinstance(value, list) else value)
+    return total
+
+
+def dump():
+    directory = settings.METRICS_DIR
+    if not directory or _process_id is None:
+        return
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    path = Path(directory) / f"{_process_id}.json"
+    temporary = path.with_suffix(".tmp")
+    temporary.write_text(json.dumps([[name, labels, value] for (name, labels), value in process_samples().items()]))
+    os.replace(temporary, path)
+
+
+def start_dumper():
+    global _dumper_pid, _process_id
+    if _dumper_pid == os.getpid() or not settings.METRICS_DIR:
+        return
+    with _dumper_lock:
+        if _dumper_pid == os.getpid():
+            return
+        _process_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+        def run():
+            while True:
+                time.sleep(settings.METRICS_DUMP_INTERVAL)
+                dump()
+
+        threading.Thread(target=run, name="metrics-dump", daemon=True).start()
+        atexit.register(dump)
+        _dumper_pid = os.getpid()
+
+
+def after_fork():
+    # The samples copied from the parent are still exported by the parent
+    for thread_samples in _thread_samples.values():
+        thread_samples.clear()
+    _exited_samples.clear()
+    if settings.configured:
+        start_dumper()
+
+
+os.register_at_fork(after_in_child=after_fork)
+
+
+def all_samples():
+    """The samples of every process writing to METRICS_DIR, the current one read from memory."""
+    total = process_samples()
+    if settings.METRICS_DIR:
+        for path in Path(settings.METRICS_DIR).glob("*.json"):
+            if path.stem == _process_id:
+                continue
+            try:
+                rows = json.loads(path.read_text())
+            except (OSError, ValueError):
+                continue  # removed by a deploy while being read
+            for name, labels, value in rows:
+                merge(total, (name, tuple(labels)), value)
+    return total
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    by_metric = {}
+    for (name, labels), value in all_samples().items():
+        by_metric.setdefault(name, []).append((labels, value))
+
+    lines = []
+    for name, metric in sorted(metrics.items()):
+        lines += [f"# HELP {name} {metric.documentation}", f"# TYPE {name} {metric.kind}"]
+        for labels, value in sorted(by_metric.get(name, [])):
+            labels = dict(zip(metric.labelnames, labels))
+            if metric.kind == "histogram":
+                cumulative = 0
+                for bound, count in zip(metric.buckets, value):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{format_labels({**labels, 'le': format_value(bound)})} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {format_value(value[-1])}")
+                lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+            else:
+                lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+    for collector in collectors:
+        for name, kind, documentation, collected in collector():
+            lines += [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+            lines += [f"{name}{format_labels(labels)} {format_value(value)}" for labels, value in collected]
+    return "\n".join(lines) + "\n"
+
+
+def scrape_allowed(request):
+    if request.META.get("REMOTE_ADDR") in settings.METRICS_ALLOWED_IPS:
+        return True
+    token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+    return bool(settings.METRICS_TOKEN) and hmac.compare_digest(token.encode(), settings.METRICS_TOKEN.encode())
+
+
+def metrics_view(request):
+    if not scrape_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Latency of HTTP requests by url name", ["view", "method"])
+REQUESTS = Counter("http_requests_total", "HTTP requests by url name and status code", ["view", "method", "status"])
+DB_QUERIES = Counter("db_queries_total", "Database queries run by HTTP requests, by url name", ["view"])
+
+
+class MetricsMiddleware:
+    """Times every request and counts its database queries, labelled with the url name."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = [0]
+
+        def count(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        started = time.perf_counter()
+        with connections["default"].execute_wrapper(count):
+            response = self.get_response(request)
+        match = request.resolver_match
+        view = (match.url_name or match.view_name) if match else "unresolved"
+        REQUEST_DURATION.observe(time.perf_counter() - started, view=view, method=request.method)
+        REQUESTS.inc(view=view, method=request.method, status=response.status_code)
+        DB_QUERIES.inc(queries[0], view=view)
+        return response
@@ -0,0 +1,46 @@
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
+
+# Below this many rows an exact COUNT(*) is cheap, and more useful than an estimate
+ESTIMATE_THRESHOLD = 10_000
+
+
+def estimated_count(model, using="default"):
+    """
+    Approximate row count of the table of `model` without scanning it, or None when the
+    database has no cheap estimate.
+
+    PostgreSQL reads the planner statistics, SQLite the largest rowid (exact until rows are deleted).
+    """
+    connection = connections[using]
+    table = connection.ops.quote_name(model._meta.db_table)
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [table])
+        elif connection.vendor == "sqlite" and model._meta.pk.get_internal_type() in ("AutoField", "BigAutoField"):
+            cursor.execute(f"SELECT MAX(rowid) FROM {table}")
+        else:
+            return None
+        row = cursor.fetchone()
+    if row is None or row[0] is None or row[0] < 0:  # reltuples is -1 until the table is analyzed
+        return None
+    return row[0]
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that replaces `COUNT(*)` over large unfiltered tables with `estimated_count()`.
+
+    Filtered querysets (searches, list filters) are still counted exactly.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if isinstance(queryset, QuerySet) and not queryset.query.where:
+            estimate = estimated_count(queryset.model, queryset.db)
+            if estimate is not None and estimate > ESTIMATE_THRESHOLD:
+                return estimate
+        return super().count
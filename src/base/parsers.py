@@ -0,0 +1,36 @@
+"""
+JSON parser backed by orjson when it is installed (the `fast-json` extra), the counterpart of
+`base.renderers.FastJSONRenderer`.
+
+UTF-8 bodies are decoded by orjson. Other charsets, non-strict JSON (STRICT_JSON off), bodies
+orjson rejects and bodies with a run of 19 digits or more (orjson reads integers outside of
+-2**63..2**64-1 as floats, -9999999999999999999 already is) are handed to DRF's `JSONParser`, so invalid JSON gets the same `400` message as
+before. Without orjson the parser is `JSONParser`.
+"""
+import codecs
+import io
+
+from django.conf import settings
+from rest_framework.parsers import JSONParser
+
+from base.renderers import FastJSONRenderer, orjson
+
+# Digits to "0", every other byte to a space: a run of 19 digits is then found by a plain substring search
+DIGITS = bytes(ord("0") if chr(byte).isdigit() and byte < 128 else ord(" ") for byte in range(256))
+LONG_NUMBER = b"0" * 19
+
+
+class FastJSONParser(JSONParser):
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get("encoding", settings.DEFAULT_CHARSET)
+        if orjson is None or not self.strict or codecs.lookup(encoding).name != "utf-8":
+            return super().parse(stream, media_type, parser_context)
+        body = stream.read()
+        if LONG_NUMBER not in body.translate(DIGITS):
+            try:
+                return orjson.loads(body)
+            except orjson.JSONDecodeError:
+                pass
+        return super().parse(io.BytesIO(body), media_type, parser_context)
@@ -0,0 +1,36 @@
+"""
+JSON renderer backed by orjson when it is installed (the `fast-json` extra).
+
+The output is byte for byte the one of DRF's `JSONRenderer` with the default settings (compact,
+UTF-8, U+2028/U+2029 escaped): values orjson does not handle natively (Decimal, datetimes, lazy
+strings, querysets) go through DRF's `JSONEncoder`, so Decimals stay exact strings and datetimes
+keep the `Z` suffix. Indented output (`; indent=` in the Accept header) and payloads orjson
+refuses (integers beyond 64 bits) are rendered by `JSONRenderer`. Without orjson the renderer is
+`JSONRenderer`.
+"""
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+ORJSON_OPTIONS = 0
+if orjson is not None:
+    ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+
+class FastJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (orjson is None or data is None or self.ensure_ascii or not self.compact
+                or self.get_indent(accepted_media_type, renderer_context or {})):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            rendered = orjson.dumps(data, default=JSONEncoder().default, option=ORJSON_OPTIONS)
+        except TypeError:  # orjson.JSONEncodeError, e.g. an integer that does not fit 64 bits
+            return super().render(data, accepted_media_type, renderer_context)
+        # Valid JSON, but not valid JavaScript: escaped like JSONRenderer does
+        if b"\xe2\x80\xa8" in rendered or b"\xe2\x80\xa9" in rendered:
+            rendered = rendered.replace(b"\xe2\x80\xa8", b"\\u2028").replace(b"\xe2\x80\xa9", b"\\u2029")
+        return rendered
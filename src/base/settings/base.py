@@ -37,9 +37,13 @@ INSTALLED_APPS = [
 
     'users',
     'staking_app',
+    'audit',
+    'jobs',
 ]
 
 MIDDLEWARE = [
+    'base.metrics.MetricsMiddleware',
+    'base.slow_queries.SlowQueryMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -47,6 +51,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'audit.middleware.AuditMiddleware',
 ]
 
 ROOT_URLCONF = 'base.urls'
@@ -71,6 +76,11 @@ WSGI_APPLICATION = 'base.wsgi.application'
 
 AUTH_USER_MODEL = 'users.User'
 
+# Hashes of the register / login / change-password API views (users/hashing.py): at most
+# PASSWORD_HASHING_MAX_CONCURRENCY at once, PASSWORD_HASHING_MAX_PENDING more waiting, then 503
+PASSWORD_HASHING_MAX_CONCURRENCY = env.int("PASSWORD_HASHING_MAX_CONCURRENCY", default=os.cpu_count() or 1)
+PASSWORD_HASHING_MAX_PENDING = env.int("PASSWORD_HASHING_MAX_PENDING", default=64)
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -97,6 +107,16 @@ REST_FRAMEWORK = {
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ],
     "EXCEPTION_HANDLER": "users.utils.custom_exception_handler",
+    # orjson backed when the `fast-json` extra is installed, same output as the DRF JSON classes
+    "DEFAULT_RENDERER_CLASSES": [
+        "base.renderers.FastJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+    "DEFAULT_PARSER_CLASSES": [
+        "base.parsers.FastJSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ],
 }
 
 SIMPLE_JWT = {
@@ -104,6 +124,112 @@ SIMPLE_JWT = {
     "REFRESH_TOKEN_LIFETIME": timedelta(days=7),
 }
 
+# Length of a staking epoch: the period rewards (`PoolConditions.reward_rate`) are accrued for
+STAKING_EPOCH_SECONDS = env.int("STAKING_EPOCH_SECONDS", default=24 * 60 * 60)
+
+# Server-Sent Events stream of wallet and position changes
+STAKING_STREAM_POLL_INTERVAL = env.float("STAKING_STREAM_POLL_INTERVAL", default=0.5)
+STAKING_STREAM_HEARTBEAT_INTERVAL = env.float("STAKING_STREAM_HEARTBEAT_INTERVAL", default=15)
+STAKING_STREAM_BATCH_SIZE = 500
+STAKING_STREAM_QUEUE_SIZE = 1000
+# Under WSGI every connected client holds a worker thread: keep this below the threads of a
+# worker, or serve the stream from base.asgi:application where waiting clients hold no thread
+STAKING_STREAM_MAX_SYNC_STREAMS = env.int("STAKING_STREAM_MAX_SYNC_STREAMS", default=8)
+
+# Total capacity of capped staking pools is tracked on this many counter rows per pool
+STAKING_CAPACITY_SHARDS = env.int("STAKING_CAPACITY_SHARDS", default=8)
+STAKING_CAPACITY_CACHE_TTL = env.float("STAKING_CAPACITY_CACHE_TTL", default=2)
+
+# Position updates are compare-and-swap on a version column, lost races are retried this many times
+STAKING_POSITION_UPDATE_RETRIES = env.int("STAKING_POSITION_UPDATE_RETRIES", default=5)
+STAKING_POSITION_RETRY_BACKOFF = 0.002  # seconds, upper bound of the jittered sleep grows per attempt
+
+# Closed positions are moved to monthly archive tables in STAKING_ARCHIVE_DATABASE (an alias of
+# DATABASES) by `archive_positions --loop`, every STAKING_ARCHIVE_INTERVAL seconds
+STAKING_ARCHIVE_DATABASE = env.str("STAKING_ARCHIVE_DATABASE", default="default")
+STAKING_ARCHIVE_INTERVAL = env.float("STAKING_ARCHIVE_INTERVAL", default=60)
+
+# Wallet and position snapshots served to detail reads, written through by the model methods
+CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "snapshots": {
+        # Off by default: local memory would miss the changes made by the other processes
+        **env.cache_url("SNAPSHOT_CACHE_URL", default="dummycache://"),
+        "OPTIONS": {"MAX_ENTRIES": env.int("SNAPSHOT_CACHE_MAX_ENTRIES", default=100_000)},
+    },
+}
+SNAPSHOT_CACHE_TTL = env.float("SNAPSHOT_CACHE_TTL", default=300)
+
+# Audit entries are buffered in memory and written in batches by a background thread, batches the
+# database does not take are spilled to AUDIT_SPILL_DIR. AUDIT_LOSSY drops the entries that do not
+# fit in a full buffer instead of spilling them from the request. Tests run with AUDIT_ASYNC=False.
+AUDIT_ASYNC = env.bool("AUDIT_ASYNC", default=True)
+AUDIT_LOSSY = env.bool("AUDIT_LOSSY", default=False)
+AUDIT_BUFFER_SIZE = env.int("AUDIT_BUFFER_SIZE", default=10_000)
+AUDIT_BATCH_SIZE = 500
+AUDIT_FLUSH_INTERVAL = env.float("AUDIT_FLUSH_INTERVAL", default=1)
+AUDIT_SPILL_DIR = env.str("AUDIT_SPILL_DIR", default=os.path.join(BASE_DIR, "audit-spill"))
+
+# Largest `?ids=` list of the positions, pools and users `by-ids/` endpoints
+BATCH_FETCH_MAX_IDS = env.int("BATCH_FETCH_MAX_IDS", default=100)
+
+# Identical concurrent reads of the pool and conditions catalog share one computation per process,
+# a request waits at most SINGLE_FLIGHT_TIMEOUT seconds for the one in flight before running its own
+SINGLE_FLIGHT_TIMEOUT = env.float("SINGLE_FLIGHT_TIMEOUT", default=5)
+
+# Prometheus metrics on /metrics. With several worker processes METRICS_DIR is a directory shared by
+# them (emptied on deploy) where each one dumps its samples every METRICS_DUMP_INTERVAL seconds
+METRICS_DIR = env.str("METRICS_DIR", default="")
+METRICS_DUMP_INTERVAL = env.float("METRICS_DUMP_INTERVAL", default=5)
+METRICS_TVL_CACHE_TTL = env.float("METRICS_TVL_CACHE_TTL", default=15)
+# /metrics exposes pool names and TVL: it answers the METRICS_ALLOWED_IPS addresses, and requests with
+# an "Authorization: Bearer <METRICS_TOKEN>" header when a token is set
+METRICS_ALLOWED_IPS = env.list("METRICS_ALLOWED_IPS", default=["127.0.0.1", "::1"])
+METRICS_TOKEN = env.str("METRICS_TOKEN", default="")
+
+# Background jobs run by `run_workers`: a claimed job is leased for JOBS_LEASE_SECONDS (renewed while
+# it runs), failed attempts are retried after JOBS_RETRY_BACKOFF * 2 ** (attempt - 1) seconds
+JOBS_LEASE_SECONDS = env.float("JOBS_LEASE_SECONDS", default=300)
+JOBS_RETRY_BACKOFF = env.float("JOBS_RETRY_BACKOFF", default=5)
+JOBS_MAX_ATTEMPTS = env.int("JOBS_MAX_ATTEMPTS", default=3)
+JOBS_POLL_INTERVAL = env.float("JOBS_POLL_INTERVAL", default=1)
+
+# base/wsgi.py and base/asgi.py warm the process up (imports, serializers, connections, caches) before
+# the first request and log its time-to-ready
+WARMUP_ON_BOOT = env.bool("WARMUP_ON_BOOT", default=True)
+
+# Statements of a request running for SLOW_QUERY_THRESHOLD ms or more are logged to SLOW_QUERY_LOG_FILE,
+# a SLOW_QUERY_SAMPLE_RATE share of them (0 turns the log off)
+SLOW_QUERY_THRESHOLD = env.float("SLOW_QUERY_THRESHOLD", default=100)
+SLOW_QUERY_SAMPLE_RATE = env.float("SLOW_QUERY_SAMPLE_RATE", default=1)
+SLOW_QUERY_STACK_DEPTH = 8
+SLOW_QUERY_LOG_FILE = env.str("SLOW_QUERY_LOG_FILE", default=os.path.join(BASE_DIR, "slow-queries.log"))
+SLOW_QUERY_LOG_MAX_BYTES = 10 * 1024 * 1024
+SLOW_QUERY_LOG_BACKUPS = 3
+# The top offenders report of api/v1/slow-queries/ is parsed from the log again at most every
+# SLOW_QUERY_REPORT_TTL seconds, and only when the log changed
+SLOW_QUERY_REPORT_TTL = env.float("SLOW_QUERY_REPORT_TTL", default=30)
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+        "slow_queries": {
+            "class": "logging.handlers.RotatingFileHandler",
+            "filename": SLOW_QUERY_LOG_FILE,
+            "maxBytes": SLOW_QUERY_LOG_MAX_BYTES,
+            "backupCount": SLOW_QUERY_LOG_BACKUPS,
+            "delay": True,
+        },
+    },
+    "loggers": {
+        "slow_queries": {"handlers": ["slow_queries"], "level": "INFO", "propagate": False},
+        "warmup": {"handlers": ["console"], "level": "INFO", "propagate": False},
+        "jobs": {"handlers": ["console"], "level": "INFO", "propagate": False},
+    },
+}
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/
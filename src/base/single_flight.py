@@ -0,0 +1,97 @@
+"""
+Single-flight coalescing of identical read requests.
+
+A view method decorated with `single_flight()` runs once for all the identical requests that
+arrive while it is running in this process: the first one (the leader) computes the response,
+the ones that arrive meanwhile wait for it and get a copy of its data and status. Requests are
+identical when they have the same view, full path (query string included) and auth scope: all
+staff users share one scope, any other user has their own. Authentication and permissions are
+checked per request before the method runs.
+
+A follower waits at most SINGLE_FLIGHT_TIMEOUT seconds (or the `timeout` given to the decorator)
+and then computes its own response, as it does when the leader raised. The outcome of every
+request is counted by `single_flight_requests_total{view, result}`, with result "leader",
+"shared" or "timeout": shared / total is the coalescing ratio.
+
+Only the staff-only pool and conditions catalog reads are decorated: with a scope per user,
+client reads would only be coalesced with the duplicates of the same user.
+"""
+import functools
+import threading
+
+from django.conf import settings
+from rest_framework.response import Response
+
+from base.metrics import Counter
+
+SINGLE_FLIGHT_REQUESTS = Counter(
+    "single_flight_requests_total", "Coalesced read requests by url name and outcome", ["view", "result"])
+
+
+class Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.failed = False
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func, timeout):
+        """Returns (result, outcome): the result of `func()`, possibly computed by a concurrent call with `key`."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Call()
+
+        if leader:
+            try:
+                call.result = func()
+            except BaseException:
+                call.failed = True
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+            return call.result, "leader"
+
+        if not call.done.wait(timeout):
+            return func(), "timeout"
+        if call.failed:
+            return func(), "leader"
+        return call.result, "shared"
+
+
+flights = SingleFlight()
+
+
+def auth_scope(request):
+    return "staff" if request.user.is_staff else f"user:{request.user.pk}"
+
+
+def single_flight(timeout=None):
+    """Decorator of read-only view methods, see the module docstring."""
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            key = (type(self).__qualname__, auth_scope(request), request.get_full_path())
+
+            def compute():
+                response = method(self, request, *args, **kwargs)
+                return response.data, response.status_code
+
+            (data, status), outcome = flights.do(
+                key, compute, settings.SINGLE_FLIGHT_TIMEOUT if timeout is None else timeout)
+            match = request.resolver_match
+            SINGLE_FLIGHT_REQUESTS.inc(view=match.url_name if match else type(self).__name__, result=outcome)
+            return Response(data, status=status)
+
+        return wrapper
+
+    return decorator
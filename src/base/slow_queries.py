@@ -0,0 +1,168 @@
+"""
+Sampled log of slow SQL statements.
+
+`SlowQueryMiddleware` wraps the queries of every request: a statement running for at least
+SLOW_QUERY_THRESHOLD milliseconds is logged, with probability SLOW_QUERY_SAMPLE_RATE, to the
+"slow_queries" logger (a rotating JSON lines file, see LOGGING). An entry holds the normalized
+statement and its fingerprint, the duration, the url name of the request and the last
+SLOW_QUERY_STACK_DEPTH frames of the project code that issued it (view, serializer, model
+method or signal handler). `top_offenders` aggregates the log per fingerprint, the aggregate is
+reused until the log changes and at most for SLOW_QUERY_REPORT_TTL seconds after it changed.
+"""
+import hashlib
+import json
+import logging
+import random
+import re
+import time
+import traceback
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+logger = logging.getLogger("slow_queries")
+
+STRINGS = re.compile(r"'(?:[^']|'')*'")
+NUMBERS = re.compile(r"\b\d+(?:\.\d+)?\b")
+LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+SPACES = re.compile(r"\s+")
+
+# Entry points, middlewares and query wrappers: on the stack of every query, they attribute nothing
+SKIPPED_FRAMES = ("manage.py", "wsgi.py", "asgi.py", "middleware.py", "base/metrics.py", "base/slow_queries.py")
+
+
+def normalize(sql):
+    """The statement with literals and parameters replaced by `?` and value lists collapsed."""
+    sql = STRINGS.sub("?", sql)
+    sql = NUMBERS.sub("?", sql.replace("%s", "?"))
+    sql = LISTS.sub("(...)", sql)
+    return SPACES.sub(" ", sql).strip()
+
+
+def fingerprint(normalized_sql):
+    return hashlib.sha1(normalized_sql.encode()).hexdigest()[:12]
+
+
+def app_stack():
+    """The innermost frames of the project code that issued the query, outermost first."""
+    root = str(settings.BASE_DIR)
+    frames = [
+        f"{Path(frame.filename).relative_to(root)}:{frame.lineno} in {frame.name}"
+        for frame in traceback.extract_stack()
+        if frame.filename.startswith(root) and "site-packages" not in frame.filename
+        and not frame.filename.endswith(SKIPPED_FRAMES)
+    ]
+    return frames[-settings.SLOW_QUERY_STACK_DEPTH:]
+
+
+class SlowQueryRecorder:
+    def __init__(self, view):
+        self.view = view
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = (time.perf_counter() - started) * 1000
+            if duration >= settings.SLOW_QUERY_THRESHOLD and random.random() < settings.SLOW_QUERY_SAMPLE_RATE:
+                self.record(sql, duration)
+
+    def record(self, sql, duration):
+        normalized = normalize(sql)
+        logger.info(json.dumps({
+            "time": timezone.now().isoformat(),
+            "fingerprint": fingerprint(normalized),
+            "sql": normalized,
+            "duration_ms": round(duration, 3),
+            "view": self.view(),
+            "stack": app_stack(),
+        }))
+
+
+class SlowQueryMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if settings.SLOW_QUERY_SAMPLE_RATE <= 0:
+            return self.get_response(request)
+
+        def view():
+            match = request.resolver_match
+            return (match.url_name or match.view_name) if match else None
+
+        with connections["default"].execute_wrapper(SlowQueryRecorder(view)):
+            return self.get_response(request)
+
+
+_report = {}  # the last aggregate of `top_offenders`: {"signature", "computed_at", "offenders"}
+
+
+def log_files():
+    """The slow query log and its rotated backups."""
+    path = Path(settings.SLOW_QUERY_LOG_FILE)
+    return [path] + [path.with_name(f"{path.name}.{index}") for index in range(1, settings.SLOW_QUERY_LOG_BACKUPS + 1)]
+
+
+def log_signature():
+    """Size and modification time of the log files, it changes with every entry and rotation."""
+    signature = []
+    for file in log_files():
+        try:
+            stat = file.stat()
+        except FileNotFoundError:
+            continue
+        signature.append((file.name, stat.st_size, stat.st_mtime_ns))
+    return signature
+
+
+def read_log():
+    """The entries of the slow query log and of its rotated backups."""
+    for file in log_files():
+        try:
+            lines = file.read_text().splitlines()
+        except FileNotFoundError:
+            continue
+        for line in lines:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue  # cut by a rotation
+
+
+def top_offenders(limit=20):
+    """Slow statements grouped by fingerprint, the largest total duration first."""
+    signature = log_signature()
+    if not _report or (
+        _report["signature"] != signature
+        and time.monotonic() - _report["computed_at"] >= settings.SLOW_QUERY_REPORT_TTL
+    ):
+        # Parsing the whole log takes a while, admins polling the endpoint share one aggregate
+        _report.update(signature=signature, computed_at=time.monotonic(), offenders=aggregate_log())
+    return _report["offenders"][:limit]
+
+
+def aggregate_log():
+    groups = {}
+    for entry in read_log():
+        group = groups.setdefault(entry["fingerprint"], {
+            "fingerprint": entry["fingerprint"], "sql": entry["sql"], "count": 0, "total_ms": 0,
+            "max_ms": 0, "views": set(), "last_seen": entry["time"], "slowest_stack": [],
+        })
+        group["count"] += 1
+        group["total_ms"] += entry["duration_ms"]
+        group["views"].add(entry["view"])
+        group["last_seen"] = max(group["last_seen"], entry["time"])
+        if entry["duration_ms"] >= group["max_ms"]:
+            group["max_ms"] = entry["duration_ms"]
+            group["slowest_stack"] = entry["stack"]
+
+    offenders = sorted(groups.values(), key=lambda group: group["total_ms"], reverse=True)
+    for group in offenders:
+        group["total_ms"] = round(group["total_ms"], 3)
+        group["avg_ms"] = round(group["total_ms"] / group["count"], 3)
+        group["views"] = sorted(view for view in group["views"] if view)
+    return offenders
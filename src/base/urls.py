@@ -17,6 +17,8 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from .metrics import metrics_view
+from .views import SlowQueriesAPIView
 from .yasg import urlpatterns as doc_urls
 
 api_v1_urls = [
@@ -25,11 +27,14 @@ api_v1_urls = [
         include([
             path("users/", include("users.urls")),
             path("staking/", include("staking_app.urls")),
+            path("jobs/", include("jobs.urls")),
+            path("slow-queries/", SlowQueriesAPIView.as_view(), name="slow_queries"),
         ])
     ),
 ]
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name="metrics"),
     *doc_urls,
 ] + api_v1_urls
@@ -0,0 +1,27 @@
+from rest_framework import permissions, status
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from base.slow_queries import top_offenders
+
+
+class SlowQueriesAPIView(APIView):
+    permission_classes = [permissions.IsAuthenticated, permissions.IsAdminUser]
+
+    def get(self, request):
+        """
+        Get the slowest SQL statements of the slow query log, grouped by fingerprint.
+
+        Args:
+            request (HttpRequest): The HTTP request object, `?limit=` caps the number of statements (20 by default).
+
+        Returns:
+            Response: The HTTP response containing the statements, the largest total duration first.
+        """
+        try:
+            limit = int(request.query_params.get("limit", 20))
+        except ValueError:
+            return Response({"message": "limit must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+        if limit < 1:
+            return Response({"message": "limit must be at least 1"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(top_offenders(limit), status=status.HTTP_200_OK)
@@ -0,0 +1,107 @@
+"""
+Warmup of a worker before it serves its first request.
+
+`base/wsgi.py` and `base/asgi.py` call `warmup` right after the application is built, unless
+WARMUP_ON_BOOT is off. The steps resolve the URLconf (importing every view), build the fields
+of the serializers of every view (which fills the model `_meta` caches they read), import the
+drf_yasg schema generators, open a connection to every database and read the most recent rows of
+the hot tables (filling the OS page cache of SQLite files), and load the pool capacity and TVL
+caches. A failing step is logged and skipped: a worker always boots.
+
+The connections are closed at the end, so that a server preloading the application (gunicorn
+`--preload`) runs the warmup once in the master and its forked workers inherit the imports and
+caches but no connection. The time-to-ready of the process is logged to the "warmup" logger.
+"""
+import importlib
+import logging
+import os
+import time
+
+from django.apps import apps
+from django.db import connections
+from django.urls import URLPattern, URLResolver, get_resolver
+
+logger = logging.getLogger("warmup")
+
+HOT_MODELS = ["users.User", "staking_app.UserWallet", "staking_app.UserPosition", "staking_app.StackingPool",
+              "staking_app.PoolConditions", "staking_app.UnstakeRequest"]
+HOT_ROWS = 1000
+API_DOCS_MODULES = ["drf_yasg.generators", "drf_yasg.inspectors", "drf_yasg.renderers", "drf_yasg.openapi"]
+
+steps = []
+
+
+def step(name):
+    def decorator(func):
+        steps.append((name, func))
+        return func
+    return decorator
+
+
+def view_classes(patterns=None):
+    for pattern in get_resolver().url_patterns if patterns is None else patterns:
+        if isinstance(pattern, URLResolver):
+            yield from view_classes(pattern.url_patterns)
+        elif isinstance(pattern, URLPattern):
+            view_class = getattr(pattern.callback, "view_class", None)
+            if view_class is not None:
+                yield view_class
+
+
+@step("urls")
+def resolve_urls():
+    get_resolver().reverse_dict  # builds the lookup tables of reverse() and of every include
+
+
+@step("serializers")
+def build_serializers():
+    for view_class in set(view_classes()):
+        serializer_class = getattr(view_class, "serializer_class", None)
+        if serializer_class is not None:
+            serializer_class().fields
+
+
+@step("api_docs")
+def import_api_docs():
+    for module in API_DOCS_MODULES:
+        importlib.import_module(module)
+
+
+@step("databases")
+def prime_databases():
+    for connection in connections.all():
+        connection.ensure_connection()
+    for label in HOT_MODELS:
+        model = apps.get_model(label)
+        list(model.objects.order_by("-pk")[:HOT_ROWS])
+
+
+@step("catalog")
+def load_catalog():
+    from staking_app import capacity
+    from staking_app.metrics import pool_tvl
+    from staking_app.models import StackingPool
+
+    for pool_id in StackingPool.objects.filter(capacity__isnull=False).values_list("pk", flat=True):
+        capacity.reserved_amount(pool_id)
+    pool_tvl()
+
+
+def warmup():
+    """Run every step, returns {step: seconds}."""
+    started = time.perf_counter()
+    timings = {}
+    for name, func in steps:
+        step_started = time.perf_counter()
+        try:
+            func()
+        except Exception:
+            logger.exception("Warmup step %s failed", name)
+        timings[name] = time.perf_counter() - step_started
+    connections.close_all()
+
+    logger.info(
+        "Process %s ready in %.3fs (%s)", os.getpid(), time.perf_counter() - started,
+        ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in timings.items()),
+    )
+    return timings
@@ -9,8 +9,14 @@ https://docs.djangoproject.com/en/4.2/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
+from base.warmup import warmup
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', "base.settings.dev")
 
 application = get_wsgi_application()
+
+if settings.WARMUP_ON_BOOT:
+    warmup()
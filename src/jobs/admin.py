@@ -0,0 +1,14 @@
+from django.contrib import admin
+
+from base.pagination import EstimatedCountPaginator
+from jobs.models import Job
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ("id", "kind", "status", "priority", "attempts", "run_after", "created_by", "finished_at")
+    list_select_related = ("created_by",)
+    list_filter = ("status", "kind")
+    raw_id_fields = ("created_by",)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
@@ -0,0 +1,51 @@
+import multiprocessing
+import signal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from jobs.queue import work
+
+
+def run_worker(stop):
+    # SIGINT reaches the whole process group: workers finish their job and stop with the parent
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda *args: stop.set())
+    work(stop)
+
+
+class Command(BaseCommand):
+    help = "Run the background jobs queued in the database"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int, default=1, help="Worker processes, each runs one job at a time")
+        parser.add_argument("--once", action="store_true", help="Run the queued jobs in this process and exit")
+
+    def handle(self, *args, **options):
+        if options["processes"] < 1:
+            raise CommandError("--processes must be at least 1")
+        if options["once"]:
+            ran = work(once=True)
+            self.stdout.write(self.style.SUCCESS(f"Ran {ran} jobs"))
+            return
+
+        context = multiprocessing.get_context("fork")
+        stop = context.Event()
+        connections.close_all()  # never shared with the forked workers
+        workers = [
+            context.Process(target=run_worker, args=(stop,), name=f"jobs-worker-{index}")
+            for index in range(options["processes"])
+        ]
+        for worker in workers:
+            worker.start()
+        self.stdout.write(self.style.SUCCESS(f"Started {len(workers)} job workers"))
+
+        signal.signal(signal.SIGTERM, lambda *args: stop.set())
+        try:
+            while not stop.is_set() and any(worker.is_alive() for worker in workers):
+                stop.wait(1)
+        except KeyboardInterrupt:
+            stop.set()
+        self.stdout.write("Stopping, waiting for the running jobs to finish")
+        for worker in workers:
+            worker.join()
@@ -0,0 +1,173 @@
+"""
+Job queue stored in the application database.
+
+Apps declare handlers in their `jobs.py` module with `register(kind)`, request code queues work
+with `enqueue`, in the transaction of the request: a job only becomes visible to the workers
+when that transaction commits, and is dropped with it.
+
+Workers (`run_workers`) claim one job at a time, the one with the highest priority, oldest
+first. On databases with `SELECT ... FOR UPDATE SKIP LOCKED` the candidate row is locked and
+skipped by the other workers; elsewhere (SQLite) the claim is a conditional UPDATE that only one
+worker can win. A claimed job is leased for JOBS_LEASE_SECONDS and the lease is renewed by a
+heartbeat thread while the handler runs, so a job whose worker died is claimed again once its
+lease expires. A handler that raises is retried after JOBS_RETRY_BACKOFF * 2 ** (attempt - 1)
+seconds until `max_attempts` is reached, then the job is failed. Handlers must be idempotent:
+a job can run more than once when a worker dies after the handler committed.
+"""
+import logging
+import os
+import threading
+import time
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import OperationalError, close_old_connections, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from jobs.models import Job
+
+logger = logging.getLogger("jobs")
+
+handlers = {}
+
+CLAIM_CANDIDATES = 10  # rows tried per claim when the database cannot skip locked rows
+
+
+def register(kind):
+    def decorator(func):
+        handlers[kind] = func
+        return func
+    return decorator
+
+
+def enqueue(kind, payload=None, priority=0, max_attempts=None, user=None):
+    if kind not in handlers:
+        raise ValueError(f"Unknown job kind {kind}")
+    return Job.objects.create(
+        kind=kind, payload=payload or {}, priority=priority,
+        max_attempts=settings.JOBS_MAX_ATTEMPTS if max_attempts is None else max_attempts,
+        created_by=user if user is not None and user.is_authenticated else None,
+    )
+
+
+def worker_name():
+    return f"{os.uname().nodename}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+def claimable(now):
+    return Q(status=Job.QUEUED, run_after__lte=now) | Q(status=Job.RUNNING, locked_until__lt=now)
+
+
+def claim(worker):
+    """Lease the next job to `worker`, None when there is nothing to run."""
+    now = timezone.now()
+    candidates = Job.objects.filter(claimable(now)).order_by("-priority", "id")
+    lease = {
+        "status": Job.RUNNING, "locked_by": worker, "locked_until": now + timedelta(seconds=settings.JOBS_LEASE_SECONDS),
+        "attempts": F("attempts") + 1, "started_at": now,
+    }
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            pk = candidates.select_for_update(skip_locked=True).values_list("pk", flat=True).first()
+            if pk is None:
+                return None
+            Job.objects.filter(pk=pk).update(**lease)
+        return Job.objects.get(pk=pk)
+
+    for pk in candidates.values_list("pk", flat=True)[:CLAIM_CANDIDATES]:
+        # Lost when another worker claimed the row since it was read
+        if Job.objects.filter(claimable(now), pk=pk).update(**lease):
+            return Job.objects.get(pk=pk)
+    return None
+
+
+class Heartbeat:
+    """Extends the lease of the job while the handler runs, in a thread with its own connection."""
+
+    def __init__(self, job, worker):
+        self.job = job
+        self.worker = worker
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name=f"job-{job.pk}-heartbeat", daemon=True)
+
+    def run(self):
+        interval = settings.JOBS_LEASE_SECONDS / 3
+        try:
+            while not self.stopped.wait(interval):
+                try:
+                    Job.objects.filter(pk=self.job.pk, locked_by=self.worker, status=Job.RUNNING).update(
+                        locked_until=timezone.now() + timedelta(seconds=settings.JOBS_LEASE_SECONDS))
+                except OperationalError:
+                    continue  # the database is busy (SQLite), the lease is long enough to retry
+        finally:
+            connection.close()
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+
+def finish(job, worker, **fields):
+    """Record the outcome, unless the lease was lost and the job went to another worker."""
+    return Job.objects.filter(pk=job.pk, locked_by=worker, status=Job.RUNNING).update(
+        locked_by="", locked_until=None, **fields)
+
+
+def execute(job, worker):
+    handler = handlers.get(job.kind)
+    now = timezone.now()
+    if handler is None:
+        return finish(job, worker, status=Job.FAILED, finished_at=now, last_error=f"Unknown job kind {job.kind}")
+    if job.attempts > job.max_attempts:
+        # Claimed again after its lease expired on the last attempt
+        return finish(job, worker, status=Job.FAILED, finished_at=now,
+                      last_error=job.last_error or "The worker running the last attempt stopped")
+
+    started = time.perf_counter()
+    try:
+        with Heartbeat(job, worker):
+            result = handler(**job.payload)
+    except Exception:
+        error = traceback.format_exc()
+        logger.warning("Job %s (%s) attempt %s failed:\n%s", job.pk, job.kind, job.attempts, error)
+        if job.attempts < job.max_attempts:
+            backoff = settings.JOBS_RETRY_BACKOFF * 2 ** (job.attempts - 1)
+            return finish(job, worker, status=Job.QUEUED, last_error=error,
+                          run_after=timezone.now() + timedelta(seconds=backoff))
+        return finish(job, worker, status=Job.FAILED, last_error=error, finished_at=timezone.now())
+
+    logger.info("Job %s (%s) done in %.2fs", job.pk, job.kind, time.perf_counter() - started)
+    return finish(job, worker, status=Job.SUCCEEDED, result=result, finished_at=timezone.now())
+
+
+def work(stop=None, once=False, worker=None):
+    """
+    Run jobs until `stop` (a threading or multiprocessing Event) is set, or until the queue is
+    empty when `once`. Returns the number of jobs run.
+    """
+    worker = worker or worker_name()
+    ran = 0
+    while stop is None or not stop.is_set():
+        close_old_connections()
+        try:
+            job = claim(worker)
+        except OperationalError:
+            job = None  # the database is busy (SQLite), try again after the poll interval
+        if job is not None:
+            execute(job, worker)
+            ran += 1
+            continue
+        if once:
+            break
+        if stop is None:
+            time.sleep(settings.JOBS_POLL_INTERVAL)
+        else:
+            stop.wait(settings.JOBS_POLL_INTERVAL)
+    return ran
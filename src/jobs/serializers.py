@@ -0,0 +1,13 @@
+from rest_framework import serializers
+
+from jobs.models import Job
+
+
+class JobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Job
+        fields = [
+            "id", "kind", "payload", "status", "priority", "attempts", "max_attempts", "run_after",
+            "result", "last_error", "created_at", "started_at", "finished_at",
+        ]
+        sparse_fields = fields
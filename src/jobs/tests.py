@@ -0,0 +1,94 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from jobs import queue
+from jobs.models import Job
+from staking_app.epochs import current_epoch
+from staking_app.models import PoolConditions, StackingPool, UserPosition
+from staking_app.unstaking import settle
+from users.models import User
+
+calls = []
+
+
+@queue.register("tests.record")
+def record(value):
+    calls.append(value)
+    return {"recorded": value}
+
+
+@queue.register("tests.fail")
+def fail():
+    raise RuntimeError("handler failed")
+
+
+@override_settings(JOBS_RETRY_BACKOFF=0)
+class JobQueueTestCase(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_jobs_run_by_priority(self):
+        low = queue.enqueue("tests.record", {"value": "low"})
+        high = queue.enqueue("tests.record", {"value": "high"}, priority=10)
+
+        self.assertEqual(queue.work(once=True), 2)
+        self.assertEqual(calls, ["high", "low"])
+        for job in [low, high]:
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.attempts, job.locked_by), (Job.SUCCEEDED, 1, ""))
+        self.assertEqual(high.result, {"recorded": "high"})
+
+    def test_failed_attempts_are_retried_then_the_job_fails(self):
+        job = queue.enqueue("tests.fail", max_attempts=2)
+
+        self.assertEqual(queue.work(once=True), 2)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+        self.assertIn("RuntimeError: handler failed", job.last_error)
+
+    def test_jobs_of_a_dead_worker_are_claimed_again_when_the_lease_expires(self):
+        expired = Job.objects.create(
+            kind="tests.record", payload={"value": "expired"}, status=Job.RUNNING, attempts=1,
+            locked_by="dead", locked_until=timezone.now() - timedelta(seconds=1))
+        Job.objects.create(
+            kind="tests.record", payload={"value": "leased"}, status=Job.RUNNING, attempts=1,
+            locked_by="alive", locked_until=timezone.now() + timedelta(minutes=5))
+
+        self.assertEqual(queue.work(once=True), 1)
+        self.assertEqual(calls, ["expired"])
+        expired.refresh_from_db()
+        self.assertEqual((expired.status, expired.attempts), (Job.SUCCEEDED, 2))
+
+
+@override_settings(ALLOWED_HOSTS=["testserver"], AUDIT_ASYNC=False)
+class StakingJobsTestCase(TestCase):
+    def test_pool_deletion_runs_in_a_job(self):
+        admin = User.objects.create(username="admin", email="admin@example.com", is_staff=True)
+        user = User.objects.create(username="staker", email="staker@example.com")
+        user.wallet.replenish(1000)
+        conditions = PoolConditions(min_amount=100, max_amount=500)
+        conditions.save()
+        pool = StackingPool.objects.create(name="Example Pool", conditions=conditions)
+        UserPosition(user=User.objects.get(pk=user.pk), pool=pool, amount=200).save()
+
+        client = APIClient()
+        client.force_authenticate(admin)
+        response = client.delete(reverse("pools_delete", kwargs={"pk": pool.pk}))
+        self.assertEqual(response.status_code, 202)
+        self.assertTrue(StackingPool.objects.filter(pk=pool.pk).exists())
+
+        queue.work(once=True)
+        self.assertFalse(StackingPool.objects.filter(pk=pool.pk).exists())
+        self.assertEqual(settle(current_epoch() + 1), 1)  # the refund is queued like any other close
+        self.assertEqual(User.objects.get(pk=user.pk).wallet.balance, Decimal(1000))
+        job = client.get(reverse("jobs_detail", kwargs={"pk": response.data["job"]})).json()
+        self.assertEqual((job["status"], job["result"]), ("succeeded", {"deleted": True, "closed_positions": 1}))
+
+        client.force_authenticate(user)
+        self.assertEqual(client.get(reverse("jobs_detail", kwargs={"pk": job["id"]})).status_code, 404)
+        self.assertEqual(client.get(reverse("jobs")).json()["results"], [])
@@ -0,0 +1,9 @@
+from django.urls import path
+
+from jobs import views
+
+
+urlpatterns = [
+    path("", views.JobListAPIView.as_view(), name="jobs"),
+    path("<int:pk>/", views.JobDetailAPIView.as_view(), name="jobs_detail"),
+]
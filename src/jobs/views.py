@@ -0,0 +1,53 @@
+from rest_framework import status, permissions
+from rest_framework.generics import ListAPIView, GenericAPIView
+from rest_framework.response import Response
+
+from base.fieldsets import SparseFieldsetMixin
+from jobs.models import Job
+from jobs.serializers import JobSerializer
+
+
+def visible_jobs(user):
+    jobs = Job.objects.all()
+    return jobs if user.is_staff else jobs.filter(created_by_id=user.id)
+
+
+class JobListAPIView(SparseFieldsetMixin, ListAPIView):
+    serializer_class = JobSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return visible_jobs(self.request.user).order_by("-id")
+
+    def get(self, request, *args, **kwargs):
+        """
+        Get the background jobs queued by the user (all jobs for admins), newest first.
+
+        Args:
+            request (HttpRequest): The HTTP request object.
+
+        Returns:
+            Response: The HTTP response containing the serialized jobs.
+        """
+        return self.list(request, *args, **kwargs)
+
+
+class JobDetailAPIView(SparseFieldsetMixin, GenericAPIView):
+    serializer_class = JobSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, pk):
+        """
+        Get the status of a background job.
+
+        Args:
+            request (HttpRequest): The HTTP request object.
+            pk (str): The primary key of the job.
+
+        Returns:
+            Response: The HTTP response containing the serialized job.
+        """
+        job = self.project(visible_jobs(request.user).filter(pk=pk)).first()
+        if not job:
+            return Response({"message": "Job not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(self.get_serializer(job).data, status=status.HTTP_200_OK)
@@ -1,11 +1,89 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 
-from staking_app.models import UserWallet, UserPosition, StackingPool, PoolConditions
+from base.pagination import EstimatedCountPaginator
+from staking_app.jobs import delete_conditions, delete_pool
+from staking_app.models import UserWallet, UserPosition, StackingPool, PoolConditions, UnstakeRequest, close_positions
 
 
-admin.site.register(UserWallet)
-admin.site.register(UserPosition)
-admin.site.register(StackingPool)
-admin.site.register(PoolConditions)
+class ScalableModelAdmin(admin.ModelAdmin):
+    """Changelists that avoid `COUNT(*)` over whole tables."""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
+@admin.register(UserWallet)
+class UserWalletAdmin(ScalableModelAdmin):
+    list_display = ("id", "user", "balance")
+    list_select_related = ("user",)
+    raw_id_fields = ("user",)
+    search_fields = ("=user__username", "=user__email")
+
+
+@admin.register(UserPosition)
+class UserPositionAdmin(ScalableModelAdmin):
+    list_display = ("id", "user", "pool", "amount")
+    list_select_related = ("user", "pool__conditions")
+    raw_id_fields = ("user",)
+    autocomplete_fields = ("pool",)
+    search_fields = ("=user__username", "=user__email")
+    actions = ["refund_and_close"]
+
+    def get_actions(self, request):
+        # The default bulk delete skips UserPosition.delete() and would not refund the wallets
+        actions = super().get_actions(request)
+        actions.pop("delete_selected", None)
+        return actions
+
+    @admin.action(description="Refund and close selected positions", permissions=["delete"])
+    def refund_and_close(self, request, queryset):
+        closed = close_positions(queryset)
+        self.message_user(
+            request, f"Closed {closed} positions, their refunds are queued for settlement", messages.SUCCESS)
+
+
+@admin.register(StackingPool)
+class StackingPoolAdmin(ScalableModelAdmin):
+    list_display = ("id", "name", "conditions", "capacity")
+    list_select_related = ("conditions",)
+    raw_id_fields = ("conditions",)
+    search_fields = ("name",)
+    actions = ["refund_and_close_positions"]
+
+    def get_actions(self, request):
+        # Deleting a pool cascades to its positions without refunding them
+        actions = super().get_actions(request)
+        actions.pop("delete_selected", None)
+        return actions
+
+    def delete_model(self, request, obj):
+        # Same path as the API delete, run inline: the positions are refunded before the cascade
+        delete_pool(obj.pk)
+
+    @admin.action(description="Refund and close all positions of selected pools", permissions=["change"])
+    def refund_and_close_positions(self, request, queryset):
+        closed = close_positions(UserPosition.objects.filter(pool__in=queryset))
+        self.message_user(
+            request, f"Closed {closed} positions, their refunds are queued for settlement", messages.SUCCESS)
+
+
+@admin.register(PoolConditions)
+class PoolConditionsAdmin(ScalableModelAdmin):
+    list_display = ("id", "min_amount", "max_amount", "reward_rate")
+
+    def get_actions(self, request):
+        # Deleting conditions cascades to the pools using them and to their positions
+        actions = super().get_actions(request)
+        actions.pop("delete_selected", None)
+        return actions
+
+    def delete_model(self, request, obj):
+        delete_conditions(obj.pk)
+
+
+@admin.register(UnstakeRequest)
+class UnstakeRequestAdmin(ScalableModelAdmin):
+    list_display = ("id", "user", "pool", "amount", "closes_position", "status", "created_at", "settled_at")
+    list_select_related = ("user", "pool")
+    list_filter = ("status",)
+    raw_id_fields = ("user", "position", "pool")
+    search_fields = ("=user__username", "=user__email")
@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete
 
 
 class StakingAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'staking_app'
+
+    def ready(self):
+        from staking_app.snapshots import forget_deleted
+
+        post_delete.connect(forget_deleted, sender="staking_app.UserWallet")
+        post_delete.connect(forget_deleted, sender="staking_app.UserPosition")
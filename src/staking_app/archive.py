@@ -0,0 +1,208 @@
+"""
+Month-partitioned archive of closed positions.
+
+Closing a position deletes it from UserPosition and records it in ClosedPosition, a staging
+table that only holds what closed since the last run of the archiver. `archive` (the
+`archive_positions` job) moves the staged rows in batches to one table per calendar month of
+closing, `staking_app_positionarchive_YYYY_MM`, created on first use in the database
+STAKING_ARCHIVE_DATABASE. A batch is inserted into the archive before it is deleted from the
+staging table, and the archive tables are keyed by the original position id, so a batch cut
+by a crash is archived again without duplicates. Another position found under an archived id
+stops the archiver with `ArchiveConflictException` instead of being dropped, `snapshot_import`
+moves the position ids past the archived ones so that imports cannot cause it.
+
+The archive tables are not part of the migrations: their models are built at runtime by
+`partition`, in a registry of their own, and are only read through `archived_positions`, which
+also returns the positions of the month that are still staged.
+"""
+import re
+import threading
+from datetime import datetime
+
+from django.apps.registry import Apps
+from django.conf import settings
+from django.db import connections, models, transaction
+
+from staking_app.models import ClosedPosition
+from staking_app.money import MoneyField
+from staking_app.staking_exceptions import ArchiveConflictException
+
+TABLE_PREFIX = "staking_app_positionarchive_"
+TABLE_NAME = re.compile(rf"^{TABLE_PREFIX}(\d{{4}})_(\d{{2}})$")
+
+archive_apps = Apps()
+_partitions = {}
+_existing_tables = set()
+_lock = threading.Lock()
+
+
+def database():
+    return settings.STAKING_ARCHIVE_DATABASE
+
+
+def month_of(moment):
+    return moment.year, moment.month
+
+
+def partition(month):
+    """The model of the archive table of `month`, a (year, month) tuple."""
+    model = _partitions.get(month)
+    if model is not None:
+        return model
+    with _lock:
+        if month not in _partitions:
+            suffix = "%04d_%02d" % month
+            meta = type("Meta", (), {
+                "app_label": "staking_app",
+                "apps": archive_apps,
+                "db_table": TABLE_PREFIX + suffix,
+                "indexes": [models.Index(fields=["user_id", "-closed_at"], name=f"position_archive_{suffix}_user")],
+            })
+            _partitions[month] = type(f"ArchivedPosition{suffix}", (models.Model,), {
+                "__module__": __name__,
+                "Meta": meta,
+                "id": models.BigIntegerField(primary_key=True),
+                "user_id": models.BigIntegerField(),
+                "pool_id": models.BigIntegerField(),
+                "amount": MoneyField(),
+                "version": models.PositiveIntegerField(default=0),
+                "closed_at": models.DateTimeField(),
+                "archived_at": models.DateTimeField(auto_now_add=True),
+            })
+    return _partitions[month]
+
+
+def existing_months():
+    """The months that have an archive table, newest first."""
+    months = []
+    for table in connections[database()].introspection.table_names():
+        match = TABLE_NAME.match(table)
+        if match:
+            months.append((int(match[1]), int(match[2])))
+            _existing_tables.add(table)
+    return sorted(months, reverse=True)
+
+
+def table_exists(model):
+    table = model._meta.db_table
+    if table not in _existing_tables:
+        existing_months()
+    return table in _existing_tables
+
+
+def ensure_partition(month):
+    model = partition(month)
+    if not table_exists(model):
+        with connections[database()].schema_editor() as schema_editor:
+            schema_editor.create_model(model)
+        _existing_tables.add(model._meta.db_table)
+    return model
+
+
+def archive(batch_size=1000):
+    """Move the staged closed positions to the archive tables. Returns the number of positions moved."""
+    moved, last_pk = 0, None
+    while True:
+        staged = ClosedPosition.objects.order_by("pk")
+        if last_pk is not None:
+            staged = staged.filter(pk__gt=last_pk)
+        batch = list(staged[:batch_size])
+        if not batch:
+            return moved
+
+        by_month = {}
+        for row in batch:
+            by_month.setdefault(month_of(row.closed_at), []).append(row)
+        for month, rows in by_month.items():
+            model = ensure_partition(month)
+            with transaction.atomic(using=database()):
+                archived = {
+                    pk: rest for pk, *rest in model.objects.using(database()).filter(id__in=[row.pk for row in rows])
+                    .values_list("id", "user_id", "pool_id", "closed_at")
+                }
+                for row in rows:
+                    if row.pk in archived and archived[row.pk] != [row.user_id, row.pool_id, row.closed_at]:
+                        raise ArchiveConflictException(
+                            f"Position {row.pk} closed at {row.closed_at} cannot be archived, "
+                            f"{model._meta.db_table} holds another position with that id")
+                model.objects.using(database()).bulk_create([
+                    model(id=row.pk, user_id=row.user_id, pool_id=row.pool_id, amount=row.amount,
+                          version=row.version, closed_at=row.closed_at)
+                    for row in rows if row.pk not in archived  # archived already by a run cut by a crash
+                ])
+
+        last_pk = batch[-1].pk
+        ClosedPosition.objects.filter(pk__in=[row.pk for row in batch]).delete()
+        moved += len(batch)
+
+
+def highest_closed_id():
+    """The largest position id staged in ClosedPosition or archived, 0 when there are none."""
+    highest = ClosedPosition.objects.aggregate(highest=models.Max("id"))["highest"] or 0
+    for month in existing_months():
+        archived = partition(month).objects.using(database()).aggregate(highest=models.Max("id"))["highest"]
+        highest = max(highest, archived or 0)
+    return highest
+
+
+def parse_month(value):
+    """'YYYY-MM' to a (year, month) tuple, ValueError when it is not a month."""
+    moment = datetime.strptime(value, "%Y-%m")
+    return moment.year, moment.month
+
+
+class ClosedPositions:
+    """
+    The closed positions of a month as one sliceable sequence for the paginator: the rows still
+    staged in ClosedPosition first (they closed after the last run of the archiver), then the
+    archived ones.
+    """
+
+    def __init__(self, staged, archived):
+        self.staged = staged
+        self.archived = archived
+
+    def staged_count(self):
+        if not hasattr(self, "_staged_count"):
+            self._staged_count = self.staged.count()
+        return self._staged_count
+
+    def count(self):
+        return self.staged_count() + (self.archived.count() if self.archived is not None else 0)
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice) or index.step is not None:
+            raise TypeError("ClosedPositions only supports slices without a step")
+        start, stop = index.start or 0, index.stop if index.stop is not None else self.count()
+        staged = self.staged_count()
+        rows = list(self.staged[min(start, staged):min(stop, staged)])
+        if self.archived is not None and stop > staged:
+            rows += list(self.archived[max(start - staged, 0):stop - staged])
+        return rows
+
+
+def archived_positions(month, user_id=None, project=None):
+    """
+    The positions closed in `month`, staged or archived, newest first, of one user when `user_id`
+    is given. `project(queryset)` narrows the columns loaded from both tables.
+    """
+    project = project or (lambda queryset: queryset)
+    year, number = month
+    staged = ClosedPosition.objects.filter(closed_at__year=year, closed_at__month=number).annotate(
+        archived_at=models.Value(None, output_field=models.DateTimeField()))
+    if user_id is not None:
+        staged = staged.filter(user_id=user_id)
+    staged = project(staged.order_by("-closed_at", "-id"))
+
+    model = partition(month)
+    if not table_exists(model):
+        return ClosedPositions(staged, None)
+    archived = model.objects.using(database()).order_by("-closed_at", "-id")
+    if user_id is not None:
+        archived = archived.filter(user_id=user_id)
+    # A batch cut by a crash is in both tables until the next run of the archiver
+    archived = archived.exclude(id__in=list(staged.values_list("id", flat=True)))
+    return ClosedPositions(staged, project(archived))
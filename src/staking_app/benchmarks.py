@@ -0,0 +1,331 @@
+import io
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.apps.registry import Apps
+from django.conf import settings
+from django.core.management import call_command
+from django.db import OperationalError, close_old_connections, connection, models
+from django.db.models import Sum
+from django.test import override_settings
+from rest_framework import serializers
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from base.benchmarks import register, best_of, speedup
+from base.parsers import FastJSONParser
+from base.renderers import FastJSONRenderer, orjson
+from staking_app.models import PoolConditions, StackingPool, UserPosition, UserWallet
+from staking_app.money import MoneySerializerField, MoneySum
+from staking_app.serializers import UserPositionSerializer
+from staking_app.snapshot_file import SNAPSHOT_MODELS, export_snapshot, import_snapshot
+from staking_app.staking_exceptions import UserPositionException, PositionConflictException
+from users.models import User
+
+legacy_apps = Apps()
+
+
+class LegacyDecimalPosition(models.Model):
+    """The pre-base-unit layout of `UserPosition.amount`, kept only to compare against."""
+    pool_id = models.BigIntegerField(db_index=True)
+    amount = models.DecimalField(max_digits=20, decimal_places=10)
+
+    class Meta:
+        app_label = "benchmarks"
+        apps = legacy_apps
+
+
+def create_positions(rows, seed=0):
+    rng = random.Random(seed)
+    conditions = PoolConditions.objects.create(min_amount=1, max_amount=1_000_000)
+    pools = StackingPool.objects.bulk_create(
+        [StackingPool(name=f"Benchmark Pool {i}", conditions=conditions) for i in range(10)])
+    users = User.objects.bulk_create(
+        [User(username=f"benchmark{i}", email=f"benchmark{i}@example.com") for i in range(max(rows // 10, 1))])
+    amounts = [Decimal(rng.randrange(10 ** 10, 10 ** 14)).scaleb(-10) for _ in range(rows)]
+    UserPosition.objects.bulk_create(
+        [UserPosition(user=users[i % len(users)], pool=pools[i % len(pools)], amount=amount)
+         for i, amount in enumerate(amounts)],
+        batch_size=5000,
+    )
+    return pools, amounts
+
+
+@register("money.aggregation")
+def money_aggregation(options):
+    pools, amounts = create_positions(options["rows"])
+    with connection.schema_editor() as schema_editor:
+        schema_editor.create_model(LegacyDecimalPosition)
+    try:
+        LegacyDecimalPosition.objects.bulk_create(
+            [LegacyDecimalPosition(pool_id=pools[i % len(pools)].pk, amount=amount) for i, amount in enumerate(amounts)],
+            batch_size=5000,
+        )
+
+        def by_pool(model, aggregate=Sum):
+            return lambda: list(model.objects.values("pool_id").annotate(total=aggregate("amount")).order_by("pool_id"))
+
+        def fetch_amounts(model):
+            return lambda: list(model.objects.values_list("amount", flat=True))
+
+        decimal_sum = best_of(by_pool(LegacyDecimalPosition), options["repeat"])
+        units_sum = best_of(by_pool(UserPosition), options["repeat"])
+        units_money_sum = best_of(by_pool(UserPosition, MoneySum), options["repeat"])
+        decimal_fetch = best_of(fetch_amounts(LegacyDecimalPosition), options["repeat"])
+        units_fetch = best_of(fetch_amounts(UserPosition), options["repeat"])
+        exact_total = sum(amounts)
+        legacy_total = sum(row["total"] for row in by_pool(LegacyDecimalPosition)())
+        units_total = sum(row["total"] for row in by_pool(UserPosition)())
+    finally:
+        with connection.schema_editor() as schema_editor:
+            schema_editor.delete_model(LegacyDecimalPosition)
+
+    return [
+        ("rows", options["rows"]),
+        ("SUM by pool, decimal column (ms)", f"{decimal_sum * 1000:.2f}"),
+        ("SUM by pool, base-unit column (ms)", f"{units_sum * 1000:.2f}"),
+        ("SUM by pool speedup", speedup(decimal_sum, units_sum)),
+        ("MoneySum by pool, base-unit column (ms)", f"{units_money_sum * 1000:.2f}"),
+        ("fetch all amounts, decimal column (ms)", f"{decimal_fetch * 1000:.2f}"),
+        ("fetch all amounts, base-unit column (ms)", f"{units_fetch * 1000:.2f}"),
+        ("fetch speedup", speedup(decimal_fetch, units_fetch)),
+        ("decimal column total error", exact_total - legacy_total),
+        ("base-unit column total error", exact_total - units_total),
+    ]
+
+
+@register("money.serializers")
+def money_serializers(options):
+    create_positions(options["rows"])
+    amounts = list(UserPosition.objects.values_list("amount", flat=True))
+    decimal_field = serializers.DecimalField(max_digits=20, decimal_places=10)
+    money_field = MoneySerializerField()
+    assert all(decimal_field.to_representation(a) == money_field.to_representation(a) for a in amounts)
+
+    class LegacyUserPositionSerializer(serializers.ModelSerializer):
+        amount = serializers.DecimalField(max_digits=20, decimal_places=10)
+
+        class Meta:
+            model = UserPosition
+            fields = ["id", "user", "pool", "amount"]
+
+    positions = list(UserPosition.objects.all())
+
+    decimal_field_time = best_of(lambda: [decimal_field.to_representation(a) for a in amounts], options["repeat"])
+    money_field_time = best_of(lambda: [money_field.to_representation(a) for a in amounts], options["repeat"])
+    legacy_serializer_time = best_of(
+        lambda: LegacyUserPositionSerializer(positions, many=True).data, options["repeat"])
+    serializer_time = best_of(lambda: UserPositionSerializer(positions, many=True).data, options["repeat"])
+
+    return [
+        ("values", len(amounts)),
+        ("DecimalField.to_representation (ms)", f"{decimal_field_time * 1000:.2f}"),
+        ("MoneySerializerField.to_representation (ms)", f"{money_field_time * 1000:.2f}"),
+        ("field speedup", speedup(decimal_field_time, money_field_time)),
+        ("UserPositionSerializer, DecimalField (ms)", f"{legacy_serializer_time * 1000:.2f}"),
+        ("UserPositionSerializer, MoneySerializerField (ms)", f"{serializer_time * 1000:.2f}"),
+        ("serializer speedup", speedup(legacy_serializer_time, serializer_time)),
+    ]
+
+
+@register("json.renderers")
+def json_renderers(options):
+    create_positions(options["rows"])
+    data = UserPositionSerializer(UserPosition.objects.all(), many=True).data
+    rendered = JSONRenderer().render(data)
+    assert FastJSONRenderer().render(data) == rendered
+
+    render_time = best_of(lambda: JSONRenderer().render(data), options["repeat"])
+    fast_render_time = best_of(lambda: FastJSONRenderer().render(data), options["repeat"])
+    parse_time = best_of(lambda: JSONParser().parse(io.BytesIO(rendered)), options["repeat"])
+    fast_parse_time = best_of(lambda: FastJSONParser().parse(io.BytesIO(rendered)), options["repeat"])
+    return [
+        ("rows", len(data)),
+        ("payload (KiB)", f"{len(rendered) / 1024:.0f}"),
+        ("orjson", orjson.__version__ if orjson else "not installed"),
+        ("JSONRenderer (ms)", f"{render_time * 1000:.2f}"),
+        ("FastJSONRenderer (ms)", f"{fast_render_time * 1000:.2f}"),
+        ("render speedup", speedup(render_time, fast_render_time)),
+        ("JSONParser (ms)", f"{parse_time * 1000:.2f}"),
+        ("FastJSONParser (ms)", f"{fast_parse_time * 1000:.2f}"),
+        ("parse speedup", speedup(parse_time, fast_parse_time)),
+    ]
+
+
+def stake_with_retry(user_id, pool_id, amount):
+    """Open a position, retrying while the database is locked by a concurrent writer."""
+    while True:
+        try:
+            position = UserPosition(user=User.objects.get(pk=user_id), pool=StackingPool.objects.get(pk=pool_id),
+                                    amount=amount)
+            position.save()
+            return True
+        except UserPositionException:
+            return False
+        except OperationalError as e:
+            if "locked" not in str(e):
+                raise
+            time.sleep(0.001)
+        finally:
+            close_old_connections()
+
+
+def launch(conditions, shards, stakers, capacity, seed=0):
+    rng = random.Random(seed)
+    with override_settings(STAKING_CAPACITY_SHARDS=shards):
+        pool = StackingPool.objects.create(name=f"Launch Pool {shards}", conditions=conditions, capacity=capacity)
+        users = User.objects.bulk_create(
+            [User(username=f"launch{shards}_{i}", email=f"launch{shards}_{i}@example.com") for i in range(stakers)])
+        UserWallet.objects.bulk_create([UserWallet(user=user, balance=1000) for user in users])
+        amounts = [Decimal(rng.randrange(1, 100)) for _ in users]
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=LAUNCH_CONCURRENCY) as executor:
+            accepted = sum(executor.map(stake_with_retry, [user.pk for user in users], [pool.pk] * stakers, amounts))
+        elapsed = time.perf_counter() - started
+
+    staked = UserPosition.objects.filter(pool=pool).aggregate(total=MoneySum("amount"))["total"]
+    reserved = pool.capacity_shards.aggregate(total=MoneySum("reserved"))["total"]
+    assert staked <= capacity, f"pool oversubscribed: {staked} > {capacity}"
+    assert staked == reserved, f"reserved capacity drifted: {reserved} != {staked}"
+    return [
+        (f"{shards} shard(s): stakes accepted / rejected", f"{accepted} / {stakers - accepted}"),
+        (f"{shards} shard(s): staked / capacity", f"{staked.normalize():f} / {capacity}"),
+        (f"{shards} shard(s): stakes/s", f"{stakers / elapsed:.0f}"),
+    ]
+
+
+LAUNCH_CONCURRENCY = 16
+
+
+@register("staking.capacity_launch")
+def capacity_launch(options):
+    """Thousands of users stake into one capped pool at once; the pool must never be oversubscribed."""
+    stakers = max(options["rows"] // 10, 100)
+    capacity = stakers * 25  # about half of the demand fits
+    conditions = PoolConditions.objects.create(min_amount=1, max_amount=100)
+    return [
+        ("stakers", f"{stakers} ({LAUNCH_CONCURRENCY} concurrent)"),
+        *launch(conditions, 1, stakers, capacity),
+        *launch(conditions, settings.STAKING_CAPACITY_SHARDS, stakers, capacity),
+    ]
+
+
+CONTENTION_THREADS = 8
+
+
+def retry_locked(func, *args):
+    """Call `func`, retrying while the database is locked by a concurrent writer."""
+    while True:
+        try:
+            return func(*args)
+        except OperationalError as e:
+            if "locked" not in str(e):
+                raise
+            time.sleep(random.uniform(0, 0.005))
+        finally:
+            close_old_connections()
+
+
+def hammer(position_id, operations, apply):
+    """Run `operations` (signed amounts) against one position from CONTENTION_THREADS threads."""
+    applied, conflicts = [], []
+
+    def run(delta):
+        try:
+            retry_locked(apply, position_id, delta)
+            applied.append(delta)
+        except PositionConflictException:
+            conflicts.append(delta)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=CONTENTION_THREADS) as executor:
+        list(executor.map(run, operations))
+    return sum(applied), len(conflicts), time.perf_counter() - started
+
+
+def versioned_update(position_id, delta):
+    position = UserPosition.objects.select_related("user__wallet", "pool__conditions").get(pk=position_id)
+    if delta > 0:
+        position.increase_position(delta)
+    else:
+        position.decrease_position(-delta)
+
+
+def unversioned_update(position_id, delta):
+    """The previous read-modify-write of `increase_position` / `decrease_position`, without the wallet."""
+    position = UserPosition.objects.get(pk=position_id)
+    time.sleep(0)  # let other threads read the same amount, as a slower request would
+    UserPosition.objects.filter(pk=position_id).update(amount=position.amount + delta)
+
+
+@register("staking.position_contention")
+def position_contention(options):
+    """Concurrent increases and decreases of one position must add up exactly."""
+    rng = random.Random(0)
+    operations = [Decimal(rng.choice([1, -1]) * rng.randrange(1, 10)) for _ in range(max(options["rows"] // 20, 100))]
+    conditions = PoolConditions.objects.create(min_amount=1, max_amount=1_000_000)
+    pool = StackingPool.objects.create(name="Contention Pool", conditions=conditions)
+    user = User.objects.create(username="contention", email="contention@example.com")
+    user.wallet.replenish(1_000_000)
+    position = UserPosition(user=User.objects.get(pk=user.pk), pool=pool, amount=10_000)
+    position.save()
+
+    expected_total = 1_000_000  # the position was funded from the wallet
+    applied, conflicts, elapsed = hammer(position.pk, operations, versioned_update)
+    position.refresh_from_db()
+    wallet = UserWallet.objects.get(user=user)
+    assert position.amount == 10_000 + applied, f"lost updates: {position.amount} != {10_000 + applied}"
+    assert wallet.balance + position.amount == expected_total, "money was created or destroyed"
+
+    start_amount = position.amount
+    unversioned_applied, _, unversioned_elapsed = hammer(position.pk, operations, unversioned_update)
+    position.refresh_from_db()
+    return [
+        ("operations on one position", f"{len(operations)} ({CONTENTION_THREADS} threads)"),
+        ("versioned: operations/s", f"{len(operations) / elapsed:.0f}"),
+        ("versioned: rejected with 409 after retries", conflicts),
+        ("versioned: final amount error", 10_000 + applied - start_amount),
+        ("unversioned: operations/s", f"{len(operations) / unversioned_elapsed:.0f}"),
+        ("unversioned: final amount error (lost updates)", start_amount + unversioned_applied - position.amount),
+    ]
+
+
+def timed(func):
+    started = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - started
+
+
+@register("staking.snapshot")
+def snapshot_round_trip(options):
+    call_command("generate_load_data", users=options["rows"], pools=20, conditions=10, stdout=io.StringIO())
+
+    snapshot = io.BytesIO()
+    totals, export_time = timed(lambda: export_snapshot(snapshot))
+    rows = sum(totals.values())
+    call_command("flush", interactive=False, verbosity=0)
+    snapshot.seek(0)
+    _, import_time = timed(lambda: import_snapshot(snapshot))
+
+    with tempfile.TemporaryDirectory() as directory:
+        fixture = os.path.join(directory, "staking.json")
+        _, dumpdata_time = timed(lambda: call_command("dumpdata", *SNAPSHOT_MODELS, output=fixture))
+        fixture_size = os.path.getsize(fixture)
+        call_command("flush", interactive=False, verbosity=0)
+        _, loaddata_time = timed(lambda: call_command("loaddata", fixture, verbosity=0))
+    return [
+        ("rows", rows),
+        ("snapshot size / dumpdata JSON size (MiB)",
+         f"{snapshot.getbuffer().nbytes / 2 ** 20:.1f} / {fixture_size / 2 ** 20:.1f}"),
+        ("snapshot_export (rows/s)", f"{rows / export_time:.0f}"),
+        ("dumpdata (rows/s)", f"{rows / dumpdata_time:.0f}"),
+        ("export speedup", speedup(dumpdata_time, export_time)),
+        ("snapshot_import (rows/s)", f"{rows / import_time:.0f}"),
+        ("loaddata (rows/s)", f"{rows / loaddata_time:.0f}"),
+        ("import speedup", speedup(loaddata_time, import_time)),
+    ]
@@ -0,0 +1,49 @@
+"""Helpers for loading large amounts of rows with raw bulk inserts."""
+from contextlib import contextmanager
+
+from django.db import connection, transaction
+
+
+@contextmanager
+def deferred_constraints():
+    """Run a batch in one transaction with foreign key / deferrable constraint checks moved to commit."""
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            if connection.vendor == "sqlite":
+                cursor.execute("PRAGMA defer_foreign_keys = ON")
+            elif connection.vendor == "postgresql":
+                cursor.execute("SET CONSTRAINTS ALL DEFERRED")
+        yield
+
+
+def secondary_index_definitions(cursor, tables):
+    """(name, kind, DDL) of the indexes and triggers on `tables` that no constraint or primary key depends on."""
+    placeholders = ", ".join(["%s"] * len(tables))
+    if connection.vendor == "sqlite":
+        cursor.execute(
+            f"SELECT name, type, sql FROM sqlite_master "
+            f"WHERE type IN ('index', 'trigger') AND sql IS NOT NULL AND tbl_name IN ({placeholders})", tables)
+        return cursor.fetchall()
+    if connection.vendor == "postgresql":
+        cursor.execute(
+            f"SELECT indexname, 'index', indexdef FROM pg_indexes WHERE tablename IN ({placeholders}) "
+            f"AND indexname NOT IN (SELECT conname FROM pg_constraint)", tables)
+        return cursor.fetchall()
+    return []
+
+
+@contextmanager
+def deferred_indexes(tables):
+    """
+    Drop the secondary indexes (and, on SQLite, the triggers) of `tables` for the duration of a
+    bulk load and recreate them once all rows are in: building an index once is much cheaper
+    than updating it on every insert. Constraint indexes stay, so duplicates are still rejected.
+    """
+    with connection.cursor() as cursor:
+        definitions = secondary_index_definitions(cursor, list(tables))
+        for name, kind, _ in definitions:
+            cursor.execute(f"DROP {kind.upper()} {connection.ops.quote_name(name)}")
+    yield
+    with connection.cursor() as cursor:
+        for _, _, definition in definitions:
+            cursor.execute(definition)
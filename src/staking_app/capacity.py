@@ -0,0 +1,146 @@
+"""
+Total capacity limits of staking pools on sharded counters.
+
+A capped pool owns STAKING_CAPACITY_SHARDS `PoolCapacityShard` rows. Each shard holds a
+`quota` and the amount `reserved` against it, and the quotas of a pool always add up to its
+capacity. A stake reserves its amount on one randomly chosen shard with a conditional
+`UPDATE ... WHERE reserved + amount <= quota`, so concurrent stakes into a popular pool are
+spread over K rows instead of queueing on one, and the pool can never be oversubscribed.
+When no single shard has enough headroom left, the slow path locks every shard of the pool
+and moves the free quota to where it is needed.
+
+Reads (`reserved_amount`) sum the shards and are cached for STAKING_CAPACITY_CACHE_TTL seconds.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, models, transaction
+
+from staking_app.money import MoneySum, format_units, from_units, money_value, to_units
+from staking_app.staking_exceptions import PoolCapacityException
+
+
+def cache_key(pool_id):
+    return f"staking:pool-capacity:{pool_id}"
+
+
+def shards_of(pool_id):
+    from staking_app.models import PoolCapacityShard
+
+    return PoolCapacityShard.objects.filter(pool_id=pool_id)
+
+
+def pick_shard(queryset):
+    """Lock (where supported, skipping shards locked by other stakes) and return a random shard of `queryset`."""
+    if connection.features.has_select_for_update_skip_locked:
+        queryset = queryset.select_for_update(skip_locked=True)
+    return queryset.order_by("?").values_list("pk", flat=True).first()
+
+
+def reserve(pool, amount):
+    """Reserve `amount` of the capacity of `pool`, raise PoolCapacityException when it does not fit."""
+    if pool.capacity is None or amount <= 0:
+        return
+    value = money_value(amount)
+    # In a savepoint: compounding catches PoolCapacityException and goes on with the transaction
+    with transaction.atomic():
+        for _ in range(settings.STAKING_CAPACITY_SHARDS):
+            candidates = shards_of(pool.pk).filter(reserved__lte=models.F("quota") - value)
+            shard_id = pick_shard(candidates)
+            if shard_id is None:
+                break
+            # Conditional, so a concurrent reservation on the same shard cannot push it over its quota
+            if candidates.filter(pk=shard_id).update(reserved=models.F("reserved") + value):
+                return
+        rebalance_and_reserve(pool, amount)
+
+
+def rebalance_and_reserve(pool, amount):
+    shards = list(shards_of(pool.pk).select_for_update().order_by("shard"))
+    reserved = sum(to_units(shard.reserved) for shard in shards)
+    free = to_units(pool.capacity) - reserved - to_units(amount)
+    if not shards or free < 0:
+        available = max(to_units(pool.capacity) - reserved, 0)
+        raise PoolCapacityException(f"Pool capacity exceeded. Available capacity is {format_units(available)}")
+
+    shards[0].reserved = from_units(to_units(shards[0].reserved) + to_units(amount))
+    share, remainder = divmod(free, len(shards))
+    for index, shard in enumerate(shards):
+        shard.quota = from_units(to_units(shard.reserved) + share + (remainder if index == 0 else 0))
+    type(shards[0]).objects.bulk_update(shards, ["reserved", "quota"])
+
+
+def release(pool, amount):
+    """Give `amount` of reserved capacity back to `pool`, a no-op for pools without a capacity."""
+    if pool.capacity is None or amount <= 0:
+        return
+    value = money_value(amount)
+    with transaction.atomic(savepoint=False):
+        candidates = shards_of(pool.pk).filter(reserved__gte=value)
+        shard_id = pick_shard(candidates)
+        if shard_id is not None and candidates.filter(pk=shard_id).update(reserved=models.F("reserved") - value):
+            return
+
+        # The amount is spread over several shards: drain them in turn
+        remaining = to_units(amount)
+        shards = list(shards_of(pool.pk).select_for_update().order_by("-reserved"))
+        for shard in shards:
+            taken = min(to_units(shard.reserved), remaining)
+            shard.reserved = from_units(to_units(shard.reserved) - taken)
+            remaining -= taken
+        if shards:
+            type(shards[0]).objects.bulk_update(shards, ["reserved"])
+
+
+def configure(pool):
+    """
+    Create, resize or drop the shards of `pool` after its capacity changed.
+
+    The reserved total is carried over from the existing shards, or taken from the open
+    positions when the pool becomes capped. A capacity below the reserved total blocks new
+    stakes until enough capacity is released.
+    """
+    from staking_app.models import PoolCapacityShard, UserPosition
+
+    with transaction.atomic(savepoint=False):
+        shards = list(shards_of(pool.pk).select_for_update())
+        if pool.capacity is None:
+            shards_of(pool.pk).delete()
+            cache.delete(cache_key(pool.pk))
+            return
+        if shards and sum(to_units(shard.quota) for shard in shards) == to_units(pool.capacity):
+            return
+        if shards:
+            reserved = sum(to_units(shard.reserved) for shard in shards)
+        else:
+            total = UserPosition.objects.filter(pool_id=pool.pk).aggregate(total=MoneySum("amount"))["total"]
+            reserved = to_units(total or 0)
+
+        count = settings.STAKING_CAPACITY_SHARDS
+        share, remainder = divmod(max(to_units(pool.capacity) - reserved, 0), count)
+        shards_of(pool.pk).delete()
+        PoolCapacityShard.objects.bulk_create([
+            PoolCapacityShard(
+                pool_id=pool.pk,
+                shard=index,
+                reserved=from_units(reserved if index == 0 else 0),
+                quota=from_units((reserved if index == 0 else 0) + share + (remainder if index == 0 else 0)),
+            )
+            for index in range(count)
+        ])
+    cache.delete(cache_key(pool.pk))
+
+
+def reserved_amount(pool_id):
+    """Total reserved capacity of the pool, exact as of at most STAKING_CAPACITY_CACHE_TTL seconds ago."""
+    key = cache_key(pool_id)
+    reserved = cache.get(key)
+    if reserved is None:
+        reserved = shards_of(pool_id).aggregate(total=models.Sum("reserved"))["total"] or from_units(0)
+        cache.set(key, reserved, settings.STAKING_CAPACITY_CACHE_TTL)
+    return reserved
+
+
+def available_amount(pool):
+    if pool.capacity is None:
+        return None
+    return max(pool.capacity - reserved_amount(pool.pk), from_units(0))
@@ -0,0 +1,130 @@
+"""
+Auto-compounding of staking rewards.
+
+Once per epoch (STAKING_EPOCH_SECONDS) every position earns `amount * reward_rate` of its
+pool, which is restaked into the position up to `PoolConditions.max_amount`. The part above the
+max, or the whole reward when a capped pool is full, is paid to the wallet instead.
+
+Pools are compounded in parallel worker threads. Each worker walks the positions of its pool
+in id order, `chunk_size` at a time, and commits one transaction per chunk: a single
+`UPDATE ... CASE` for the positions, the wallet credits for the overflow, the outbox events and
+the advanced `CompoundingCheckpoint` of the pool. An interrupted run resumes after the last
+committed chunk and a position is never compounded twice in one epoch.
+"""
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections, connection, models, transaction
+from django.utils import timezone
+
+from staking_app import capacity, snapshots
+from staking_app.epochs import current_epoch
+from staking_app.models import CompoundingCheckpoint, OutboxEvent, StackingPool, UserPosition, credit_wallets
+from staking_app.money import MoneyField, format_amount, from_units, money_value, to_units
+from staking_app.staking_exceptions import PoolCapacityException
+
+
+def lock_checkpoint(pk):
+    """Lock and re-read a checkpoint, so two schedulers running at once cannot compound the same chunk."""
+    queryset = CompoundingCheckpoint.objects.filter(pk=pk)
+    if not connection.features.has_select_for_update:
+        # SQLite has no row locks: taking the database write lock first makes parallel workers
+        # wait for each other, instead of deadlocking when they upgrade from a read later
+        queryset.update(last_position_id=models.F("last_position_id"))
+    return queryset.select_for_update().get()
+
+
+def compound_pool(pool_id, epoch, chunk_size):
+    """Compound every position of the pool for `epoch`, resuming from its checkpoint. Returns the checkpoint."""
+    checkpoint, _ = CompoundingCheckpoint.objects.get_or_create(pool_id=pool_id, epoch=epoch)
+    if checkpoint.completed_at:
+        return checkpoint
+    pool = StackingPool.objects.select_related("conditions").get(pk=pool_id)
+    while True:
+        with transaction.atomic():
+            checkpoint = lock_checkpoint(checkpoint.pk)
+            if checkpoint.completed_at or not compound_chunk(pool, checkpoint, chunk_size):
+                break
+    if not checkpoint.completed_at:
+        checkpoint.completed_at = timezone.now()
+        checkpoint.save(update_fields=["completed_at"])
+    return checkpoint
+
+
+def compound_chunk(pool, checkpoint, chunk_size):
+    """Compound the next chunk of positions after the checkpoint, return False once the pool is done."""
+    rows = list(
+        UserPosition.objects.select_for_update()
+        .filter(pool_id=pool.pk, pk__gt=checkpoint.last_position_id)
+        .order_by("pk")
+        .values_list("pk", "user_id", "amount")[:chunk_size]
+    )
+    if not rows:
+        return False
+
+    rate = pool.conditions.reward_rate
+    max_units = to_units(pool.conditions.max_amount)
+    restaked, overflow = {}, defaultdict(int)
+    for pk, user_id, amount in rows:
+        units = to_units(amount)
+        reward = int(units * rate)  # rounded down to whole base units
+        if reward <= 0:
+            continue
+        new_units = min(units + reward, max(units, max_units))
+        if new_units != units:
+            restaked[pk] = (user_id, units, new_units)
+        if units + reward != new_units:
+            overflow[user_id] += units + reward - new_units
+
+    added = sum(new_units - units for _, units, new_units in restaked.values())
+    try:
+        # Rolled back to this savepoint on failure, the chunk transaction goes on without it
+        with transaction.atomic():
+            capacity.reserve(pool, from_units(added))
+    except PoolCapacityException:
+        # The pool is full: the whole reward of this chunk goes to the wallets
+        for user_id, units, new_units in restaked.values():
+            overflow[user_id] += new_units - units
+        restaked, added = {}, 0
+
+    if restaked:
+        UserPosition.objects.filter(pk__in=restaked).update(
+            amount=models.Case(
+                *[models.When(pk=pk, then=money_value(from_units(new_units)))
+                  for pk, (_, _, new_units) in restaked.items()],
+                output_field=MoneyField(),
+            ),
+            version=models.F("version") + 1,
+        )
+        snapshots.forget_on_commit(snapshots.position_key(pk) for pk in restaked)
+    overflow = {user_id: from_units(units) for user_id, units in overflow.items()}
+    events = credit_wallets(overflow)
+    events += [
+        OutboxEvent(user_id=user_id, kind=OutboxEvent.POSITION_CHANGED,
+                    payload={"position": pk, "pool": pool.pk, "amount": format_amount(from_units(new_units))})
+        for pk, (user_id, _, new_units) in restaked.items()
+    ]
+    OutboxEvent.objects.bulk_create(events)
+
+    checkpoint.last_position_id = rows[-1][0]
+    checkpoint.compounded = from_units(to_units(checkpoint.compounded) + added)
+    checkpoint.overflowed = checkpoint.overflowed + sum(overflow.values(), from_units(0))
+    checkpoint.save(update_fields=["last_position_id", "compounded", "overflowed"])
+    return True
+
+
+def compound(epoch=None, workers=4, chunk_size=1000, pool_ids=None):
+    """Compound all pools with a reward rate (or `pool_ids`) for `epoch` on `workers` threads."""
+    epoch = current_epoch() if epoch is None else epoch
+    pools = StackingPool.objects.filter(conditions__reward_rate__gt=0)
+    if pool_ids:
+        pools = pools.filter(pk__in=pool_ids)
+
+    def worker(pool_id):
+        try:
+            return compound_pool(pool_id, epoch, chunk_size)
+        finally:
+            close_old_connections()
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="compounding") as executor:
+        return list(executor.map(worker, pools.order_by("pk").values_list("pk", flat=True)))
@@ -0,0 +1,21 @@
+"""Staking epochs: consecutive STAKING_EPOCH_SECONDS long periods counted from the Unix epoch."""
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+
+
+def current_epoch():
+    return int(time.time() // settings.STAKING_EPOCH_SECONDS)
+
+
+def epoch_of(moment):
+    return int(moment.timestamp() // settings.STAKING_EPOCH_SECONDS)
+
+
+def epoch_start(epoch):
+    return datetime.fromtimestamp(epoch * settings.STAKING_EPOCH_SECONDS, tz=timezone.utc)
+
+
+def sleep_until_next_epoch():
+    time.sleep(settings.STAKING_EPOCH_SECONDS - time.time() % settings.STAKING_EPOCH_SECONDS)
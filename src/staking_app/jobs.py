@@ -0,0 +1,37 @@
+"""Background jobs of the staking app, run by `run_workers` (see `jobs.queue`)."""
+from django.db import transaction
+
+from jobs.queue import register
+from staking_app.models import PoolConditions, StackingPool, UserPosition, close_positions
+from staking_app.simulation import simulate
+
+
+@register("staking.delete_pool")
+def delete_pool(pool_id):
+    """Refund and close the positions of the pool, then delete it. Nothing to do when it is gone already."""
+    with transaction.atomic():
+        pool = StackingPool.objects.filter(pk=pool_id).first()
+        if pool is None:
+            return {"deleted": False}
+        closed = close_positions(pool.positions.all())
+        pool.delete()
+    return {"deleted": True, "closed_positions": closed}
+
+
+@register("staking.delete_conditions")
+def delete_conditions(conditions_id):
+    """Delete the conditions with the pools using them, their positions are refunded and closed first."""
+    with transaction.atomic():
+        conditions = PoolConditions.objects.filter(pk=conditions_id).first()
+        if conditions is None:
+            return {"deleted": False}
+        closed = close_positions(UserPosition.objects.filter(pool__conditions=conditions))
+        pools = StackingPool.objects.filter(conditions=conditions).count()
+        conditions.delete()
+    return {"deleted": True, "deleted_pools": pools, "closed_positions": closed}
+
+
+@register("staking.simulate_rewards")
+def simulate_rewards(scenarios, epochs, compound=False):
+    """Project the rewards of all positions under the scenarios, the result is kept on the job."""
+    return simulate(scenarios, epochs, compound=compound)
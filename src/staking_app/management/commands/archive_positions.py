@@ -0,0 +1,35 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from staking_app.archive import archive
+from staking_app.metrics import JOB_DURATION
+from staking_app.staking_exceptions import ArchiveConflictException
+
+
+class Command(BaseCommand):
+    help = "Move the closed positions to the monthly archive tables"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Positions moved per batch")
+        parser.add_argument("--loop", action="store_true",
+                            help="Keep running, archiving every STAKING_ARCHIVE_INTERVAL seconds")
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be at least 1")
+
+        while True:
+            started = time.perf_counter()
+            try:
+                with JOB_DURATION.time(job="archive_positions"):
+                    moved = archive(options["batch_size"])
+            except ArchiveConflictException as e:
+                raise CommandError(str(e))
+            if moved or not options["loop"]:
+                self.stdout.write(self.style.SUCCESS(
+                    f"Archived {moved} closed positions in {time.perf_counter() - started:.2f}s"))
+            if not options["loop"]:
+                return
+            time.sleep(settings.STAKING_ARCHIVE_INTERVAL)
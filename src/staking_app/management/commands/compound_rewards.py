@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from staking_app.compounding import compound
+from staking_app.epochs import current_epoch, sleep_until_next_epoch
+from staking_app.metrics import JOB_DURATION
+from staking_app.models import CompoundingCheckpoint
+
+
+class Command(BaseCommand):
+    help = "Restake the rewards of the current epoch into positions, pools are compounded in parallel"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--epoch", type=int, help="Epoch to compound (the current one by default)")
+        parser.add_argument("--workers", type=int, default=4, help="Pools compounded in parallel")
+        parser.add_argument("--chunk-size", type=int, default=1000, help="Positions updated per transaction")
+        parser.add_argument("--pool", type=int, action="append", dest="pools", help="Only these pools")
+        parser.add_argument("--loop", action="store_true", help="Keep running, compounding every new epoch")
+
+    def handle(self, *args, **options):
+        if options["workers"] < 1 or options["chunk_size"] < 1:
+            raise CommandError("--workers and --chunk-size must be at least 1")
+        if options["loop"] and options["epoch"] is not None:
+            raise CommandError("--loop always compounds the current epoch")
+
+        while True:
+            self.run(options["epoch"], options)
+            if not options["loop"]:
+                return
+            sleep_until_next_epoch()
+
+    def run(self, epoch, options):
+        epoch = current_epoch() if epoch is None else epoch
+        started = time.perf_counter()
+        with JOB_DURATION.time(job="compound_rewards"):
+            checkpoints = compound(epoch, options["workers"], options["chunk_size"], options["pools"])
+        for checkpoint in checkpoints:
+            self.stdout.write(
+                f"Pool {checkpoint.pool_id}: restaked {checkpoint.compounded}, "
+                f"paid to wallets {checkpoint.overflowed}")
+        pending = CompoundingCheckpoint.objects.filter(epoch=epoch, completed_at__isnull=True).count()
+        self.stdout.write(self.style.SUCCESS(
+            f"Epoch {epoch}: compounded {len(checkpoints)} pools in {time.perf_counter() - started:.2f}s"
+            + (f", {pending} unfinished" if pending else "")))
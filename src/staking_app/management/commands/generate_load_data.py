@@ -0,0 +1,144 @@
+import random
+import time
+from decimal import Decimal
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max
+from django.utils import timezone
+
+from staking_app import capacity
+from staking_app.bulk import deferred_constraints
+from staking_app.models import UserWallet, UserPosition, StackingPool, PoolConditions
+from staking_app.money import UNITS_PER_COIN, from_units, to_units
+from users.models import User
+
+
+def next_id(model):
+    return (model.objects.aggregate(max_id=Max("pk"))["max_id"] or 0) + 1
+
+
+class Command(BaseCommand):
+    help = "Generate a large, reproducible data set of users, wallets, pools, conditions and positions"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100_000)
+        parser.add_argument("--pools", type=int, default=50)
+        parser.add_argument("--conditions", type=int, default=20)
+        parser.add_argument("--positions-per-user", type=float, default=2.0,
+                            help="Mean number of positions per user (geometric distribution)")
+        parser.add_argument("--capped-pools", type=float, default=0.0,
+                            help="Share of the pools (0 to 1) that get a total capacity")
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--batch-size", type=int, default=10_000)
+        parser.add_argument("--password", default="load-test-password",
+                            help="Password of every generated user, hashed once")
+
+    def handle(self, *args, **options):
+        if options["users"] < 1 or options["pools"] < 1 or options["conditions"] < 1:
+            raise CommandError("--users, --pools and --conditions must be at least 1")
+        if not 0 <= options["capped_pools"] <= 1:
+            raise CommandError("--capped-pools must be between 0 and 1")
+
+        self.rng = random.Random(options["seed"])
+        self.batch_size = options["batch_size"]
+        self.started = time.perf_counter()
+
+        conditions = self.create_conditions(options["conditions"])
+        pools = self.create_pools(options["pools"], conditions, options["capped_pools"])
+        self.create_users_and_positions(options["users"], pools, options["positions_per_user"], options["password"])
+        self.reserve_capacity(pools)
+
+    def log(self, message):
+        self.stdout.write(self.style.SUCCESS(f"[{time.perf_counter() - self.started:8.1f}s] {message}"))
+
+    def create_conditions(self, count):
+        existing = set(PoolConditions.objects.values_list("min_amount", "max_amount"))
+        conditions = []
+        while len(conditions) < count:
+            min_amount = Decimal(self.rng.choice([1, 5, 10, 50, 100, 500, 1000]))
+            max_amount = min_amount * self.rng.choice([10, 20, 50, 100, 1000])
+            if (min_amount, max_amount) in existing:
+                min_amount += Decimal(self.rng.randrange(1, 10 ** 6)).scaleb(-6)
+            if (min_amount, max_amount) in existing:
+                continue
+            existing.add((min_amount, max_amount))
+            rate = Decimal(self.rng.randrange(1, 3000)).scaleb(-6)  # up to 0.3% per epoch
+            conditions.append(PoolConditions(min_amount=min_amount, max_amount=max_amount, reward_rate=rate))
+        with deferred_constraints():
+            conditions = PoolConditions.objects.bulk_create(conditions)
+        self.log(f"Created {len(conditions)} PoolConditions")
+        return conditions
+
+    def create_pools(self, count, conditions, capped_share):
+        first_id = next_id(StackingPool)
+        pools = [
+            StackingPool(id=first_id + i, name=f"Load Pool {first_id + i}", conditions=self.rng.choice(conditions))
+            for i in range(count)
+        ]
+        for index in self.rng.sample(range(count), round(count * capped_share)):
+            pools[index].capacity = pools[index].conditions.max_amount * self.rng.choice([100, 1000, 10_000])
+        with deferred_constraints():
+            StackingPool.objects.bulk_create(pools)
+        self.log(f"Created {len(pools)} StackingPools")
+        return pools
+
+    def create_users_and_positions(self, count, pools, positions_per_user, password):
+        # Pool popularity follows a Zipf-like curve: a few pools hold most of the positions
+        pool_weights = [1 / (rank + 1) for rank in range(len(pools))]
+        self.rng.shuffle(pool_weights)
+        cum_weights = list(accumulate(pool_weights))
+        # Users are inserted with bulk_create, which skips User.save() and its wallet round trip
+        password = make_password(password)
+        joined = timezone.now()
+        first_user_id = next_id(User)
+        next_position_id = next_id(UserPosition)
+        # Each extra position is kept with probability p, so the count is geometric with the requested mean
+        keep_probability = positions_per_user / (1 + positions_per_user)
+        created_positions = 0
+        # Staked units of the capped pools, positions that would overflow a pool are not created
+        staked = {pool.pk: 0 for pool in pools if pool.capacity is not None}
+
+        for batch_start in range(0, count, self.batch_size):
+            users, wallets, positions = [], [], []
+            for user_id in range(first_user_id + batch_start, first_user_id + min(batch_start + self.batch_size, count)):
+                users.append(User(
+                    id=user_id, username=f"load_user_{user_id}", email=f"load_user_{user_id}@example.com",
+                    password=password, date_joined=joined))
+
+                while self.rng.random() < keep_probability:
+                    pool = self.rng.choices(pools, cum_weights=cum_weights)[0]
+                    amount = self.position_amount(pool)
+                    if pool.pk in staked:
+                        if staked[pool.pk] + to_units(amount) > to_units(pool.capacity):
+                            continue
+                        staked[pool.pk] += to_units(amount)
+                    positions.append(UserPosition(
+                        id=next_position_id, user_id=user_id, pool_id=pool.pk, amount=amount))
+                    next_position_id += 1
+                # Balances are log-normal, most users keep a modest amount next to their stakes
+                balance = from_units(int(self.rng.lognormvariate(5, 1.5) * UNITS_PER_COIN))
+                wallets.append(UserWallet(user_id=user_id, balance=balance))
+
+            with deferred_constraints():
+                User.objects.bulk_create(users)
+                UserWallet.objects.bulk_create(wallets)
+                UserPosition.objects.bulk_create(positions)
+            created_positions += len(positions)
+            self.log(f"Created {batch_start + len(users)}/{count} users with wallets, {created_positions} positions")
+
+    def reserve_capacity(self, pools):
+        """Build the capacity shards of the capped pools from their positions, bulk inserts skip `reserve()`."""
+        capped = [pool for pool in pools if pool.capacity is not None]
+        for pool in capped:
+            capacity.configure(pool)
+        if capped:
+            self.log(f"Reserved the capacity of {len(capped)} capped StackingPools")
+
+    def position_amount(self, pool):
+        """Amounts cluster near the pool minimum with a long tail towards the maximum."""
+        min_units = to_units(pool.conditions.min_amount)
+        span = to_units(pool.conditions.max_amount) - min_units
+        fraction = min(self.rng.expovariate(6), 1.0)
+        return from_units(min_units + int(span * fraction))
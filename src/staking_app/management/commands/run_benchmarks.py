@@ -0,0 +1,37 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_databases, teardown_databases
+
+from base import benchmarks
+
+
+class Command(BaseCommand):
+    help = "Run the registered benchmarks against a throwaway test database"
+
+    def add_arguments(self, parser):
+        parser.add_argument("names", nargs="*", help="Benchmarks to run (all by default)")
+        parser.add_argument("--rows", type=int, default=10_000, help="Size of the generated data set")
+        parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement, the best one is reported")
+        parser.add_argument("--list", action="store_true", help="List the registered benchmarks")
+
+    def handle(self, *args, **options):
+        benchmarks.autodiscover()
+        if options["list"]:
+            for name in sorted(benchmarks.registry):
+                self.stdout.write(name)
+            return
+
+        names = options["names"] or sorted(benchmarks.registry)
+        unknown = set(names) - set(benchmarks.registry)
+        if unknown:
+            raise CommandError(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            for name in names:
+                self.stdout.write(self.style.MIGRATE_HEADING(name))
+                for label, value in benchmarks.registry[name](options):
+                    self.stdout.write(f"  {label:<48} {value}")
+                call_command("flush", interactive=False, verbosity=0)
+        finally:
+            teardown_databases(old_config, verbosity=0)
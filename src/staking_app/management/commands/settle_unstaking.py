@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from staking_app.epochs import current_epoch, sleep_until_next_epoch
+from staking_app.metrics import JOB_DURATION
+from staking_app.models import UnstakeRequest
+from staking_app.unstaking import settle
+
+
+class Command(BaseCommand):
+    help = "Credit the wallets of the unstake requests created before the current epoch"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000, help="Requests settled per transaction")
+        parser.add_argument("--loop", action="store_true", help="Keep running, settling at every new epoch")
+
+    def handle(self, *args, **options):
+        if options["chunk_size"] < 1:
+            raise CommandError("--chunk-size must be at least 1")
+
+        while True:
+            self.run(options["chunk_size"])
+            if not options["loop"]:
+                return
+            sleep_until_next_epoch()
+
+    def run(self, chunk_size):
+        epoch = current_epoch()
+        started = time.perf_counter()
+        with JOB_DURATION.time(job="settle_unstaking"):
+            settled = settle(epoch, chunk_size)
+        pending = UnstakeRequest.objects.filter(status=UnstakeRequest.PENDING).count()
+        self.stdout.write(self.style.SUCCESS(
+            f"Epoch {epoch}: settled {settled} unstake requests in {time.perf_counter() - started:.2f}s"
+            + (f", {pending} queued for the next epoch" if pending else "")))
@@ -0,0 +1,54 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from staking_app.simulation import simulate
+
+
+def parse_scenario(value):
+    """Parse `name:pool_id=rate,pool_id=rate` into a scenario dict."""
+    name, _, overrides = value.rpartition(":")
+    rates = {}
+    for override in filter(None, overrides.split(",")):
+        pool_id, _, rate = override.partition("=")
+        try:
+            rates[int(pool_id)] = float(rate)
+        except ValueError:
+            raise CommandError(f"Invalid rate override '{override}', expected pool_id=rate")
+    return {"name": name or value, "rates": rates}
+
+
+class Command(BaseCommand):
+    help = "Project staking rewards over N epochs for the current positions under several rate scenarios"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--epochs", type=int, default=30)
+        parser.add_argument("--compound", action="store_true", help="Restake rewards every epoch up to the pool max")
+        parser.add_argument(
+            "--scenario", action="append", default=[], type=parse_scenario,
+            help="Rate overrides as 'name:pool_id=rate,pool_id=rate', may be repeated")
+        parser.add_argument("--json", action="store_true", help="Print the full result as JSON")
+
+    def handle(self, *args, **options):
+        if options["epochs"] < 1:
+            raise CommandError("--epochs must be at least 1")
+
+        started = time.perf_counter()
+        result = simulate(options["scenario"], options["epochs"], compound=options["compound"])
+        elapsed = time.perf_counter() - started
+
+        if options["json"]:
+            self.stdout.write(json.dumps(result, indent=2))
+            return
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Projected {result['positions']} positions over {result['epochs']} epochs in {elapsed:.2f}s"))
+        for scenario in result["scenarios"]:
+            self.stdout.write(self.style.MIGRATE_HEADING(f"{scenario['name']}: {scenario['total_rewards']:.4f} total"))
+            for pool in scenario["pools"]:
+                self.stdout.write(f"  pool {pool['pool']}: staked {pool['staked']:.4f}, rewards {pool['rewards']:.4f}")
+            users = scenario["users"]
+            percentiles = ", ".join(f"{name} {value:.4f}" for name, value in users["percentiles"].items())
+            self.stdout.write(f"  per user ({users['count']}): mean {users['mean']:.4f}, {percentiles}, "
+                              f"max {users['max']:.4f}")
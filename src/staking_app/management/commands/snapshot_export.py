@@ -0,0 +1,30 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from staking_app.snapshot_file import export_snapshot
+
+
+class Command(BaseCommand):
+    help = "Write users, conditions, pools, wallets, positions and unstake requests to a compressed columnar file"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Snapshot file to create")
+        parser.add_argument("--chunk-size", type=int, default=10_000, help="Rows per block")
+        parser.add_argument("--level", type=int, default=6, choices=range(0, 10), metavar="0-9",
+                            help="zlib compression level")
+
+    def handle(self, *args, **options):
+        if options["chunk_size"] < 1:
+            raise CommandError("--chunk-size must be at least 1")
+        started = time.perf_counter()
+        with open(options["path"], "wb") as file:
+            totals = export_snapshot(file, options["chunk_size"], options["level"])
+        elapsed = time.perf_counter() - started
+        rows = sum(totals.values())
+        for table, count in totals.items():
+            self.stdout.write(f"{table}: {count} rows")
+        self.stdout.write(self.style.SUCCESS(
+            f"Exported {rows} rows in {elapsed:.2f}s ({rows / elapsed:.0f} rows/s), "
+            f"{os.path.getsize(options['path']) / 1024 / 1024:.1f} MiB"))
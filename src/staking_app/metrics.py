@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from base.metrics import Counter, Histogram, register_collector
+from staking_app.money import MoneySum
+
+WALLET_OPERATIONS = Counter("staking_wallet_operations_total", "Committed wallet balance changes", ["operation"])
+WALLET_OPERATION_AMOUNT = Counter(
+    "staking_wallet_operation_amount_total", "Amount moved by committed wallet balance changes", ["operation"])
+JOB_DURATION = Histogram(
+    "staking_job_duration_seconds", "Duration of the per-epoch staking jobs", ["job"],
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300, 600, 1800, 3600, float("inf")),
+)
+
+TVL_CACHE_KEY = "staking:metrics:tvl"
+
+
+def count_wallet_operation(operation, amount, operations=1):
+    WALLET_OPERATIONS.inc(operations, operation=operation)
+    WALLET_OPERATION_AMOUNT.inc(float(abs(amount)), operation=operation)
+
+
+@register_collector
+def pool_tvl():
+    """Total value locked per pool, summed over the positions at most METRICS_TVL_CACHE_TTL seconds ago."""
+    from staking_app.models import StackingPool
+
+    tvl = cache.get(TVL_CACHE_KEY)
+    if tvl is None:
+        pools = StackingPool.objects.annotate(tvl=MoneySum("positions__amount")).values_list("pk", "name", "tvl")
+        tvl = [({"pool": pk, "name": name}, float(total or 0)) for pk, name, total in pools]
+        cache.set(TVL_CACHE_KEY, tvl, settings.METRICS_TVL_CACHE_TTL)
+    return [("staking_pool_tvl", "gauge", "Total amount staked in the pool", tvl)]
@@ -0,0 +1,142 @@
+from django.core.management.base import CommandError
+from django.db import migrations, models
+
+import staking_app.money
+from staking_app.money import MAX_AMOUNT
+
+MONEY_FIELDS = {
+    "userwallet": ["balance"],
+    "userposition": ["amount"],
+    "poolconditions": ["min_amount", "max_amount"],
+}
+BATCH_SIZE = 1000
+MAX_REPORTED = 20
+
+
+def _check_range(apps):
+    """
+    Refuse to migrate amounts a money column cannot hold.
+
+    The old DecimalField(max_digits=20, decimal_places=10) columns accept up to about 1e10 coins,
+    the base-unit columns +/- MAX_AMOUNT (about 9.22e8). Rows beyond that are listed (model, pk,
+    column and value) before anything is copied, to be fixed by hand before migrating again.
+    """
+    out_of_range = []
+    for model_name, field_names in MONEY_FIELDS.items():
+        model = apps.get_model("staking_app", model_name)
+        # Whole coins in SQL to find the candidates, the exact comparison in Python: SQLite
+        # keeps decimals as floats, which cannot tell MAX_AMOUNT from its neighbours
+        candidates = models.Q()
+        for name in field_names:
+            candidates |= models.Q(**{f"{name}__gt": int(MAX_AMOUNT)}) | models.Q(**{f"{name}__lt": -int(MAX_AMOUNT)})
+        for pk, *values in model.objects.filter(candidates).order_by("pk").values_list("pk", *field_names):
+            out_of_range += [
+                f"{model.__name__}(pk={pk}).{name} = {value}"
+                for name, value in zip(field_names, values) if value is not None and abs(value) > MAX_AMOUNT
+            ]
+    if out_of_range:
+        listed = "\n".join(out_of_range[:MAX_REPORTED])
+        more = f"\n... and {len(out_of_range) - MAX_REPORTED} more" if len(out_of_range) > MAX_REPORTED else ""
+        raise CommandError(
+            f"{len(out_of_range)} money amounts are beyond the +/-{MAX_AMOUNT} coins integer base units can hold, "
+            f"fix them and migrate again:\n{listed}{more}"
+        )
+
+
+def _copy(apps, source_suffix, target_suffix):
+    for model_name, field_names in MONEY_FIELDS.items():
+        model = apps.get_model("staking_app", model_name)
+        batch = []
+        for obj in model.objects.only("pk", *(f"{name}{source_suffix}" for name in field_names)).iterator():
+            for name in field_names:
+                setattr(obj, f"{name}{target_suffix}", getattr(obj, f"{name}{source_suffix}"))
+            batch.append(obj)
+            if len(batch) >= BATCH_SIZE:
+                model.objects.bulk_update(batch, [f"{name}{target_suffix}" for name in field_names])
+                batch = []
+        if batch:
+            model.objects.bulk_update(batch, [f"{name}{target_suffix}" for name in field_names])
+
+
+def decimals_to_units(apps, schema_editor):
+    _check_range(apps)
+    _copy(apps, "", "_units")
+
+
+def units_to_decimals(apps, schema_editor):
+    _copy(apps, "_units", "")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("staking_app", "0002_outboxevent"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="userwallet",
+            name="balance_units",
+            field=staking_app.money.MoneyField(default=0),
+        ),
+        migrations.AddField(
+            model_name="userposition",
+            name="amount_units",
+            field=staking_app.money.MoneyField(default=0),
+        ),
+        migrations.AddField(
+            model_name="poolconditions",
+            name="min_amount_units",
+            field=staking_app.money.MoneyField(default=0),
+        ),
+        migrations.AddField(
+            model_name="poolconditions",
+            name="max_amount_units",
+            field=staking_app.money.MoneyField(default=0),
+        ),
+        # Nullable legacy columns keep the migration reversible: they are re-added empty and refilled
+        migrations.AlterField(
+            model_name="userwallet",
+            name="balance",
+            field=models.DecimalField(decimal_places=10, default=0, max_digits=20, null=True),
+        ),
+        migrations.AlterField(
+            model_name="userposition",
+            name="amount",
+            field=models.DecimalField(decimal_places=10, max_digits=20, null=True),
+        ),
+        migrations.AlterField(
+            model_name="poolconditions",
+            name="min_amount",
+            field=models.DecimalField(decimal_places=10, max_digits=20, null=True),
+        ),
+        migrations.AlterField(
+            model_name="poolconditions",
+            name="max_amount",
+            field=models.DecimalField(decimal_places=10, max_digits=20, null=True),
+        ),
+        migrations.RunPython(decimals_to_units, units_to_decimals),
+        migrations.RemoveField(model_name="userwallet", name="balance"),
+        migrations.RemoveField(model_name="userposition", name="amount"),
+        migrations.RemoveField(model_name="poolconditions", name="min_amount"),
+        migrations.RemoveField(model_name="poolconditions", name="max_amount"),
+        migrations.RenameField(model_name="userwallet", old_name="balance_units", new_name="balance"),
+        migrations.RenameField(model_name="userposition", old_name="amount_units", new_name="amount"),
+        migrations.RenameField(model_name="poolconditions", old_name="min_amount_units", new_name="min_amount"),
+        migrations.RenameField(model_name="poolconditions", old_name="max_amount_units", new_name="max_amount"),
+        migrations.AlterField(
+            model_name="userposition",
+            name="amount",
+            field=staking_app.money.MoneyField(),
+        ),
+        migrations.AlterField(
+            model_name="poolconditions",
+            name="min_amount",
+            field=staking_app.money.MoneyField(),
+        ),
+        migrations.AlterField(
+            model_name="poolconditions",
+            name="max_amount",
+            field=staking_app.money.MoneyField(),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('staking_app', '0003_money_base_units'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='poolconditions',
+            name='reward_rate',
+            field=models.DecimalField(decimal_places=10, default=0, max_digits=12),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:07
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('staking_app', '0004_poolconditions_reward_rate'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='userposition',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='positions', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='userposition',
+            index=models.Index(fields=['user', 'pool'], name='position_user_pool_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='poolconditions',
+            constraint=models.UniqueConstraint(fields=('min_amount', 'max_amount'), name='unique_pool_conditions_amounts'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+import staking_app.money
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('staking_app', '0005_position_indexes_conditions_constraint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stackingpool',
+            name='capacity',
+            field=staking_app.money.MoneyField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='PoolCapacityShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('reserved', staking_app.money.MoneyField(default=0)),
+                ('quota', staking_app.money.MoneyField(default=0)),
+                ('pool', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='capacity_shards', to='staking_app.stackingpool')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='poolcapacityshard',
+            constraint=models.UniqueConstraint(fields=('pool', 'shard'), name='unique_pool_capacity_shard'),
+        ),
+    ]
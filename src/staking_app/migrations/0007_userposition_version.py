@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('staking_app', '0006_pool_capacity_shards'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userposition',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
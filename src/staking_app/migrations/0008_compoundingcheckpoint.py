@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:32
+
+from django.db import migrations, models
+import django.db.models.deletion
+import staking_app.money
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('staking_app', '0007_userposition_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompoundingCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('epoch', models.PositiveIntegerField()),
+                ('last_position_id', models.BigIntegerField(default=0)),
+                ('compounded', staking_app.money.MoneyField(default=0)),
+                ('overflowed', staking_app.money.MoneyField(default=0)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('pool', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='compounding_checkpoints', to='staking_app.stackingpool')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='compoundingcheckpoint',
+            constraint=models.UniqueConstraint(fields=('pool', 'epoch'), name='unique_compounding_checkpoint'),
+        ),
+    ]
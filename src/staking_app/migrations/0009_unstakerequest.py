@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:35
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import staking_app.money
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('staking_app', '0008_compoundingcheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UnstakeRequest',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', staking_app.money.MoneyField()),
+                ('closes_position', models.BooleanField(default=False)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('settled', 'Settled')], default='pending', max_length=16)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('settled_at', models.DateTimeField(blank=True, null=True)),
+                ('pool', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='staking_app.stackingpool')),
+                ('position', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='unstake_requests', to='staking_app.userposition')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='unstake_requests', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'id'], name='unstake_status_id_idx'), models.Index(fields=['user', 'id'], name='unstake_user_id_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:54
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import staking_app.money
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('staking_app', '0009_unstakerequest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClosedPosition',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('amount', staking_app.money.MoneyField()),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('closed_at', models.DateTimeField(auto_now_add=True)),
+                ('pool', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='staking_app.stackingpool')),
+                ('user', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-19 19:13
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('staking_app', '0010_closedposition'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='stackingpool',
+            name='name',
+            field=models.CharField(max_length=255, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='userposition',
+            name='pool',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='positions', to='staking_app.stackingpool'),
+        ),
+        migrations.AlterField(
+            model_name='userwallet',
+            name='user',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='wallet', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -1,28 +1,65 @@
-from django.db import models
+import random
+import time
+from collections import defaultdict
 
-from staking_app.staking_exceptions import UserPositionException, PoolConditionsException
+from django.conf import settings
+from django.db import models, transaction, IntegrityError
+
+from staking_app import capacity, snapshots
+from staking_app.metrics import count_wallet_operation
+from staking_app.money import MoneyField, format_amount, money_value
+from staking_app.staking_exceptions import (
+    UserPositionException, PoolConditionsException, StackingPoolException, PositionVersionConflict,
+    PositionConflictException,
+)
 
 
 class UserWallet(models.Model):
     user = models.OneToOneField("users.User", on_delete=models.CASCADE, related_name="wallet")
-    balance = models.DecimalField(max_digits=20, decimal_places=10, default=0)
+    balance = MoneyField(default=0)
 
     def __str__(self):
         return f"ID:{self.pk} | Wallet of {self.user}"
 
     def replenish(self, amount):
-        self.balance += amount
-        self.save()
+        self.add_to_balance(amount, "replenish")
 
     def withdraw(self, amount):
-        self.balance -= amount
-        self.save()
+        self.add_to_balance(-amount, "withdraw")
+
+    def add_to_balance(self, amount, operation="adjust"):
+        # Applied in SQL, so concurrent updates of the same wallet cannot overwrite each other
+        with transaction.atomic(savepoint=False):
+            UserWallet.objects.filter(pk=self.pk).update(balance=models.F("balance") + money_value(amount))
+            self.refresh_from_db(fields=["balance"])
+            self.emit_changed()
+            transaction.on_commit(lambda: count_wallet_operation(operation, amount))
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        snapshots.forget_on_commit([snapshots.wallet_key(self.pk)])
+
+    def emit_changed(self):
+        event = OutboxEvent.objects.create(
+            user_id=self.user_id,
+            kind=OutboxEvent.WALLET_CHANGED,
+            payload={"wallet": self.pk, "balance": format_amount(self.balance)},
+        )
+        snapshots.store_on_commit(snapshots.wallet_key(self.pk), snapshots.wallet_data(self), event.pk)
+        return event
 
 
 class UserPosition(models.Model):
-    user = models.ForeignKey("users.User", on_delete=models.CASCADE, related_name="positions")
+    # Lookups by user are served by the (user, pool) index below
+    user = models.ForeignKey("users.User", on_delete=models.CASCADE, related_name="positions", db_index=False)
     pool = models.ForeignKey('StackingPool', on_delete=models.CASCADE, related_name="positions")
-    amount = models.DecimalField(max_digits=20, decimal_places=10)
+    amount = MoneyField()
+    version = models.PositiveIntegerField(default=0)  # bumped by every compare-and-swap update
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "pool"], name="position_user_pool_idx"),
+        ]
 
     def __str__(self):
         return f"ID:{self.pk} | {self.user} - {self.amount}"
@@ -33,11 +70,29 @@ class UserPosition(models.Model):
         if self.amount < self.pool.conditions.min_amount:
             raise UserPositionException(f"Amount too small. Min amount is {self.pool.conditions.min_amount}")
 
-        if not self.pk:  # check if this is a new position, then withdraw the amount
-            if self.user.wallet.balance < self.amount:
-                raise UserPositionException(f"User balance too low. User balance is {self.user.wallet.balance}")
-            self.user.wallet.withdraw(self.amount)
-        super().save(*args, **kwargs)
+        # Not savepoint=False: the batch endpoint catches the exceptions raised here inside its transaction
+        with transaction.atomic():
+            if not self.pk:  # check if this is a new position, then withdraw the amount
+                if self.user.wallet.balance < self.amount:
+                    raise UserPositionException(f"User balance too low. User balance is {self.user.wallet.balance}")
+                self.user.wallet.withdraw(self.amount)
+                capacity.reserve(self.pool, self.amount)
+            else:
+                self.version += 1  # a plain save still invalidates concurrent compare-and-swap updates
+            super().save(*args, **kwargs)
+            self.emit_event(OutboxEvent.POSITION_CHANGED)
+
+    def emit_event(self, kind):
+        event = OutboxEvent.objects.create(
+            user_id=self.user_id,
+            kind=kind,
+            payload={"position": self.pk, "pool": self.pool_id, "amount": format_amount(self.amount)},
+        )
+        if kind == OutboxEvent.POSITION_CLOSED:
+            snapshots.forget_on_commit([snapshots.position_key(self.pk)])
+        else:
+            snapshots.store_on_commit(snapshots.position_key(self.pk), snapshots.position_data(self), event.pk)
+        return event
 
     def calculate_profit(self):
         pass
@@ -45,55 +100,204 @@ class UserPosition(models.Model):
     def increase_position(self, amount):
         if amount <= 0:
             raise UserPositionException("Amount to increase must be greater than 0")
-        if (amount + self.amount) > self.pool.conditions.max_amount:
-            raise UserPositionException(f"Effective amount too large. Max amount is {self.pool.conditions.max_amount}")
-        if (amount + self.amount) < self.pool.conditions.min_amount:
-            raise UserPositionException(f"Effective amount too small. Min amount is {self.pool.conditions.min_amount}")
-        user = self.user
-        if user.wallet.balance < self.amount:
-            raise UserPositionException(f"User balance too low. User balance is {user.wallet.balance}")
-        self.user.wallet.withdraw(amount)
-        self.amount += amount
-        self.save()
+
+        def increase():
+            if (amount + self.amount) > self.pool.conditions.max_amount:
+                raise UserPositionException(
+                    f"Effective amount too large. Max amount is {self.pool.conditions.max_amount}")
+            if (amount + self.amount) < self.pool.conditions.min_amount:
+                raise UserPositionException(
+                    f"Effective amount too small. Min amount is {self.pool.conditions.min_amount}")
+            user = self.user
+            if user.wallet.balance < self.amount:
+                raise UserPositionException(f"User balance too low. User balance is {user.wallet.balance}")
+            with transaction.atomic():
+                self.user.wallet.withdraw(amount)
+                capacity.reserve(self.pool, amount)
+                self.compare_and_swap(self.amount + amount)
+
+        self.retry_on_conflict(increase)
         return True
 
     def decrease_position(self, amount):
         if amount <= 0:
             raise UserPositionException("Amount to decrease must be greater than 0")
-        if (self.amount - amount) < self.pool.conditions.min_amount:
-            raise UserPositionException(
-                f"Effective amount too small. Min amount is {self.pool.conditions.min_amount}")
-        if (self.amount + amount) > self.pool.conditions.max_amount:
-            raise UserPositionException(
-                f"Effective amount too large. Max amount is {self.pool.conditions.max_amount}")
-
-        self.user.wallet.replenish(amount)
-        self.amount -= amount
-        self.save()
+
+        def decrease():
+            if (self.amount - amount) < self.pool.conditions.min_amount:
+                raise UserPositionException(
+                    f"Effective amount too small. Min amount is {self.pool.conditions.min_amount}")
+            if (self.amount + amount) > self.pool.conditions.max_amount:
+                raise UserPositionException(
+                    f"Effective amount too large. Max amount is {self.pool.conditions.max_amount}")
+            with transaction.atomic():
+                UnstakeRequest.objects.create(user_id=self.user_id, position=self, pool_id=self.pool_id, amount=amount)
+                capacity.release(self.pool, amount)
+                self.compare_and_swap(self.amount - amount)
+
+        self.retry_on_conflict(decrease)
         return True
 
+    def compare_and_swap(self, amount):
+        """Store the new amount only if the row still has the version this instance was read at."""
+        updated = UserPosition.objects.filter(pk=self.pk, version=self.version).update(
+            amount=amount, version=models.F("version") + 1)
+        if not updated:
+            raise PositionVersionConflict(self.pk)
+        self.amount = amount
+        self.version += 1
+        self.emit_event(OutboxEvent.POSITION_CHANGED)
+
+    def retry_on_conflict(self, change):
+        """
+        Run `change` (validation and a `compare_and_swap` in a savepoint) until it wins the race,
+        re-reading the position and the wallet after every lost one. Raises
+        PositionConflictException after STAKING_POSITION_UPDATE_RETRIES retries.
+        """
+        retries = settings.STAKING_POSITION_UPDATE_RETRIES
+        for attempt in range(retries + 1):
+            try:
+                return change()
+            except PositionVersionConflict:
+                if attempt == retries:
+                    raise PositionConflictException(
+                        "Position was modified concurrently, please retry") from None
+                time.sleep(random.uniform(0, settings.STAKING_POSITION_RETRY_BACKOFF * (attempt + 1)))
+                self.refresh_from_db(fields=["amount", "version"])
+                self.user.wallet.refresh_from_db(fields=["balance"])
+
     def money_back(self):
-        self.user.wallet.replenish(self.amount)
+        """Queue the refund of the whole position, the wallet is credited when the unstaking queue is settled."""
+        return UnstakeRequest.objects.create(
+            user_id=self.user_id, position=self, pool_id=self.pool_id, amount=self.amount, closes_position=True)
 
     def delete(self, using=None, keep_parents=False):
-        self.money_back()
-        return super().delete()
+        with transaction.atomic(savepoint=False):
+            self.money_back()
+            capacity.release(self.pool, self.amount)
+            self.emit_event(OutboxEvent.POSITION_CLOSED)
+            ClosedPosition.objects.create(
+                id=self.pk, user_id=self.user_id, pool_id=self.pool_id, amount=self.amount, version=self.version)
+            return super().delete()
 
     def check_blockchain_status(self):
         pass
 
 
+def credit_wallets(amounts, chunk_size=500):
+    """
+    Add `amounts` ({user_id: amount}) to the wallets of those users with one `UPDATE ... CASE`
+    per chunk of users. Returns the unsaved WALLET_CHANGED outbox events for the caller to bulk insert.
+    """
+    events = []
+    user_ids = list(amounts)
+    for start in range(0, len(user_ids), chunk_size):
+        chunk = user_ids[start:start + chunk_size]
+        UserWallet.objects.filter(user_id__in=chunk).update(balance=models.F("balance") + models.Case(
+            *[models.When(user_id=user_id, then=money_value(amounts[user_id])) for user_id in chunk],
+            output_field=MoneyField(),
+        ))
+        events += [
+            OutboxEvent(user_id=user_id, kind=OutboxEvent.WALLET_CHANGED,
+                        payload={"wallet": wallet_id, "balance": format_amount(balance)})
+            for wallet_id, user_id, balance in
+            UserWallet.objects.filter(user_id__in=chunk).values_list("pk", "user_id", "balance")
+        ]
+    snapshots.forget_on_commit(snapshots.wallet_key(event.payload["wallet"]) for event in events)
+    if amounts:
+        total = sum(amounts.values())
+        transaction.on_commit(lambda: count_wallet_operation("credit", total, len(amounts)))
+    return events
+
+
+def close_positions(positions, chunk_size=500):
+    """
+    Queue the refund of every position of the `positions` queryset and delete them with set-based queries.
+
+    Equivalent of calling `UserPosition.delete()` on each of them: the pending `UnstakeRequest`
+    rows (credited to the wallets when the unstaking queue is settled), the outbox rows and the
+    `ClosedPosition` rows are bulk inserted and the positions are removed with one `DELETE` per
+    chunk. Returns the number of closed positions.
+    """
+    with transaction.atomic(savepoint=False):
+        closed = list(positions.order_by().select_for_update().values_list(
+            "pk", "user_id", "pool_id", "amount", "version"))
+        released = defaultdict(int)
+        for _, _, pool_id, amount, _ in closed:
+            released[pool_id] += amount
+        for pool in StackingPool.objects.filter(pk__in=released, capacity__isnull=False):
+            capacity.release(pool, released[pool.pk])
+
+        UnstakeRequest.objects.bulk_create([
+            UnstakeRequest(user_id=user_id, position_id=pk, pool_id=pool_id, amount=amount, closes_position=True)
+            for pk, user_id, pool_id, amount, _ in closed
+        ], batch_size=chunk_size)
+        OutboxEvent.objects.bulk_create([
+            OutboxEvent(user_id=user_id, kind=OutboxEvent.POSITION_CLOSED,
+                        payload={"position": pk, "pool": pool_id, "amount": format_amount(amount)})
+            for pk, user_id, pool_id, amount, _ in closed
+        ], batch_size=chunk_size)
+        ClosedPosition.objects.bulk_create([
+            ClosedPosition(id=pk, user_id=user_id, pool_id=pool_id, amount=amount, version=version)
+            for pk, user_id, pool_id, amount, version in closed
+        ], batch_size=chunk_size)
+
+        position_ids = [row[0] for row in closed]
+        for start in range(0, len(position_ids), chunk_size):
+            UserPosition.objects.filter(pk__in=position_ids[start:start + chunk_size]).delete()
+    return len(closed)
+
+
 class StackingPool(models.Model):
     name = models.CharField(max_length=255, unique=True)
     conditions = models.ForeignKey('PoolConditions', on_delete=models.CASCADE)
+    capacity = MoneyField(null=True, blank=True)  # total amount that can be staked, unlimited when empty
 
     def __str__(self):
         return f"ID:{self.pk} | {self.name} | {self.conditions.min_amount} - {self.conditions.max_amount}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        pool = super().from_db(db, field_names, values)
+        # Capacity as loaded (DEFERRED when unknown), saving a pool that stays uncapped skips the shards
+        pool._loaded_capacity = dict(zip(field_names, values)).get("capacity", models.DEFERRED)
+        return pool
+
+    def save(self, *args, **kwargs):
+        if self.capacity is not None and self.capacity <= 0:
+            raise StackingPoolException("Capacity must be greater than 0")
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+            if self.capacity is not None or getattr(self, "_loaded_capacity", None) is not None:
+                capacity.configure(self)
+            self._loaded_capacity = self.capacity
+
+
+class PoolCapacityShard(models.Model):
+    """One of the counter rows the total capacity of a capped pool is split over, see `staking_app.capacity`."""
+    pool = models.ForeignKey(StackingPool, on_delete=models.CASCADE, related_name="capacity_shards")
+    shard = models.PositiveSmallIntegerField()
+    reserved = MoneyField(default=0)
+    quota = MoneyField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["pool", "shard"], name="unique_pool_capacity_shard"),
+        ]
+
+    def __str__(self):
+        return f"ID:{self.pk} | Pool {self.pool_id} shard {self.shard} | {self.reserved} / {self.quota}"
+
 
 class PoolConditions(models.Model):
-    min_amount = models.DecimalField(max_digits=20, decimal_places=10)
-    max_amount = models.DecimalField(max_digits=20, decimal_places=10)
+    min_amount = MoneyField()
+    max_amount = MoneyField()
+    reward_rate = models.DecimalField(max_digits=12, decimal_places=10, default=0)  # reward per epoch
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["min_amount", "max_amount"], name="unique_pool_conditions_amounts"),
+        ]
 
     def __str__(self):
         return f"ID:{self.pk} | {self.min_amount} - {self.max_amount}"
@@ -105,8 +309,111 @@ class PoolConditions(models.Model):
             raise PoolConditionsException(f"Min amount must be greater than 0")
         if self.max_amount <= 0:
             raise PoolConditionsException(f"Max amount must be greater than 0")
-        if PoolConditions.objects.filter(
-                min_amount=self.min_amount,
-                max_amount=self.max_amount).exclude(pk=self.pk).exists():
+        try:
+            with transaction.atomic():
+                super().save()
+        except IntegrityError:
             raise PoolConditionsException("Pool Conditions with these values already exist")
-        super().save()
+
+
+class UnstakeRequest(models.Model):
+    """
+    Amount taken out of a position and waiting for the wallet credit.
+
+    Decreases and closes only record a request, the `settle_unstaking` job credits the wallets of
+    all requests of an epoch in one batch at the start of the next one (see `staking_app.unstaking`).
+    """
+    PENDING = "pending"
+    SETTLED = "settled"
+
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (SETTLED, "Settled"),
+    ]
+
+    user = models.ForeignKey("users.User", on_delete=models.CASCADE, related_name="unstake_requests")
+    position = models.ForeignKey(UserPosition, on_delete=models.SET_NULL, null=True, blank=True,
+                                 related_name="unstake_requests")
+    pool = models.ForeignKey(StackingPool, on_delete=models.SET_NULL, null=True, blank=True)
+    amount = MoneyField()
+    closes_position = models.BooleanField(default=False)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    created_at = models.DateTimeField(auto_now_add=True)
+    settled_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "id"], name="unstake_status_id_idx"),  # the queue, in order
+            models.Index(fields=["user", "id"], name="unstake_user_id_idx"),
+        ]
+
+    def __str__(self):
+        return f"ID:{self.pk} | {self.amount} to {self.user_id} | {self.status}"
+
+
+class ClosedPosition(models.Model):
+    """
+    Position closed since the last run of the archiver, keeping the id it had in UserPosition.
+
+    Closing a position deletes it from the hot UserPosition table and records it here, the
+    `archive_positions` job moves these rows in batches to the monthly archive tables (see
+    `staking_app.archive`). Users and pools are not foreign keys: the history outlives them.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey("users.User", on_delete=models.DO_NOTHING, db_constraint=False, related_name="+")
+    pool = models.ForeignKey(StackingPool, on_delete=models.DO_NOTHING, db_constraint=False, related_name="+")
+    amount = MoneyField()  # staked when the position was closed, refunded through the unstaking queue
+    version = models.PositiveIntegerField(default=0)
+    closed_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"ID:{self.pk} | {self.amount} of {self.user_id} closed {self.closed_at}"
+
+
+class CompoundingCheckpoint(models.Model):
+    """Progress of reward compounding of one pool for one epoch, see `staking_app.compounding`."""
+    pool = models.ForeignKey(StackingPool, on_delete=models.CASCADE, related_name="compounding_checkpoints")
+    epoch = models.PositiveIntegerField()
+    last_position_id = models.BigIntegerField(default=0)  # positions up to this id are compounded
+    compounded = MoneyField(default=0)
+    overflowed = MoneyField(default=0)  # rewards paid to wallets because positions hit the pool max
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["pool", "epoch"], name="unique_compounding_checkpoint"),
+        ]
+
+    def __str__(self):
+        return f"ID:{self.pk} | Pool {self.pool_id} epoch {self.epoch} | up to position {self.last_position_id}"
+
+
+class OutboxEvent(models.Model):
+    """
+    Transactional outbox of wallet and position changes.
+
+    Rows are written in the same transaction as the mutation they describe and are
+    read by the per-process broadcaster that feeds the `stream/` endpoint.
+    """
+    WALLET_CHANGED = "wallet.changed"
+    POSITION_CHANGED = "position.changed"
+    POSITION_CLOSED = "position.closed"
+
+    KIND_CHOICES = [
+        (WALLET_CHANGED, "Wallet changed"),
+        (POSITION_CHANGED, "Position changed"),
+        (POSITION_CLOSED, "Position closed"),
+    ]
+
+    user = models.ForeignKey("users.User", on_delete=models.CASCADE, related_name="outbox_events")
+    kind = models.CharField(max_length=32, choices=KIND_CHOICES)
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "id"], name="outbox_user_id_idx"),
+        ]
+
+    def __str__(self):
+        return f"ID:{self.pk} | {self.kind} for user {self.user_id}"
@@ -0,0 +1,150 @@
+from decimal import Decimal, ROUND_HALF_EVEN
+
+from django import forms
+from django.db import models
+from django.db.models import Sum
+from rest_framework import serializers
+
+SCALE = 10
+UNITS_PER_COIN = 10 ** SCALE
+QUANTUM = Decimal(1).scaleb(-SCALE)
+MAX_UNITS = 2 ** 63 - 1
+MAX_AMOUNT = Decimal(MAX_UNITS).scaleb(-SCALE)  # largest amount a money column can hold, in coins
+
+
+def to_units(value):
+    """
+    Convert an amount (Decimal, int, str or float) to integer base units, rounding half-even
+    to `SCALE` decimal places.
+    """
+    if isinstance(value, int):
+        return value * UNITS_PER_COIN
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value))
+    return int(value.quantize(QUANTUM, rounding=ROUND_HALF_EVEN).scaleb(SCALE))
+
+
+def from_units(units):
+    """Convert integer base units to an exact Decimal with `SCALE` decimal places."""
+    return Decimal(units).scaleb(-SCALE)
+
+
+def format_units(units):
+    """Render integer base units as a fixed-point string without going through Decimal."""
+    sign = "-" if units < 0 else ""
+    whole, fraction = divmod(abs(units), UNITS_PER_COIN)
+    return f"{sign}{whole}.{fraction:0{SCALE}d}"
+
+
+def format_amount(value):
+    """Render an amount the way the API renders money: fixed-point with `SCALE` decimal places."""
+    if isinstance(value, Decimal) and value.as_tuple().exponent == -SCALE:
+        return f"{value:f}"
+    return format_units(to_units(value))
+
+
+def money_value(amount):
+    """Wrap a Python amount for use in ORM expressions against money columns, e.g. `F("balance") + money_value(x)`."""
+    return models.Value(amount, output_field=MoneyField())
+
+
+class MoneyField(models.BigIntegerField):
+    """
+    Money amount stored as a BIGINT of base units (1 unit = 10**-SCALE).
+
+    Python code keeps working with Decimal values, while the database compares and aggregates
+    plain integers. The range is +/- MAX_UNITS base units (about 922 million coins), which
+    also bounds the result of SUM() over a money column.
+    """
+    description = "Money amount stored as integer base units"
+
+    @property
+    def validators(self):
+        # IntegerField range validators compare against base units, the Python value is in coins
+        return [*self.default_validators, *self._validators]
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return value
+        if isinstance(value, str):  # "whole:fraction" pair produced by MoneySum on SQLite
+            whole, fraction = value.split(":")
+            value = int(whole) * UNITS_PER_COIN + int(fraction)
+        return from_units(value)
+
+    def to_python(self, value):
+        if value is None or isinstance(value, Decimal):
+            return value
+        try:
+            return Decimal(str(value))
+        except ArithmeticError:
+            raise forms.ValidationError(self.error_messages["invalid"], code="invalid", params={"value": value})
+
+    def get_prep_value(self, value):
+        if value is None or hasattr(value, "resolve_expression"):
+            return value
+        units = to_units(value)
+        if abs(units) > MAX_UNITS:
+            raise ValueError(f"Amount {value} is out of the supported money range")
+        return units
+
+    def formfield(self, **kwargs):
+        return models.Field.formfield(self, **{
+            "form_class": forms.DecimalField,
+            "max_digits": 19,
+            "decimal_places": SCALE,
+            "max_value": MAX_AMOUNT,
+            "min_value": -MAX_AMOUNT,
+            **kwargs,
+        })
+
+
+class MoneySerializerField(serializers.DecimalField):
+    """
+    API-compatible replacement for `DecimalField(max_digits=20, decimal_places=10)`.
+
+    Parsing rejects amounts a money column cannot store (beyond +/- MAX_AMOUNT), rendering skips
+    the per-call context copy and quantization when the value already comes from a money column.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault("max_digits", 20)
+        kwargs.setdefault("decimal_places", SCALE)
+        kwargs.setdefault("max_value", MAX_AMOUNT)
+        kwargs.setdefault("min_value", -MAX_AMOUNT)
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        if value is None:
+            return None
+        return format_amount(value)
+
+
+class MoneySum(Sum):
+    """
+    SUM() of a money column that cannot overflow on SQLite.
+
+    SQLite sums integers in 64 bits and raises "integer overflow" once the total passes
+    MAX_UNITS, so whole coins and fractions are summed separately and recombined exactly in
+    `MoneyField.from_db_value`. Other backends sum BIGINT into NUMERIC and use a plain SUM().
+    """
+
+    def __init__(self, expression, **extra):
+        if extra.get("filter") is not None or extra.get("distinct"):
+            raise ValueError("MoneySum does not support filter or distinct")
+        super().__init__(expression, **extra)
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        # "%%%%" survives both the template and the query parameter interpolation as a single "%"
+        template = (
+            f"(SUM(%(expressions)s / {UNITS_PER_COIN}) || ':' || SUM(%(expressions)s %%%% {UNITS_PER_COIN}))"
+        )
+        sql, params = super().as_sql(compiler, connection, template=template, **extra_context)
+        return sql, (*params, *params)
+
+    def _resolve_output_field(self):
+        return MoneyField()
+
+    @property
+    def convert_value(self):
+        # The generic int() conversion of integer expressions would reject the SQLite pair
+        return self._convert_value_noop
@@ -1,51 +1,72 @@
+from django.db import transaction
 from rest_framework import serializers
 
-from staking_app.models import UserWallet, UserPosition, StackingPool, PoolConditions
-from staking_app.staking_exceptions import StackingPoolException, UserPositionException
+from staking_app import capacity, unstaking
+from staking_app.models import UserWallet, UserPosition, StackingPool, PoolConditions, UnstakeRequest
+from staking_app.money import MoneySerializerField
+from staking_app.money import format_amount
+from staking_app.staking_exceptions import StackingPoolException, UserPositionException, BatchOperationException
 
 
 class UserWalletSerializer(serializers.ModelSerializer):
+    balance = MoneySerializerField(required=False)
+
     class Meta:
         model = UserWallet
         fields = ["user", "balance"]
+        sparse_fields = fields
 
 
 class StackingPoolSerializer(serializers.ModelSerializer):
+    capacity = MoneySerializerField(required=False, allow_null=True)
+    available = serializers.SerializerMethodField()
+
     class Meta:
         model = StackingPool
-        fields = ["id", "name", "conditions"]
+        fields = ["id", "name", "conditions", "capacity", "available"]
+        sparse_fields = fields
+        sparse_field_sources = {"available": ["capacity"]}
+
+    def get_available(self, obj):
+        available = capacity.available_amount(obj)
+        return None if available is None else format_amount(available)
 
     def create(self, validated_data):
         return StackingPool.objects.create(**validated_data)
 
 
 class UpdateStackingPoolSerializer(serializers.ModelSerializer):
+    capacity = MoneySerializerField(required=False, allow_null=True)
+
     class Meta:
         model = StackingPool
-        fields = ["name"]
+        fields = ["name", "capacity"]
 
     def update(self, instance, validated_data):
-        if instance.name == validated_data.get("name"):
+        if instance.name == validated_data.get("name") and "capacity" not in validated_data:
             raise StackingPoolException("Name must be different")
         instance.name = validated_data.get("name")
+        if "capacity" in validated_data:
+            instance.capacity = validated_data["capacity"]
         instance.save()
         return instance
 
 
 class PoolConditionsSerializer(serializers.ModelSerializer):
-    min_amount = serializers.DecimalField(max_digits=20, decimal_places=10)
-    max_amount = serializers.DecimalField(max_digits=20, decimal_places=10)
+    min_amount = MoneySerializerField()
+    max_amount = MoneySerializerField()
 
     class Meta:
         model = PoolConditions
-        fields = ["id", "min_amount", "max_amount"]
+        fields = ["id", "min_amount", "max_amount", "reward_rate"]
+        sparse_fields = fields
 
     def create(self, validated_data):
         return PoolConditions.objects.create(**validated_data)
 
 
 class WalletReplenishSerializer(serializers.ModelSerializer):
-    amount = serializers.DecimalField(max_digits=20, decimal_places=10)
+    amount = MoneySerializerField()
 
     class Meta:
         model = UserWallet
@@ -60,12 +81,11 @@ class WalletReplenishSerializer(serializers.ModelSerializer):
         user_wallet = UserWallet.objects.get(user=self.context.get("request").user)
         amount = validated_data.get("amount")
         user_wallet.replenish(amount)
-        user_wallet.save()
         return user_wallet
 
 
 class WalletWithdrawSerializer(serializers.ModelSerializer):
-    amount = serializers.DecimalField(max_digits=20, decimal_places=10)
+    amount = MoneySerializerField()
 
     class Meta:
         model = UserWallet
@@ -80,11 +100,12 @@ class WalletWithdrawSerializer(serializers.ModelSerializer):
         user_wallet = UserWallet.objects.get(user=self.context.get("request").user)
         amount = validated_data.get("amount")
         user_wallet.withdraw(amount)
-        user_wallet.save()
         return user_wallet
 
 
 class CreatePositionSerializer(serializers.ModelSerializer):
+    amount = MoneySerializerField()
+
     class Meta:
         model = UserPosition
         fields = ['pool', 'amount']
@@ -96,13 +117,47 @@ class CreatePositionSerializer(serializers.ModelSerializer):
 
 
 class UserPositionSerializer(serializers.ModelSerializer):
+    amount = MoneySerializerField()
+
     class Meta:
         model = UserPosition
         fields = ["id", "user", "pool", "amount"]
+        sparse_fields = fields
+
+
+class UnstakeRequestSerializer(serializers.ModelSerializer):
+    amount = MoneySerializerField()
+    queue_position = serializers.IntegerField(read_only=True, allow_null=True)
+    eta = serializers.SerializerMethodField()
+
+    class Meta:
+        model = UnstakeRequest
+        fields = [
+            "id", "position", "pool", "amount", "closes_position", "status",
+            "created_at", "settled_at", "queue_position", "eta",
+        ]
+        sparse_fields = fields
+        sparse_field_sources = {"queue_position": [], "eta": ["status", "created_at", "settled_at"]}
+
+    def get_eta(self, obj):
+        eta = unstaking.settlement_eta(obj)
+        return serializers.DateTimeField().to_representation(eta) if eta else None
+
+
+class ArchivedPositionSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    pool = serializers.IntegerField(source="pool_id")
+    amount = MoneySerializerField()
+    version = serializers.IntegerField()
+    closed_at = serializers.DateTimeField()
+    archived_at = serializers.DateTimeField(allow_null=True)  # null until the archiver moved the position
+
+    class Meta:
+        sparse_fields = ["id", "pool", "amount", "version", "closed_at", "archived_at"]
 
 
 class PositionIncreaseSerializer(serializers.ModelSerializer):
-    amount = serializers.DecimalField(max_digits=20, decimal_places=10, required=True)
+    amount = MoneySerializerField(required=True)
 
     class Meta:
         model = UserPosition
@@ -113,7 +168,6 @@ class PositionIncreaseSerializer(serializers.ModelSerializer):
         amount = validated_data.get("amount")
         try:
             success = user_position.increase_position(amount)
-            user_position.save()
         except UserPositionException as e:
             raise serializers.ValidationError({"message": str(e)})
         if not success:
@@ -122,7 +176,7 @@ class PositionIncreaseSerializer(serializers.ModelSerializer):
 
 
 class PositionDecreaseSerializer(serializers.Serializer):
-    amount = serializers.DecimalField(max_digits=20, decimal_places=10, required=True)
+    amount = MoneySerializerField(required=True)
 
     class Meta:
         model = UserPosition
@@ -133,9 +187,101 @@ class PositionDecreaseSerializer(serializers.Serializer):
         amount = validated_data.get("amount")
         try:
             success = user_position.decrease_position(amount)
-            user_position.save()
         except UserPositionException as e:
             raise serializers.ValidationError({"message": str(e)})
         if not success:
             return False
         return user_position
+
+
+class SimulationScenarioSerializer(serializers.Serializer):
+    name = serializers.CharField(max_length=255)
+    rates = serializers.DictField(child=serializers.DecimalField(max_digits=12, decimal_places=10))
+
+    def validate_rates(self, value):
+        if not all(str(pool_id).isdigit() for pool_id in value):
+            raise serializers.ValidationError("Rates must be keyed by pool id")
+        return {int(pool_id): rate for pool_id, rate in value.items()}
+
+
+class SimulationSerializer(serializers.Serializer):
+    epochs = serializers.IntegerField(min_value=1, max_value=10_000)
+    compound = serializers.BooleanField(default=False)
+    scenarios = SimulationScenarioSerializer(many=True, max_length=20)
+
+
+class BatchOperationSerializer(serializers.Serializer):
+    REPLENISH = "replenish"
+    WITHDRAW = "withdraw"
+    CREATE_POSITION = "create_position"
+    INCREASE_POSITION = "increase_position"
+    DECREASE_POSITION = "decrease_position"
+
+    op = serializers.ChoiceField(choices=[REPLENISH, WITHDRAW, CREATE_POSITION, INCREASE_POSITION, DECREASE_POSITION])
+    amount = MoneySerializerField()
+    pool = serializers.PrimaryKeyRelatedField(queryset=StackingPool.objects.select_related("conditions"), required=False)
+    position = serializers.IntegerField(required=False)
+
+    def validate_amount(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("Amount must be greater than 0")
+        return value
+
+    def validate(self, attrs):
+        if attrs["op"] == self.CREATE_POSITION and "pool" not in attrs:
+            raise serializers.ValidationError({"pool": "This field is required for create_position."})
+        if attrs["op"] in (self.INCREASE_POSITION, self.DECREASE_POSITION) and "position" not in attrs:
+            raise serializers.ValidationError({"position": f"This field is required for {attrs['op']}."})
+        return attrs
+
+
+class BatchSerializer(serializers.Serializer):
+    operations = BatchOperationSerializer(many=True, allow_empty=False, max_length=50)
+
+    def create(self, validated_data):
+        """
+        Execute the operations in order in one transaction, with the wallet row locked once.
+
+        Any failure rolls back every operation and raises `BatchOperationException` with the
+        index of the failed operation.
+        """
+        operations = validated_data["operations"]
+        with transaction.atomic():
+            wallet = UserWallet.objects.select_for_update().select_related("user").get(
+                user=self.context.get("request").user)
+            user = wallet.user  # user.wallet is this locked instance, positions below share it
+            position_ids = {operation["position"] for operation in operations if "position" in operation}
+            positions = UserPosition.objects.select_for_update().select_related("pool__conditions").filter(
+                user=user, pk__in=position_ids).in_bulk()
+            for position in positions.values():
+                position.user = user
+
+            return [self.execute(index, operation, user, wallet, positions) for index, operation in enumerate(operations)]
+
+    def execute(self, index, operation, user, wallet, positions):
+        op, amount = operation["op"], operation["amount"]
+        position = None
+        try:
+            if op == BatchOperationSerializer.REPLENISH:
+                wallet.replenish(amount)
+            elif op == BatchOperationSerializer.WITHDRAW:
+                wallet.withdraw(amount)
+            elif op == BatchOperationSerializer.CREATE_POSITION:
+                position = UserPosition(user=user, pool=operation["pool"], amount=amount)
+                position.save()
+                positions[position.pk] = position
+            else:
+                position = positions.get(operation["position"])
+                if not position:
+                    raise BatchOperationException(index, "Position not found")
+                if op == BatchOperationSerializer.INCREASE_POSITION:
+                    position.increase_position(amount)
+                else:
+                    position.decrease_position(amount)
+        except UserPositionException as e:
+            raise BatchOperationException(index, str(e))
+
+        result = {"op": op, "balance": format_amount(wallet.balance)}
+        if position:
+            result.update(position=position.pk, amount=format_amount(position.amount))
+        return result
@@ -0,0 +1,221 @@
+"""
+Columnar snapshot files of the staking state, written by `snapshot_export` and restored by
+`snapshot_import`.
+
+A snapshot holds the rows of SNAPSHOT_MODELS (users, conditions, pools with their capacity
+shards, wallets, positions, closed positions not archived yet and unstake requests; the monthly
+archive tables, group and permission memberships are not included), streamed table by table in
+primary key order, `chunk_size` rows per block, all read in one transaction. A block
+stores every column on its own, zlib compressed: integer and boolean columns (keys, amounts in
+base units) as little-endian int64 arrays, every other column as UTF-8 text with an array of
+lengths, plus a bit mask of the NULLs when the column is nullable. The values are the raw
+database values, no model instance or field conversion is involved in either direction.
+
+Layout: MAGIC, then frames of `<u32 header length><JSON header><compressed blobs>`. A block
+header names the table, its row count and the columns with the compressed length of each of
+their blobs; the final header `{"end": true, "rows": {table: count}}` closes the file.
+"""
+import json
+import struct
+import zlib
+
+import numpy as np
+from django.apps import apps
+from django.core.management.color import no_style
+from django.db import connection, transaction
+
+from staking_app import archive
+from staking_app.bulk import deferred_constraints, deferred_indexes
+from users.search import SEARCH_TABLE
+
+MAGIC = b"STAKESNAP1\n"
+SNAPSHOT_MODELS = [
+    "users.User",
+    "staking_app.PoolConditions",
+    "staking_app.StackingPool",
+    "staking_app.PoolCapacityShard",
+    "staking_app.UserWallet",
+    "staking_app.UserPosition",
+    "staking_app.ClosedPosition",
+    "staking_app.UnstakeRequest",
+]
+INTEGER_TYPES = {
+    "AutoField", "BigAutoField", "SmallAutoField", "IntegerField", "BigIntegerField", "SmallIntegerField",
+    "PositiveIntegerField", "PositiveBigIntegerField", "PositiveSmallIntegerField", "ForeignKey", "OneToOneField",
+}
+
+
+class SnapshotFormatError(Exception):
+    pass
+
+
+def snapshot_models():
+    return [apps.get_model(label) for label in SNAPSHOT_MODELS]
+
+
+def column_kind(field):
+    internal_type = field.get_internal_type()
+    if internal_type == "BooleanField":
+        return "bool"
+    return "int" if internal_type in INTEGER_TYPES else "text"
+
+
+def encode_column(kind, values, nullable, level):
+    count = len(values)
+    if kind == "text":
+        encoded = [b"" if value is None else str(value).encode() for value in values]
+        blobs = [np.fromiter(map(len, encoded), dtype="<u4", count=count).tobytes(), b"".join(encoded)]
+    else:
+        blobs = [np.fromiter((0 if value is None else int(value) for value in values), dtype="<i8", count=count).tobytes()]
+    if nullable:
+        blobs.append(np.packbits(np.fromiter((value is None for value in values), dtype=bool, count=count)).tobytes())
+    return [zlib.compress(blob, level) for blob in blobs]
+
+
+def decode_column(kind, blobs, count, nullable):
+    blobs = [zlib.decompress(blob) for blob in blobs]
+    if kind == "text":
+        lengths = np.frombuffer(blobs[0], dtype="<u4")
+        ends = np.cumsum(lengths, dtype=np.int64).tolist()
+        data = blobs[1]
+        values, start = [], 0
+        for end in ends:
+            values.append(data[start:end].decode())
+            start = end
+    else:
+        values = np.frombuffer(blobs[0], dtype="<i8").tolist()
+        if kind == "bool":
+            values = [bool(value) for value in values]
+    if nullable:
+        nulls = np.unpackbits(np.frombuffer(blobs[-1], dtype=np.uint8), count=count).tolist()
+        values = [None if null else value for value, null in zip(values, nulls)]
+    return values
+
+
+def write_frame(file, header, blobs=()):
+    encoded = json.dumps(header).encode()
+    file.write(struct.pack("<I", len(encoded)))
+    file.write(encoded)
+    for blob in blobs:
+        file.write(blob)
+
+
+def read_frames(file):
+    if file.read(len(MAGIC)) != MAGIC:
+        raise SnapshotFormatError("Not a staking snapshot file")
+    while True:
+        length = file.read(4)
+        if len(length) < 4:
+            raise SnapshotFormatError("Truncated snapshot file")
+        header = json.loads(file.read(struct.unpack("<I", length)[0]))
+        if header.get("end"):
+            return
+        blobs = [[file.read(size) for size in column["blobs"]] for column in header["columns"]]
+        yield header, blobs
+
+
+def export_snapshot(file, chunk_size=10_000, level=6, progress=None):
+    """Stream the snapshot of the database into the binary `file`. Returns {table: rows}."""
+    file.write(MAGIC)
+    totals = {}
+    # One transaction, so the tables are read as of the same moment: positions match the wallets
+    # they were paid from even while the service keeps running
+    outermost = not connection.in_atomic_block
+    with transaction.atomic(), connection.cursor() as cursor:
+        if outermost and connection.vendor == "postgresql":
+            cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+        for model in snapshot_models():
+            table = model._meta.db_table
+            fields = model._meta.concrete_fields
+            pk = connection.ops.quote_name(model._meta.pk.column)
+            columns = ", ".join(connection.ops.quote_name(field.column) for field in fields)
+            sql = f"SELECT {columns} FROM {connection.ops.quote_name(table)} WHERE {pk} > %s ORDER BY {pk} LIMIT %s"
+            pk_index = fields.index(model._meta.pk)
+            totals[table], last_pk = 0, -1
+            while True:
+                cursor.execute(sql, [last_pk, chunk_size])
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                last_pk = rows[-1][pk_index]
+                header = {"table": table, "rows": len(rows), "columns": []}
+                blobs = []
+                for field, values in zip(fields, zip(*rows)):
+                    kind = column_kind(field)
+                    compressed = encode_column(kind, values, field.null, level)
+                    header["columns"].append({
+                        "name": field.column, "kind": kind, "null": field.null,
+                        "blobs": [len(blob) for blob in compressed],
+                    })
+                    blobs += compressed
+                write_frame(file, header, blobs)
+                totals[table] += len(rows)
+                if progress:
+                    progress(table, totals[table])
+    write_frame(file, {"end": True, "rows": totals})
+    return totals
+
+
+def advance_sequence(cursor, model, floor):
+    """Make the ids the database assigns to new rows of `model` larger than `floor`."""
+    table, column = model._meta.db_table, model._meta.pk.column
+    quoted_table, quoted_column = connection.ops.quote_name(table), connection.ops.quote_name(column)
+    if connection.vendor == "sqlite":
+        # AUTOINCREMENT continues after the largest of the rows and of the sqlite_sequence entry
+        cursor.execute("UPDATE sqlite_sequence SET seq = MAX(seq, %s) WHERE name = %s", [floor, table])
+        if not cursor.rowcount:
+            cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)", [table, floor])
+    elif connection.vendor == "postgresql":
+        cursor.execute(
+            f"SELECT setval(pg_get_serial_sequence(%s, %s), "
+            f"GREATEST(%s, (SELECT MAX({quoted_column}) FROM {quoted_table})))",
+            [table, column, floor],
+        )
+    elif connection.vendor == "mysql":
+        cursor.execute(f"ALTER TABLE {quoted_table} AUTO_INCREMENT = {int(floor) + 1}")
+
+
+def import_snapshot(file, progress=None):
+    """
+    Load a snapshot into empty tables in one transaction, with foreign key checks deferred to
+    the commit and the secondary indexes built once at the end. Returns {table: rows}.
+    """
+    models = snapshot_models()
+    tables = {model._meta.db_table: model for model in models}
+    totals = dict.fromkeys(tables, 0)
+    with deferred_constraints(), deferred_indexes(tables):
+        with connection.cursor() as cursor:
+            for table in tables:
+                cursor.execute(f"SELECT 1 FROM {connection.ops.quote_name(table)} LIMIT 1")
+                if cursor.fetchone():
+                    raise SnapshotFormatError(f"Table {table} is not empty")
+
+            for header, blobs in read_frames(file):
+                table = header["table"]
+                if table not in tables:
+                    raise SnapshotFormatError(f"Unknown table {table}")
+                columns = [
+                    decode_column(column["kind"], column_blobs, header["rows"], column["null"])
+                    for column, column_blobs in zip(header["columns"], blobs)
+                ]
+                names = ", ".join(connection.ops.quote_name(column["name"]) for column in header["columns"])
+                placeholders = ", ".join(["%s"] * len(columns))
+                cursor.executemany(
+                    f"INSERT INTO {connection.ops.quote_name(table)} ({names}) VALUES ({placeholders})",
+                    list(zip(*columns)),
+                )
+                totals[table] += header["rows"]
+                if progress:
+                    progress(table, totals[table])
+
+            for statement in connection.ops.sequence_reset_sql(no_style(), models):
+                cursor.execute(statement)
+            # Closed positions keep their ids in the staging and archive tables (the latter are not in
+            # the snapshot): new positions must not reuse them, the archiver would refuse to move them
+            highest_closed_id = archive.highest_closed_id()
+            if highest_closed_id:
+                advance_sequence(cursor, apps.get_model("staking_app", "UserPosition"), highest_closed_id)
+            if connection.vendor == "sqlite" and totals.get(SEARCH_TABLE.removesuffix("_search")):
+                # The triggers feeding the user search index were dropped with the indexes
+                cursor.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('rebuild')")
+    return totals
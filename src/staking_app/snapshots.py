@@ -0,0 +1,116 @@
+"""
+Write-through cache of wallet and position snapshots.
+
+Wallet and position detail reads are served from the "snapshots" cache when SNAPSHOT_CACHE_URL
+points to a backend shared by every process (the workers and the management commands that
+change wallets and positions), without it the cache is off. The model methods that change a
+wallet or a position store the new serialized snapshot once their transaction commits, versioned
+by the id of the outbox event written with the change: a snapshot only replaces an older one, so
+late commit callbacks cannot roll the cache back. As the snapshot is stored before the request
+that made the change responds, the next read of that user already sees it.
+
+Every key has a generation token next to it, an entry only counts while it carries the current
+token. Changes made with set-based queries (wallet credits, compounding) and deletes replace the
+token instead of storing a snapshot, and misses are filled with the token read before the
+database was: a fill racing with a change is ignored instead of pinning the stale row. Entries
+expire after SNAPSHOT_CACHE_TTL seconds, which bounds the staleness a shared backend can show
+when two processes store the same entry at once.
+"""
+import os
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+_store_lock = threading.Lock()
+
+
+def cache():
+    return caches["snapshots"]
+
+
+def wallet_key(pk):
+    return f"snapshot:wallet:{pk}"
+
+
+def position_key(pk):
+    return f"snapshot:position:{pk}"
+
+
+def wallet_data(wallet):
+    from staking_app.serializers import UserWalletSerializer
+
+    return dict(UserWalletSerializer(wallet).data)
+
+
+def position_data(position):
+    from staking_app.serializers import UserPositionSerializer
+
+    return dict(UserPositionSerializer(position).data)
+
+
+def generation_key(key):
+    return f"{key}:generation"
+
+
+def new_generation():
+    return os.urandom(8).hex()
+
+
+def get(key):
+    """
+    Return `(data, generation)`: the cached snapshot, None on a miss, and the generation a miss
+    is filled with. Read it before the database, a change committed in between then voids the fill.
+    """
+    values = cache().get_many([key, generation_key(key)])
+    entry, generation = values.get(key), values.get(generation_key(key))
+    if generation is None:
+        cache().add(generation_key(key), new_generation(), settings.SNAPSHOT_CACHE_TTL)
+        generation = cache().get(generation_key(key))
+    elif entry is not None and entry["generation"] == generation:
+        return entry["data"], generation
+    return None, generation
+
+
+def store(key, data, version):
+    """Cache a snapshot written by the change with outbox event id `version`, unless a newer one is cached."""
+    with _store_lock:
+        current = cache().get(key)
+        if current is None or current["version"] <= version:
+            generation = new_generation()
+            cache().set_many({
+                generation_key(key): generation,
+                key: {"generation": generation, "version": version, "data": data},
+            }, settings.SNAPSHOT_CACHE_TTL)
+
+
+def fill(key, data, generation):
+    """Cache a snapshot read from the database after `get` returned `generation`, unless a current one is cached."""
+    entry = {"generation": generation, "version": 0, "data": data}
+    if cache().add(key, entry, settings.SNAPSHOT_CACHE_TTL):
+        return
+    values = cache().get_many([key, generation_key(key)])
+    current = values.get(key)
+    if current is None or current["generation"] != values.get(generation_key(key)):
+        cache().set(key, entry, settings.SNAPSHOT_CACHE_TTL)
+
+
+def store_on_commit(key, data, version):
+    transaction.on_commit(lambda: store(key, data, version))
+
+
+def forget(keys):
+    cache().set_many({generation_key(key): new_generation() for key in keys}, settings.SNAPSHOT_CACHE_TTL)
+
+
+def forget_on_commit(keys):
+    keys = list(keys)
+    if keys:
+        transaction.on_commit(lambda: forget(keys))
+
+
+def forget_deleted(sender, instance, **kwargs):
+    """post_delete receiver: positions and wallets are also deleted by cascades, which call no model method."""
+    key = wallet_key if sender._meta.model_name == "userwallet" else position_key
+    forget_on_commit([key(instance.pk)])
@@ -4,9 +4,31 @@ class UserPositionException(Exception):
     pass
 
 
+class PoolCapacityException(UserPositionException):
+    pass
+
+
+class PositionVersionConflict(Exception):
+    pass
+
+
+class PositionConflictException(Exception):
+    pass
+
+
 class PoolConditionsException(Exception):
     pass
 
 
 class StackingPoolException(Exception):
     pass
+
+
+class ArchiveConflictException(Exception):
+    pass
+
+
+class BatchOperationException(Exception):
+    def __init__(self, index, message):
+        super().__init__(message)
+        self.index = index
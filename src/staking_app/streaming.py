@@ -0,0 +1,282 @@
+import asyncio
+import json
+import queue
+import re
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from rest_framework.renderers import BaseRenderer
+
+from base.batch_fetch import MAX_ID
+from staking_app.models import OutboxEvent
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Lets DRF content negotiation accept `text/event-stream` requests.
+
+    The stream body itself is produced by the view, only error payloads go through `render`.
+    """
+    media_type = "text/event-stream"
+    format = "event-stream"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return f"event: error\ndata: {json.dumps(data, default=str)}\n\n".encode(self.charset)
+
+
+class Subscription:
+    """
+    Queue of the events of one connected client.
+
+    Sync streams block on a `queue.Queue`. Async streams (ASGI) await an `asyncio.Queue` of their
+    event loop, the reader thread hands events over to that loop.
+    """
+
+    def __init__(self, user_id, max_size, loop=None):
+        self.user_id = user_id
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=max_size) if loop else queue.Queue(maxsize=max_size)
+        self.overflowed = False
+        self.first_id = None  # id of the first queued event, where a client reset before any event resumes
+
+    def push(self, event):
+        if self.loop:
+            try:
+                self.loop.call_soon_threadsafe(self._put, event)
+            except RuntimeError:  # the loop is closed, so is the stream
+                pass
+        else:
+            self._put(event)
+
+    def _put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except (queue.Full, asyncio.QueueFull):
+            self.overflowed = True
+        else:
+            if self.first_id is None:
+                self.first_id = event.id
+
+
+class OutboxBroadcaster:
+    """
+    A single outbox reader per process, fanning new events out to subscribed clients.
+
+    The reader thread starts with the first subscriber and polls the outbox table only
+    while at least one client is connected. Sync streams (WSGI) hold a worker thread each for as
+    long as the client stays connected, at most `max_sync_streams` of them are served at once.
+    """
+
+    def __init__(self, poll_interval, batch_size, queue_size, max_sync_streams):
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.max_sync_streams = max_sync_streams
+        self._subscribers = {}
+        self._sync_streams = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._cursor = None
+
+    def acquire_sync_stream(self):
+        """Take one of the `max_sync_streams` slots, False when they are all taken."""
+        with self._lock:
+            if self._sync_streams >= self.max_sync_streams:
+                return False
+            self._sync_streams += 1
+            return True
+
+    def release_sync_stream(self):
+        with self._lock:
+            self._sync_streams -= 1
+
+    def subscribe(self, user_id, loop=None):
+        subscription = Subscription(user_id, self.queue_size, loop)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+            self._ensure_reader()
+        self._wakeup.set()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            user_subscriptions = self._subscribers.get(subscription.user_id)
+            if user_subscriptions:
+                user_subscriptions.discard(subscription)
+                if not user_subscriptions:
+                    del self._subscribers[subscription.user_id]
+
+    def _ensure_reader(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="outbox-broadcaster", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            if not self._subscribers:
+                self._wakeup.clear()
+                self._wakeup.wait()
+                self._cursor = None  # clients that were away resume through Last-Event-ID
+            try:
+                close_old_connections()
+                if self._cursor is None:
+                    self._cursor = OutboxEvent.objects.order_by("-id").values_list("id", flat=True).first() or 0
+                fetched = self._dispatch_pending()
+            except Exception:  # the reader must survive transient database errors
+                fetched = 0
+            if fetched < self.batch_size:
+                time.sleep(self.poll_interval)
+
+    def _dispatch_pending(self):
+        events = list(OutboxEvent.objects.filter(id__gt=self._cursor).order_by("id")[:self.batch_size])
+        for event in events:
+            with self._lock:
+                subscriptions = list(self._subscribers.get(event.user_id, ()))
+            for subscription in subscriptions:
+                subscription.push(event)
+            self._cursor = event.id
+        return len(events)
+
+
+def format_event(event):
+    data = json.dumps({"kind": event.kind, **event.payload})
+    return f"id: {event.id}\nevent: {event.kind}\ndata: {data}\n\n"
+
+
+def format_reset(last_event_id):
+    """Tell a client that fell behind to reconnect and resume from the last event it received."""
+    retry = int(settings.STAKING_STREAM_POLL_INTERVAL * 1000)
+    data = json.dumps({"kind": "reset", "last_event_id": last_event_id})
+    return f"retry: {retry}\nevent: reset\ndata: {data}\n\n"
+
+
+def parse_event_id(value):
+    """Parse a `Last-Event-ID`, ValueError unless it is an integer an outbox id can hold."""
+    if not re.fullmatch(r"[0-9]{1,19}", value) or int(value) > MAX_ID:
+        raise ValueError(f"Last-Event-ID must be an integer between 0 and {MAX_ID}")
+    return int(value)
+
+
+def backlog(user_id, after_id):
+    """The next STAKING_STREAM_BATCH_SIZE events of the user after `after_id`."""
+    events = OutboxEvent.objects.filter(user_id=user_id, id__gt=after_id).order_by("id")
+    batch = list(events[:settings.STAKING_STREAM_BATCH_SIZE])
+    close_old_connections()
+    return batch
+
+
+def reset_frame(subscription, sent_id):
+    if not sent_id:
+        # Nothing was sent yet, resume before the first dropped event
+        sent_id = subscription.first_id - 1 if subscription.first_id else 0
+    return format_reset(sent_id)
+
+
+def event_stream(broadcaster, user_id, last_event_id=None):
+    """
+    Yield SSE frames for the user: first the backlog after `last_event_id`, then live events.
+
+    The subscription is registered before the backlog query, so events committed in between
+    are delivered exactly once. A client too slow to drain its queue gets a `reset` event and
+    the stream is closed, it reconnects with the `Last-Event-ID` of the reset to catch up.
+    """
+    subscription = broadcaster.subscribe(user_id)
+    heartbeat_interval = settings.STAKING_STREAM_HEARTBEAT_INTERVAL
+    try:
+        sent_id = last_event_id or 0
+        if last_event_id is not None:
+            while True:
+                batch = backlog(user_id, sent_id)
+                for event in batch:
+                    sent_id = event.id
+                    yield format_event(event)
+                if len(batch) < settings.STAKING_STREAM_BATCH_SIZE:
+                    break
+        yield ": connected\n\n"
+
+        while not subscription.overflowed:
+            try:
+                event = subscription.queue.get(timeout=heartbeat_interval)
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+                continue
+            if event.id <= sent_id:
+                continue
+            sent_id = event.id
+            yield format_event(event)
+        yield reset_frame(subscription, sent_id)
+    finally:
+        broadcaster.unsubscribe(subscription)
+
+
+async def async_event_stream(broadcaster, user_id, last_event_id=None):
+    """
+    `event_stream` for ASGI: Django 4.2 collects a sync iterator into a list before sending it,
+    so a stream that never ends must be an async generator. Waiting for events holds no thread.
+    """
+    subscription = broadcaster.subscribe(user_id, loop=asyncio.get_running_loop())
+    heartbeat_interval = settings.STAKING_STREAM_HEARTBEAT_INTERVAL
+    try:
+        sent_id = last_event_id or 0
+        if last_event_id is not None:
+            while True:
+                batch = await sync_to_async(backlog)(user_id, sent_id)
+                for event in batch:
+                    sent_id = event.id
+                    yield format_event(event)
+                if len(batch) < settings.STAKING_STREAM_BATCH_SIZE:
+                    break
+        yield ": connected\n\n"
+
+        while not subscription.overflowed:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), heartbeat_interval)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if event.id <= sent_id:
+                continue
+            sent_id = event.id
+            yield format_event(event)
+        yield reset_frame(subscription, sent_id)
+    finally:
+        broadcaster.unsubscribe(subscription)
+
+
+class SyncEventStream:
+    """
+    `event_stream` holding one of the sync stream slots of the broadcaster.
+
+    The response closes it even when the client went away before the first frame, which a
+    generator's `finally` alone would miss.
+    """
+
+    def __init__(self, broadcaster, user_id, last_event_id=None):
+        self._frames = event_stream(broadcaster, user_id, last_event_id)
+        self._release = broadcaster.release_sync_stream
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._frames)
+
+    def close(self):
+        self._frames.close()
+        if self._release:
+            self._release()
+            self._release = None
+
+
+broadcaster = OutboxBroadcaster(
+    poll_interval=settings.STAKING_STREAM_POLL_INTERVAL,
+    batch_size=settings.STAKING_STREAM_BATCH_SIZE,
+    queue_size=settings.STAKING_STREAM_QUEUE_SIZE,
+    max_sync_streams=settings.STAKING_STREAM_MAX_SYNC_STREAMS,
+)
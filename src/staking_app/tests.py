@@ -1,3 +1,1451 @@
-from django.test import TestCase
+import io
+import json
+import re
+import tempfile
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django import forms
+from django.contrib import admin
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse, URLResolver
+from django.utils import timezone
+from rest_framework import permissions, serializers
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+from rest_framework.views import APIView
+
+from base import metrics, slow_queries
+from base.pagination import EstimatedCountPaginator
+from base.parsers import FastJSONParser
+from base.renderers import FastJSONRenderer
+from base.single_flight import SingleFlight, flights, single_flight
+from base.warmup import warmup
+from jobs import queue
+
+from staking_app import archive
+from staking_app import urls as staking_urls
+from staking_app.epochs import current_epoch, epoch_of, epoch_start
+from staking_app import capacity, snapshots, streaming
+from staking_app.compounding import compound_pool
+from staking_app.money import MAX_AMOUNT, MAX_UNITS, MoneyField, format_amount, format_units, to_units
+from staking_app.models import (
+    UserPosition, StackingPool, PoolConditions, UserWallet, ClosedPosition, OutboxEvent, PoolCapacityShard,
+    UnstakeRequest, credit_wallets, close_positions,
+)
+from staking_app.simulation import simulate
+from staking_app.snapshot_file import SnapshotFormatError, export_snapshot, import_snapshot, snapshot_models
+from staking_app.staking_exceptions import (
+    ArchiveConflictException, PoolCapacityException, PositionConflictException, PositionVersionConflict, UserPositionException,
+)
+from staking_app.unstaking import settle, settlement_eta, with_queue_position
+from users import urls as users_urls
+from users.models import User
+
+HOT_TABLES = {
+    "users_user",
+    "staking_app_userwallet",
+    "staking_app_userposition",
+    "staking_app_outboxevent",
+    "staking_app_unstakerequest",
+}
+
+# Views that read a whole hot table on purpose
+FULL_SCAN_ALLOWED = {
+    "wallets": "admin listing pages through every wallet",
+    "user_list": "listing pages through every user",
+    "simulate": "the simulator loads the whole position book",
+}
+
+# Views whose queries cannot be captured by a plain request/response cycle
+NOT_EXPLAINED = {
+    "stream": "queries run lazily while the event stream is consumed",
+}
+
+FULL_SCAN = re.compile(r"^SCAN (\w+)\b(?! USING)")
+
+# (url name, method, url kwargs, data, user): url kwargs and data values starting with "@" are
+# attributes of the test case, resolved after the fixtures are created
+CASES = [
+    ("wallets", "get", {}, None, "admin"),
+    ("wallets_detail", "get", {"pk": "@wallet.pk"}, None, "admin"),
+    ("wallets_replenish", "post", {}, {"amount": "10"}, "user"),
+    ("wallets_withdraw", "post", {}, {"amount": "10"}, "user"),
+    ("positions", "get", {}, None, "user"),
+    ("positions_create", "post", {}, {"pool": "@pool.pk", "amount": "150"}, "user"),
+    ("positions_detail", "get", {"pk": "@position.pk"}, None, "user"),
+    ("positions_by_ids", "get", {}, {"ids": "@position.pk"}, "user"),
+    ("positions_delete", "delete", {"pk": "@position.pk"}, None, "admin"),
+    ("positions_increase", "post", {"pk": "@position.pk"}, {"amount": "10"}, "user"),
+    ("positions_decrease", "post", {"pk": "@position.pk"}, {"amount": "10"}, "user"),
+    ("positions_archive", "get", {}, None, "user"),
+    ("unstaking", "get", {}, None, "user"),
+    ("batch", "post", {}, {"operations": [
+        {"op": "replenish", "amount": "100"},
+        {"op": "create_position", "pool": "@pool.pk", "amount": "150"},
+        {"op": "increase_position", "position": "@position.pk", "amount": "10"},
+    ]}, "user"),
+    ("conditions", "get", {}, None, "admin"),
+    ("conditions_create", "post", {}, {"min_amount": "1", "max_amount": "2"}, "admin"),
+    ("conditions_detail", "get", {"pk": "@conditions.pk"}, None, "admin"),
+    ("conditions_delete", "delete", {"pk": "@conditions.pk"}, None, "admin"),
+    ("pools", "get", {}, None, "admin"),
+    ("pools_create", "post", {}, {"name": "New Pool", "conditions": "@conditions.pk"}, "admin"),
+    ("pools_detail", "get", {"pk": "@pool.pk"}, None, "admin"),
+    ("pools_by_ids", "get", {}, {"ids": "@pool.pk"}, "admin"),
+    ("pools_delete", "delete", {"pk": "@pool.pk"}, None, "admin"),
+    ("pools_edit", "put", {"pk": "@pool.pk"}, {"name": "Renamed Pool"}, "admin"),
+    ("simulate", "post", {}, {"epochs": 3, "scenarios": [{"name": "up", "rates": {"1": "0.1"}}]}, "admin"),
+    ("user_list", "get", {}, None, "admin"),
+    ("user_detail", "get", {"pk": "@user.pk"}, None, "user"),
+    ("user_by_ids", "get", {}, {"ids": "@user.pk"}, "user"),
+    ("register", "post", {}, {"username": "new", "email": "new@example.com", "password": "pw-n3w-user"}, None),
+    ("delete_user", "delete", {"pk": "@user.pk"}, None, "admin"),
+    ("edit_profile", "put", {}, {"username": "renamed"}, "user"),
+    ("change_password", "put", {}, {
+        "old_password": "pw-staker", "new_password": "pw-changed", "confirm_password": "pw-changed"}, "user"),
+    ("token_obtain_pair", "post", {}, {"username": "staker", "password": "pw-staker"}, None),
+    ("token_refresh", "post", {}, {"refresh": "invalid"}, None),
+    ("login", "post", {}, {"username": "staker", "password": "pw-staker"}, None),
+    ("logout", "post", {}, None, "user"),
+]
+
+
+@override_settings(
+    PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"], ALLOWED_HOSTS=["testserver"], AUDIT_ASYNC=False)
+class QueryPlanTestCase(TestCase):
+    """
+    Runs every staking and users view and fails when one of its queries fully scans a hot table.
+
+    Each query captured during the request is replayed with `EXPLAIN QUERY PLAN`, a plain
+    `SCAN <table>` step (no index used) on one of HOT_TABLES is a regression.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(
+            username="admin", email="admin@example.com", password="pw-admin", is_staff=True)
+        cls.user = User.objects.create_user(username="staker", email="staker@example.com", password="pw-staker")
+        cls.wallet = cls.user.wallet
+        cls.wallet.replenish(1000)
+        cls.conditions = PoolConditions(min_amount=100, max_amount=500)
+        cls.conditions.save()
+        cls.pool = StackingPool.objects.create(name="Example Pool", conditions=cls.conditions)
+        cls.position = UserPosition(user=cls.user, pool=cls.pool, amount=200)
+        cls.position.save()
+        for i in range(20):
+            User.objects.create(username=f"filler{i}", email=f"filler{i}@example.com")
+
+    def resolve(self, value):
+        if isinstance(value, str) and value.startswith("@"):
+            obj = self
+            for attribute in value[1:].split("."):
+                obj = getattr(obj, attribute)
+            return obj
+        if isinstance(value, dict):
+            return {key: self.resolve(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self.resolve(item) for item in value]
+        return value
+
+    def full_scans(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+            details = [row[-1] for row in cursor.fetchall()]
+        return [
+            detail for detail in details
+            if (match := FULL_SCAN.match(detail)) and match.group(1) in HOT_TABLES
+        ]
+
+    def assertNoFullScans(self, name, method, kwargs, data, user):
+        snapshots.cache().clear()  # detail views served from a snapshot would run no query
+        client = APIClient()
+        if user:
+            client.force_authenticate(User.objects.get(pk=getattr(self, user).pk))
+        url = reverse(name, kwargs=self.resolve(kwargs))
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(client, method)(url, self.resolve(data), format="json")
+        self.assertLess(response.status_code, 500, response.content)
+
+        for query in queries.captured_queries:
+            sql = query["sql"]
+            if not sql.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+                continue
+            scans = self.full_scans(sql)
+            if scans and name not in FULL_SCAN_ALLOWED:
+                self.fail(f"{name}: full scan ({', '.join(scans)}) in query:\n{sql}")
+
+    def test_every_view_has_a_case(self):
+        names = url_names(staking_urls.urlpatterns) | url_names(users_urls.urlpatterns)
+        covered = {case[0] for case in CASES} | set(NOT_EXPLAINED)
+        self.assertEqual(names - covered, set(), "views without a query plan case")
+
+
+@override_settings(ALLOWED_HOSTS=["testserver"], STAKING_POSITION_RETRY_BACKOFF=0, AUDIT_ASYNC=False)
+class PositionVersioningTestCase(TestCase):
+    """Compare-and-swap updates of positions read by concurrent requests."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username="staker", email="staker@example.com")
+        cls.user.wallet.replenish(1000)
+        cls.conditions = PoolConditions(min_amount=100, max_amount=500)
+        cls.conditions.save()
+        cls.pool = StackingPool.objects.create(name="Example Pool", conditions=cls.conditions)
+        position = UserPosition(user=User.objects.get(pk=cls.user.pk), pool=cls.pool, amount=200)
+        position.save()
+        cls.position_id = position.pk
+
+    def load(self):
+        return UserPosition.objects.select_related("user__wallet", "pool__conditions").get(pk=self.position_id)
+
+    def balance(self):
+        return UserWallet.objects.get(user=self.user).balance
+
+    def test_stale_instance_retries_instead_of_overwriting(self):
+        first, second = self.load(), self.load()
+        first.increase_position(10)
+        second.increase_position(20)
+        second.decrease_position(5)
+
+        position = self.load()
+        self.assertEqual(position.amount, 225)
+        self.assertEqual(position.version, 3)
+        # The decrease is queued and reaches the wallet when the epoch is settled
+        self.assertEqual(self.balance(), 1000 - 230)
+        self.assertEqual(settle(current_epoch() + 1), 1)
+        self.assertEqual(self.balance(), 1000 - 225)
+
+    @override_settings(STAKING_POSITION_UPDATE_RETRIES=0)
+    def test_exhausted_retries_roll_back_the_attempt(self):
+        first, second = self.load(), self.load()
+        first.increase_position(10)
+        with self.assertRaises(PositionConflictException):
+            second.increase_position(20)
+
+        self.assertEqual(self.load().amount, 210)
+        self.assertEqual(self.balance(), 1000 - 210)
+
+    def test_conflict_returns_409(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        url = reverse("positions_increase", kwargs={"pk": self.position_id})
+        with mock.patch.object(UserPosition, "compare_and_swap", side_effect=PositionVersionConflict):
+            response = client.post(url, {"amount": "10"}, format="json")
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.load().amount, 200)
+        self.assertEqual(self.balance(), 1000 - 200)
+
+
+@override_settings(ALLOWED_HOSTS=["testserver"], AUDIT_ASYNC=False, STAKING_EPOCH_SECONDS=3600)
+class UnstakingQueueTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        conditions = PoolConditions(min_amount=100, max_amount=500)
+        conditions.save()
+        cls.pool = StackingPool.objects.create(name="Example Pool", conditions=conditions)
+        cls.first = User.objects.create(username="first", email="first@example.com")
+        cls.second = User.objects.create(username="second", email="second@example.com")
+        for user in [cls.first, cls.second]:
+            user.wallet.replenish(1000)
+
+    def open_position(self, user, amount):
+        position = UserPosition(user=User.objects.get(pk=user.pk), pool=self.pool, amount=amount)
+        position.save()
+        return position.pk
+
+    def decrease(self, position_id, amount):
+        UserPosition.objects.select_related("pool__conditions").get(pk=position_id).decrease_position(amount)
+
+    def queue(self):
+        """Four requests in this order: 50 of the first user, 100 and 200 (a close) of the second, 50 of the first."""
+        first, second = self.open_position(self.first, 300), self.open_position(self.second, 300)
+        closed = self.open_position(self.second, 200)
+        self.decrease(first, 50)
+        self.decrease(second, 100)
+        UserPosition.objects.get(pk=closed).delete()
+        self.decrease(first, 50)
+        return list(UnstakeRequest.objects.order_by("pk"))
+
+    def balances(self):
+        return [UserWallet.objects.get(user=user).balance for user in [self.first, self.second]]
+
+    def test_settle_credits_each_user_once_per_chunk(self):
+        self.queue()
+        self.assertEqual(settle(), 0)  # created in the current epoch, settled at the start of the next one
+        self.assertEqual(self.balances(), [700, 500])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(settle(current_epoch() + 1, chunk_size=3), 4)
+        wallet_updates = [query for query in queries if query["sql"].startswith('UPDATE "staking_app_userwallet"')]
+        self.assertEqual(len(wallet_updates), 2)  # one per chunk, whatever the number of requests in it
+        self.assertEqual(self.balances(), [800, 800])
+        self.assertEqual(
+            set(UnstakeRequest.objects.values_list("status", flat=True)), {UnstakeRequest.SETTLED})
+        self.assertEqual(settle(current_epoch() + 1), 0)
+
+    def test_queue_position_counts_the_pending_requests_ahead(self):
+        requests = self.queue()
+        positions = with_queue_position(UnstakeRequest.objects.order_by("pk")).values_list("queue_position", flat=True)
+        self.assertEqual(list(positions), [1, 2, 3, 4])
+
+        UnstakeRequest.objects.filter(pk=requests[0].pk).update(status=UnstakeRequest.SETTLED)
+        self.assertEqual(list(positions.all()), [None, 1, 2, 3])
+
+        client = APIClient()
+        client.force_authenticate(self.second)
+        response = client.get(reverse("unstaking"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item["queue_position"] for item in response.data["results"]], [2, 1])
+        self.assertEqual([item["closes_position"] for item in response.data["results"]], [True, False])
+
+    def test_settlement_eta_is_the_start_of_the_next_epoch(self):
+        request = self.queue()[0]
+        eta = epoch_start(epoch_of(request.created_at) + 1)
+        self.assertEqual(settlement_eta(request), eta)
+        self.assertTrue(request.created_at < eta <= request.created_at + timedelta(hours=1))
+
+        client = APIClient()
+        client.force_authenticate(self.first)
+        response = client.get(reverse("unstaking"))
+        self.assertEqual(response.data["results"][-1]["eta"], serializers.DateTimeField().to_representation(eta))
+
+        settle(current_epoch() + 1)
+        request.refresh_from_db()
+        self.assertEqual(settlement_eta(request), request.settled_at)
+
+
+@override_settings(ALLOWED_HOSTS=["testserver"], AUDIT_ASYNC=False, CACHES={
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "snapshots": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "snapshots"},
+})
+class SnapshotCacheTestCase(TestCase):
+    """Wallet and position detail reads served from the write-through snapshot cache."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username="staker", email="staker@example.com", is_staff=True)
+        cls.wallet = UserWallet.objects.get(user=cls.user)
+
+    def setUp(self):
+        snapshots.cache().clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def wallet_detail(self):
+        return self.client.get(reverse("wallets_detail", kwargs={"pk": self.wallet.pk})).json()
+
+    def test_reads_see_their_own_writes_without_querying_the_wallet(self):
+        self.assertEqual(self.wallet_detail()["balance"], "0.0000000000")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("wallets_replenish"), {"amount": "10"}, format="json")
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.wallet_detail()["balance"], "10.0000000000")
+        self.assertFalse([query for query in queries.captured_queries if "staking_app_userwallet" in query["sql"]])
+
+    def test_older_snapshots_do_not_replace_newer_ones(self):
+        key = snapshots.wallet_key(self.wallet.pk)
+        _, generation = snapshots.get(key)
+        snapshots.store(key, {"user": self.user.pk, "balance": "2"}, version=2)
+        snapshots.store(key, {"user": self.user.pk, "balance": "1"}, version=1)
+        snapshots.fill(key, {"user": self.user.pk, "balance": "0"}, generation)
+
+        self.assertEqual(self.wallet_detail()["balance"], "2")
+
+    def test_fills_racing_with_a_change_are_ignored(self):
+        key = snapshots.wallet_key(self.wallet.pk)
+        _, generation = snapshots.get(key)  # a read misses and queries the wallet...
+        with self.captureOnCommitCallbacks(execute=True):
+            credit_wallets({self.user.pk: 5})  # ...while another process credits it
+        snapshots.fill(key, {"user": self.user.pk, "balance": "0.0000000000"}, generation)
+
+        self.assertEqual(snapshots.get(key)[0], None)
+        self.assertEqual(self.wallet_detail()["balance"], "5.0000000000")
+        self.assertEqual(snapshots.get(key)[0]["balance"], "5.0000000000")
+
+    def test_set_based_credits_drop_the_snapshot(self):
+        self.wallet_detail()
+        with self.captureOnCommitCallbacks(execute=True):
+            credit_wallets({self.user.pk: 5})
+
+        self.assertEqual(self.wallet_detail()["balance"], "5.0000000000")
+
+
+@override_settings(ALLOWED_HOSTS=["testserver"], AUDIT_ASYNC=False)
+class SparseFieldsetTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username="staker", email="staker@example.com")
+        cls.user.wallet.replenish(1000)
+        conditions = PoolConditions(min_amount=100, max_amount=500)
+        conditions.save()
+        cls.pool = StackingPool.objects.create(name="Example Pool", conditions=conditions, capacity=10_000)
+        cls.position = UserPosition(user=User.objects.get(pk=cls.user.pk), pool=cls.pool, amount=200)
+        cls.position.save()
+
+    def setUp(self):
+        snapshots.cache().clear()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.get(pk=self.user.pk))
+
+    def test_requested_fields_narrow_the_output_and_the_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("positions"), {"fields": "id,amount"})
+        self.assertEqual(response.json(), [{"id": self.position.pk, "amount": "200.0000000000"}])
+        position_queries = [query["sql"] for query in queries.captured_queries if "userposition" in query["sql"]]
+        self.assertEqual(len(position_queries), 1)
+        self.assertNotIn('"pool_id"', position_queries[0])
+
+        response = self.client.get(reverse("positions_detail", kwargs={"pk": self.position.pk}), {"fields": "amount"})
+        self.assertEqual(response.json(), {"amount": "200.0000000000"})
+        response = self.client.get(reverse("user_detail", kwargs={"pk": self.user.pk}), {"fields": "email"})
+        self.assertEqual(response.json(), {"email": "staker@example.com"})
+
+    def test_fields_outside_the_whitelist_are_rejected(self):
+        response = self.client.get(reverse("positions"), {"fields": "id,secret"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("secret", response.json()["message"])
+        response = self.client.get(reverse("user_detail", kwargs={"pk": self.user.pk}), {"fields": "password"})
+        self.assertEqual(response.status_code, 400)
+
+
+class WaitedEvent(threading.Event):
+    """Event that sets `all_waiting` once `waiters` threads wait on it."""
+
+    def __init__(self, waiters):
+        super().__init__()
+        self.waiters = waiters
+        self.all_waiting = threading.Event()
+        self._lock = threading.Lock()
+
+    def wait(self, timeout=None):
+        with self._lock:
+            self.waiters -= 1
+            if self.waiters == 0:
+                self.all_waiting.set()
+        return super().wait(timeout)
+
+
+class CoalescedView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+    started, release, calls = threading.Event(), threading.Event(), []
+
+    @single_flight()
+    def get(self, request):
+        self.calls.append(1)
+        self.started.set()
+        self.release.wait(5)
+        return Response({"pools": len(self.calls)}, status=202)
+
+
+class SingleFlightTestCase(SimpleTestCase):
+    def start_flight(self, flight, key, started, leader, followers):
+        """Start `leader` and, once it `started`, the `followers`. Returns the threads and the `WaitedEvent`."""
+        leader.start()
+        self.assertTrue(started.wait(5))
+        done = flight._calls[key].done = WaitedEvent(len(followers))
+        for thread in followers:
+            thread.start()
+        return [leader, *followers], done
+
+    def test_concurrent_calls_share_the_leader_result(self):
+        flight, started, release, calls, outcomes = SingleFlight(), threading.Event(), threading.Event(), [], []
+
+        def compute():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return "pools"
+
+        threads = [threading.Thread(target=lambda: outcomes.append(flight.do("key", compute, 5))) for _ in range(5)]
+        threads, done = self.start_flight(flight, "key", started, threads[0], threads[1:])
+        self.assertTrue(done.all_waiting.wait(5))
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(outcomes), [("pools", "leader")] + [("pools", "shared")] * 4)
+        self.assertEqual(flight.do("key", lambda: "again", 5), ("again", "leader"))
+
+    def test_followers_stop_waiting_after_the_timeout(self):
+        flight, started, release, calls, outcomes = SingleFlight(), threading.Event(), threading.Event(), [], []
+
+        def compute():
+            calls.append(1)
+            if len(calls) == 1:
+                started.set()
+                release.wait(5)
+                return "in flight"
+            return "own"
+
+        leader = threading.Thread(target=lambda: outcomes.append(flight.do("key", compute, 5)))
+        follower = threading.Thread(target=lambda: outcomes.append(flight.do("key", compute, 0.01)))
+        self.start_flight(flight, "key", started, leader, [follower])
+        follower.join()
+        release.set()
+        leader.join()
+        self.assertEqual(outcomes, [("own", "timeout"), ("in flight", "leader")])
+
+    def test_decorated_views_share_the_response_and_count_the_outcomes(self):
+        CoalescedView.started, CoalescedView.release, CoalescedView.calls = threading.Event(), threading.Event(), []
+        view = CoalescedView.as_view()
+        staff, user = User(pk=1, is_staff=True), User(pk=2)
+        before = metrics.process_samples()
+        responses = []
+
+        def get(as_user):
+            request = APIRequestFactory().get("/pools/?page=1")
+            force_authenticate(request, as_user)
+            responses.append(view(request))
+
+        key = ("CoalescedView", "staff", "/pools/?page=1")
+        threads = [threading.Thread(target=get, args=[staff]) for _ in range(4)]
+        threads, done = self.start_flight(flights, key, CoalescedView.started, threads[0], threads[1:])
+        self.assertTrue(done.all_waiting.wait(5))
+        CoalescedView.release.set()
+        for thread in threads:
+            thread.join()
+        get(user)  # another auth scope: not shared
+
+        self.assertEqual([(response.status_code, response.data) for response in responses],
+                         [(202, {"pools": 1})] * 4 + [(202, {"pools": 2})])
+        after = metrics.process_samples()
+        for outcome, count in [("leader", 2), ("shared", 3), ("timeout", 0)]:
+            key = ("single_flight_requests_total", ("CoalescedView", outcome))
+            self.assertEqual(after.get(key, 0) - before.get(key, 0), count, outcome)
+
+
+@override_settings(ALLOWED_HOSTS=["testserver"], AUDIT_ASYNC=False, BATCH_FETCH_MAX_IDS=3)
+class BatchFetchTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username="staker", email="staker@example.com")
+        cls.other = User.objects.create(username="other", email="other@example.com")
+        conditions = PoolConditions(min_amount=100, max_amount=500)
+        conditions.save()
+        pool = StackingPool.objects.create(name="Example Pool", conditions=conditions)
+        cls.positions = {}
+        for user in [cls.user, cls.other]:
+            user.wallet.replenish(1000)
+            position = UserPosition(user=User.objects.get(pk=user.pk), pool=pool, amount=200)
+            position.save()
+            cls.positions[user.username] = position.pk
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.get(pk=self.user.pk))
+
+    def test_positions_of_other_users_are_reported_missing(self):
+        own, other = self.positions["staker"], self.positions["other"]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("positions_by_ids"), {"ids": f"{other},{own},404", "fields": "id"})
+        self.assertEqual(response.json(), {"results": [{"id": own}], "missing": [other, 404]})
+        self.assertEqual(len([query for query in queries.captured_queries if "userposition" in query["sql"]]), 1)
+
+        response = self.client.get(reverse("user_by_ids"), {"ids": f"{self.other.pk},{self.user.pk}"})
+        self.assertEqual([user["id"] for user in response.json()["results"]], [self.user.pk])
+        self.assertEqual(response.json()["missing"], [self.other.pk])
+
+    def test_invalid_and_oversized_id_lists_are_rejected(self):
+        for ids in ["", "1,a", "1,2,3,4", "99999999999999999999", "0", "1,-2"]:
+            response = self.client.get(reverse("positions_by_ids"), {"ids": ids})
+            self.assertEqual(response.status_code, 400, ids)
+        response = self.client.get(reverse("positions_by_ids"), {"ids": str(2 ** 63)})
+        self.assertEqual(response.json(), {"message": "ids must be between 1 and 9223372036854775807"})
+        response = self.client.get(reverse("positions_by_ids"), {"ids": str(2 ** 63 - 1)})
+        self.assertEqual(response.json()["missing"], [2 ** 63 - 1])
+        self.assertEqual(self.client.delete(reverse("positions_by_ids")).status_code, 405)
+
+
+class WarmupTestCase(TestCase):
+    def test_every_step_runs_and_time_to_ready_is_logged(self):
+        with self.assertLogs("warmup", "INFO") as logs:
+            timings = warmup()
+        self.assertEqual(list(timings), ["urls", "serializers", "api_docs", "databases", "catalog"])
+        self.assertEqual(len(logs.records), 1)  # no failed step
+        self.assertIn("ready in", logs.output[0])
+
+
+class FastJSONTestCase(TestCase):
+    def test_output_matches_the_drf_renderer(self):
+        data = {
+            "amount": Decimal("200.0000000001"), "at": timezone.now(), "day": timezone.now().date(),
+            "name": "pool\u2028ünï", 1: [None, True, 1.5, 2 ** 70],
+        }
+        for payload in [data, [data], {"nested": data}]:
+            self.assertEqual(FastJSONRenderer().render(payload), JSONRenderer().render(payload))
+        self.assertEqual(FastJSONRenderer().render(data, "application/json; indent=2"),
+                         JSONRenderer().render(data, "application/json; indent=2"))
+
+    def test_parser_matches_the_drf_parser(self):
+        body = b'{"amount": "10.5", "rate": 0.1, "big": 123456789012345678901234567890, "name": "\xc3\xbc"}'
+        self.assertEqual(FastJSONParser().parse(io.BytesIO(body)), JSONParser().parse(io.BytesIO(body)))
+        for number in [-9999999999999999999, -2 ** 63, 2 ** 64 - 1, 10 ** 20]:
+            self.assertEqual(FastJSONParser().parse(io.BytesIO(b'{"n": %d}' % number)), {"n": number})
+        with self.assertRaisesMessage(ParseError, "JSON parse error - Expecting value"):
+            FastJSONParser().parse(io.BytesIO(b'{"amount": }'))
+
+
+class SnapshotFileTestCase(TestCase):
+    def dump_tables(self):
+        return {model: list(model.objects.order_by("pk").values()) for model in snapshot_models()}
+
+    def test_import_restores_the_exported_rows(self):
+        user = User.objects.create(username="staker", email="staker@example.com")
+        User.objects.create(username="other", email="other@example.com", last_login=None)
+        user.wallet.replenish(1000)
+        conditions = PoolConditions(min_amount=100, max_amount=500, reward_rate=Decimal("0.00125"))
+        conditions.save()
+        pool = StackingPool.objects.create(name="Capped Pool", conditions=conditions, capacity=10_000)
+        position = UserPosition(user=User.objects.get(pk=user.pk), pool=pool, amount=Decimal("200.0000000001"))
+        position.save()
+        UserPosition.objects.get(pk=position.pk).decrease_position(50)
+        expected = self.dump_tables()
+
+        snapshot = io.BytesIO()
+        export_snapshot(snapshot, chunk_size=1)
+        for model in reversed(snapshot_models()):
+            model.objects.all().delete()
+        snapshot.seek(0)
+        totals = import_snapshot(snapshot)
+
+        self.assertEqual(self.dump_tables(), expected)
+        self.assertEqual(totals["staking_app_userposition"], 1)
+        self.assertEqual(totals["staking_app_poolcapacityshard"], 8)
+
+    def test_import_refuses_tables_with_rows(self):
+        User.objects.create(username="staker", email="staker@example.com")
+        snapshot = io.BytesIO()
+        export_snapshot(snapshot)
+        snapshot.seek(0)
+        with self.assertRaisesMessage(SnapshotFormatError, "users_user is not empty"):
+            import_snapshot(snapshot)
+
+
+class SnapshotExportTransactionTestCase(TransactionTestCase):
+    def test_tables_are_exported_in_one_transaction(self):
+        User.objects.create(username="staker", email="staker@example.com")
+        blocks = []
+
+        def progress(table, rows):
+            blocks.append((table, connection.in_atomic_block))
+
+        export_snapshot(io.BytesIO(), progress=progress)
+        self.assertIn(("users_user", True), blocks)
+        self.assertTrue(all(in_transaction for _, in_transaction in blocks))
+        self.assertFalse(connection.in_atomic_block)
+
+
+def url_names(patterns):
+    names = set()
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            names |= url_names(pattern.url_patterns)
+        elif pattern.name:
+            names.add(pattern.name)
+    return names
+
+
+def make_case(case):
+    def test(self):
+        self.assertNoFullScans(*case)
+    return test
+
+
+for case in CASES:
+    setattr(QueryPlanTestCase, f"test_query_plan_{case[0]}", make_case(case))
+
+
+@override_settings(ALLOWED_HOSTS=["testserver"], AUDIT_ASYNC=False)
+class PositionArchiveTestCase(TransactionTestCase):
+    """Runs outside of a transaction: the archive tables are created on the fly."""
+
+    def setUp(self):
+        self.user = User.objects.create(username="staker", email="staker@example.com")
+        self.user.wallet.replenish(1000)
+        conditions = PoolConditions(min_amount=100, max_amount=500)
+        conditions.save()
+        self.pool = StackingPool.objects.create(name="Example Pool", conditions=conditions)
+        self.addCleanup(self.drop_partitions)
+
+    def drop_partitions(self):
+        with connection.schema_editor() as schema_editor:
+            for month in archive.existing_months():
+                schema_editor.delete_model(archive.partition(month))
+        archive._existing_tables.clear()
+
+    def open_position(self, amount):
+        position = UserPosition(user=User.objects.get(pk=self.user.pk), pool=self.pool, amount=amount)
+        position.save()
+        return position
+
+    def test_closed_positions_are_moved_to_the_archive(self):
+        kept = self.open_position(100)
+        closed = self.open_position(200)
+        closed_pk = closed.pk
+        closed.delete()
+        close_positions(UserPosition.objects.filter(pk=self.open_position(300).pk))
+        self.assertEqual(ClosedPosition.objects.count(), 2)
+
+        self.assertEqual(archive.archive(batch_size=1), 2)
+        self.assertEqual(archive.archive(), 0)
+        self.assertEqual(ClosedPosition.objects.count(), 0)
+        self.assertEqual(list(UserPosition.objects.values_list("pk", flat=True)), [kept.pk])
+        month = archive.month_of(timezone.now())
+        self.assertEqual(archive.existing_months(), [month])
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get(reverse("positions_archive"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item["amount"] for item in response.data["results"]], ["300.0000000000", "200.0000000000"])
+        self.assertEqual(response.data["results"][1]["id"], closed_pk)
+
+        staged = self.open_position(400)
+        staged_pk = staged.pk
+        staged.delete()
+        response = client.get(reverse("positions_archive"), {"fields": "id,amount,archived_at"})
+        self.assertEqual([(item["id"], item["archived_at"] is None) for item in response.data["results"]],
+                         [(staged_pk, True), (closed_pk + 1, False), (closed_pk, False)])
+        self.assertEqual(response.data["count"], 3)
+        positions = archive.archived_positions(month, self.user.id)
+        self.assertEqual([position.amount for position in positions[0:2] + positions[2:10]], [400, 300, 200])
+        self.assertEqual([position.amount for position in positions[1:2]], [300])
+
+        previous = client.get(reverse("positions_archive"), {"month": "2001-01"})
+        self.assertEqual(previous.data["results"], [])
+        self.assertEqual(client.get(reverse("positions_archive"), {"month": "January"}).status_code, 400)
+
+    def test_archiving_another_position_under_an_archived_id_fails(self):
+        closed = self.open_position(200)
+        closed.delete()
+        self.assertEqual(archive.archive(), 1)
+        archived = archive.partition(archive.month_of(timezone.now())).objects.get()
+
+        # A batch cut by a crash is archived again
+        ClosedPosition.objects.create(id=archived.id, user_id=archived.user_id, pool_id=archived.pool_id,
+                                      amount=archived.amount, version=archived.version)
+        ClosedPosition.objects.update(closed_at=archived.closed_at)
+        self.assertEqual(archive.archive(), 1)
+        self.assertEqual(ClosedPosition.objects.count(), 0)
+
+        # Another position with the same id is not dropped
+        other = User.objects.create(username="other", email="other@example.com")
+        ClosedPosition.objects.create(id=archived.id, user_id=other.pk, pool_id=self.pool.pk, amount=300)
+        with self.assertRaisesMessage(ArchiveConflictException, f"Position {archived.id} closed at"):
+            archive.archive()
+        with self.assertRaisesMessage(CommandError, "holds another position with that id"):
+            call_command("archive_positions", stdout=io.StringIO())
+        self.assertEqual(ClosedPosition.objects.get().user_id, other.pk)
+        self.assertEqual(archive.partition(archive.month_of(timezone.now())).objects.get().amount, 200)
+
+    def test_import_moves_position_ids_past_the_archived_ones(self):
+        kept = self.open_position(100)
+        closed = self.open_position(200)
+        closed_pk = closed.pk
+        closed.delete()
+        archive.archive()
+
+        snapshot = io.BytesIO()
+        export_snapshot(snapshot)
+        snapshot.seek(0)
+        call_command("flush", interactive=False, verbosity=0)
+        import_snapshot(snapshot)
+
+        self.assertEqual(list(UserPosition.objects.values_list("pk", flat=True)), [kept.pk])
+        self.assertGreater(self.open_position(300).pk, closed_pk)
+
+
+class StubBroadcaster:
+    """Hands out subscriptions without starting the outbox reader, events are pushed by the test."""
+
+    def __init__(self, queue_size=10):
+        self.queue_size = queue_size
+        self.subscriptions = []
+
+    def subscribe(self, user_id, loop=None):
+        subscription = streaming.Subscription(user_id, self.queue_size, loop)
+        self.subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self.subscriptions.remove(subscription)
+
+
+@override_settings(STAKING_STREAM_HEARTBEAT_INTERVAL=0.01)
+class EventStreamTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username="staker", email="staker@example.com")
+        cls.wallet = UserWallet.objects.get(user=cls.user)
+
+    def replenish(self, amount):
+        self.wallet.replenish(amount)
+        return OutboxEvent.objects.filter(user=self.user).latest("id")
+
+    def test_mutations_write_outbox_events(self):
+        conditions = PoolConditions(min_amount=100, max_amount=500)
+        conditions.save()
+        pool = StackingPool.objects.create(name="Example Pool", conditions=conditions)
+        self.replenish(1000)
+        position = UserPosition(user=User.objects.get(pk=self.user.pk), pool=pool, amount=200)
+        position.save()
+
+        events = list(OutboxEvent.objects.filter(user=self.user).order_by("id").values_list("kind", "payload"))
+        self.assertEqual(events, [
+            (OutboxEvent.WALLET_CHANGED, {"wallet": self.wallet.pk, "balance": "1000.0000000000"}),
+            (OutboxEvent.WALLET_CHANGED, {"wallet": self.wallet.pk, "balance": "800.0000000000"}),
+            (OutboxEvent.POSITION_CHANGED, {"position": position.pk, "pool": pool.pk, "amount": "200.0000000000"}),
+        ])
+
+    def test_stream_resumes_after_the_last_event_id(self):
+        first, second = self.replenish(10), self.replenish(20)
+        broadcaster = StubBroadcaster()
+        stream = streaming.event_stream(broadcaster, self.user.pk, last_event_id=first.id)
+
+        self.assertEqual(next(stream), streaming.format_event(second))
+        self.assertEqual(next(stream), ": connected\n\n")
+        third = self.replenish(30)
+        subscription = broadcaster.subscriptions[0]
+        for event in [first, second, third]:  # already sent in the backlog, then live
+            subscription.push(event)
+        self.assertEqual(next(stream), streaming.format_event(third))
+        self.assertEqual(next(stream), ": keep-alive\n\n")
+        stream.close()
+        self.assertEqual(broadcaster.subscriptions, [])
+
+    def test_overflowing_subscriber_is_told_to_reset(self):
+        broadcaster = StubBroadcaster(queue_size=1)
+        stream = streaming.event_stream(broadcaster, self.user.pk)
+        self.assertEqual(next(stream), ": connected\n\n")
+        first, second = self.replenish(10), self.replenish(20)
+        broadcaster.subscriptions[0].push(first)
+        broadcaster.subscriptions[0].push(second)
+
+        reset = next(stream)
+        self.assertTrue(reset.startswith("retry: "))
+        self.assertIn("event: reset\n", reset)
+        self.assertIn(f'"last_event_id": {first.id - 1}', reset)
+        self.assertEqual(list(stream), [])
+        self.assertEqual(broadcaster.subscriptions, [])
+
+    @override_settings(STAKING_STREAM_BATCH_SIZE=2)
+    def test_backlog_is_read_in_batches(self):
+        first, *rest = [self.replenish(amount) for amount in range(10, 70, 10)]
+        stream = streaming.event_stream(StubBroadcaster(), self.user.pk, last_event_id=first.id)
+
+        with CaptureQueriesContext(connection) as queries:
+            frames = [next(stream) for _ in range(len(rest) + 1)]
+        self.assertEqual(frames, [streaming.format_event(event) for event in rest] + [": connected\n\n"])
+        self.assertEqual(len(queries), 3)  # 2 + 2 + 1 events
+        self.assertTrue(all("LIMIT 2" in query["sql"] for query in queries))
+        stream.close()
+
+    def test_async_stream_waits_for_events_on_the_event_loop(self):
+        first, second = self.replenish(10), self.replenish(20)
+        live = OutboxEvent(id=second.id + 100, user=self.user, kind=OutboxEvent.WALLET_CHANGED, payload={})
+        broadcaster = StubBroadcaster()
+
+        async def read():
+            stream = streaming.async_event_stream(broadcaster, self.user.pk, last_event_id=first.id)
+            frames = [await anext(stream), await anext(stream), await anext(stream)]
+            # The outbox reader pushes from its own thread
+            threading.Thread(target=broadcaster.subscriptions[0].push, args=[live]).start()
+            frames.append(await anext(stream))
+            await stream.aclose()
+            return frames
+
+        self.assertEqual(async_to_sync(read)(), [
+            streaming.format_event(second), ": connected\n\n", ": keep-alive\n\n", streaming.format_event(live),
+        ])
+        self.assertEqual(broadcaster.subscriptions, [])
+
+    @override_settings(ALLOWED_HOSTS=["testserver"], AUDIT_ASYNC=False)
+    async def test_view_streams_asynchronously_under_asgi(self):
+        first, second = await sync_to_async(self.replenish)(10), await sync_to_async(self.replenish)(20)
+        await sync_to_async(self.async_client.force_login)(self.user)
+
+        with mock.patch.object(streaming, "broadcaster", StubBroadcaster()):
+            response = await self.async_client.get(reverse("stream"), headers={"Last-Event-ID": str(first.id)})
+            self.assertTrue(response.is_async)
+            frames = aiter(response.streaming_content)
+            self.assertEqual(await anext(frames), streaming.format_event(second).encode())
+            self.assertEqual(await anext(frames), b": connected\n\n")
+            await frames.aclose()
+
+    @override_settings(ALLOWED_HOSTS=["testserver"], AUDIT_ASYNC=False)
+    def test_view_rejects_event_ids_beyond_the_id_range(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        for last_event_id in ["12345678901234567890123", str(2 ** 63), "-1", "1e3", "\u00b2"]:
+            with self.subTest(last_event_id=last_event_id):
+                response = client.get(
+                    reverse("stream"), HTTP_LAST_EVENT_ID=last_event_id, HTTP_ACCEPT="application/json")
+                self.assertEqual(response.status_code, 412)
+                self.assertIn("between 0 and", response.json()["message"])
+
+    @override_settings(ALLOWED_HOSTS=["testserver"], AUDIT_ASYNC=False)
+    def test_view_limits_the_sync_streams(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        broadcaster = streaming.OutboxBroadcaster(poll_interval=1, batch_size=10, queue_size=10, max_sync_streams=1)
+        with mock.patch.object(streaming, "broadcaster", broadcaster):
+            first = client.get(reverse("stream"), HTTP_LAST_EVENT_ID=str(2 ** 63 - 1))
+            self.assertEqual(first.status_code, 200)
+            busy = client.get(reverse("stream"))
+            self.assertEqual(busy.status_code, 503)
+            self.assertEqual(busy["Retry-After"], "5")
+            first.close()  # the client went away without reading: the slot is released all the same
+            self.assertEqual(client.get(reverse("stream")).status_code, 200)
+
+
+class MoneyTestCase(SimpleTestCase):
+    def test_amounts_convert_to_base_units(self):
+        self.assertEqual(to_units(3), 30_000_000_000)
+        self.assertEqual(to_units(Decimal("0.00000000015")), 2)  # half-even at the 10th decimal
+        self.assertEqual(to_units(Decimal("0.00000000025")), 2)
+        self.assertEqual(to_units("-1.5"), -15_000_000_000)
+        self.assertEqual(to_units(0.1), 1_000_000_000)
+        self.assertEqual(to_units(MAX_AMOUNT), MAX_UNITS)
+
+    def test_amounts_render_with_ten_decimals(self):
+        self.assertEqual(format_amount(Decimal("200")), "200.0000000000")
+        self.assertEqual(format_amount(Decimal("-0.5")), "-0.5000000000")
+        self.assertEqual(format_amount(7), "7.0000000000")
+        self.assertEqual(format_units(-1), "-0.0000000001")
+        self.assertEqual(format_units(MAX_UNITS), "922337203.6854775807")
+
+    def test_amounts_out_of_range_are_rejected(self):
+        with self.assertRaisesMessage(ValueError, "out of the supported money range"):
+            MoneyField().get_prep_value(MAX_AMOUNT + Decimal("0.0000000001"))
+        form_field = MoneyField().formfield()
+        self.assertEqual(form_field.clean(str(MAX_AMOUNT)), MAX_AMOUNT)
+        with self.assertRaises(forms.ValidationError):
+            form_field.clean("999999999")
+
+
+@override_settings(ALLOWED_HOSTS=["testserver"], AUDIT_ASYNC=False)
+class MoneyRangeTestCase(TestCase):
+    def test_amount_inputs_beyond_the_money_range_are_rejected(self):
+        user = User.objects.create(username="staker", email="staker@example.com")
+        conditions = PoolConditions(min_amount=100, max_amount=500)
+        conditions.save()
+        pool = StackingPool.objects.create(name="Example Pool", conditions=conditions)
+        user.wallet.replenish(1000)
+        position = UserPosition(user=User.objects.get(pk=user.pk), pool=pool, amount=200)
+        position.save()
+        client = APIClient()
+        client.force_authenticate(User.objects.get(pk=user.pk))
+
+        for name, kwargs in [
+            ("wallets_replenish", {}), ("wallets_withdraw", {}),
+            ("positions_increase", {"pk": position.pk}), ("positions_decrease", {"pk": position.pk}),
+        ]:
+            response = client.post(reverse(name, kwargs=kwargs), {"amount": "5000000000"}, format="json")
+            self.assertEqual(response.status_code, 412, name)
+            self.assertIn("less than or equal to", response.json()["message"]["amount"][0])
+        response = client.post(reverse("batch"), {"operations": [{"op": "replenish", "amount": "5000000000"}]},
+                               format="json")
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(UserWallet.objects.get(user=user).balance, 800)
+
+
+class MoneyMigrationTestCase(TransactionTestCase):
+    """Seeds the decimal columns of 0002 and converts them to base units with 0003."""
+    decimals = [("staking_app", "0002_outboxevent")]
+    base_units = [("staking_app", "0003_money_base_units")]
+    # SQLite keeps decimals as floats read back with 15 significant digits: the largest amount
+    # below MAX_AMOUNT it can hold (PostgreSQL converts MAX_AMOUNT itself)
+    largest = Decimal("922337203.685477")
+
+    def setUp(self):
+        self.migrate(self.decimals)
+        self.addCleanup(self.migrate, None)
+        apps = MigrationExecutor(connection).loader.project_state(self.decimals).apps
+        user = apps.get_model("users", "User").objects.create(username="staker", email="staker@example.com")
+        self.wallet = apps.get_model("staking_app", "UserWallet").objects.create(user=user, balance=self.largest)
+        self.conditions = apps.get_model("staking_app", "PoolConditions").objects.create(
+            min_amount=Decimal("0.0000000001"), max_amount=-self.largest)
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets or executor.loader.graph.leaf_nodes())
+
+    def test_amounts_within_the_range_are_converted_exactly(self):
+        self.migrate(self.base_units)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT balance FROM staking_app_userwallet WHERE id = %s", [self.wallet.pk])
+            self.assertEqual(cursor.fetchone()[0], to_units(self.largest))
+            cursor.execute("SELECT min_amount, max_amount FROM staking_app_poolconditions")
+            self.assertEqual(cursor.fetchone(), (1, -to_units(self.largest)))
+
+    def test_amounts_beyond_the_range_stop_the_migration_before_any_copy(self):
+        type(self.conditions).objects.filter(pk=self.conditions.pk).update(max_amount=Decimal("5000000000"))
+        type(self.wallet).objects.filter(pk=self.wallet.pk).update(balance=Decimal("922337203.685478"))
+
+        with self.assertRaisesMessage(CommandError, "2 money amounts are beyond") as raised:
+            self.migrate(self.base_units)
+        self.assertIn(f"UserWallet(pk={self.wallet.pk}).balance = 922337203.6854780000", str(raised.exception))
+        self.assertIn(f"PoolConditions(pk={self.conditions.pk}).max_amount = 5000000000.0000000000",
+                      str(raised.exception))
+        self.assertNotIn("min_amount", str(raised.exception))
+        applied = MigrationExecutor(connection).loader.applied_migrations
+        self.assertNotIn(self.base_units[0], applied)  # rolled back, the decimal columns are untouched
+        self.assertEqual(type(self.wallet).objects.get().balance, Decimal("922337203.685478"))
+
+        type(self.conditions).objects.update(max_amount=1000)
+        type(self.wallet).objects.update(balance=self.largest)
+        self.migrate(self.base_units)  # goes through once the rows are fixed
+
+
+@override_settings(ALLOWED_HOSTS=["testserver"], AUDIT_ASYNC=False)
+class RewardSimulationTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create(username="admin", email="admin@example.com", is_staff=True)
+        cls.small = User.objects.create(username="small", email="small@example.com")
+        cls.large = User.objects.create(username="large", email="large@example.com")
+        conditions = PoolConditions(min_amount=100, max_amount=500, reward_rate=Decimal("0.01"))
+        conditions.save()
+        cls.pool = StackingPool.objects.create(name="Example Pool", conditions=conditions)
+        for user, amount in [(cls.small, 200), (cls.large, 490)]:
+            user.wallet.replenish(1000)
+            UserPosition(user=User.objects.get(pk=user.pk), pool=cls.pool, amount=amount).save()
+
+    def user_rewards(self, scenario):
+        return {item["user"]: round(item["rewards"], 6) for item in scenario["users"]["top"]}
+
+    def test_simple_rewards_under_each_scenario(self):
+        result = simulate([{"name": "up", "rates": {self.pool.pk: Decimal("0.05")}}], epochs=2)
+
+        self.assertEqual(result["positions"], 2)
+        baseline, up = result["scenarios"]
+        self.assertEqual(baseline["name"], "baseline")
+        self.assertEqual(self.user_rewards(baseline), {self.large.pk: 9.8, self.small.pk: 4.0})
+        self.assertEqual(self.user_rewards(up), {self.large.pk: 49.0, self.small.pk: 20.0})
+        self.assertAlmostEqual(up["pools"][0]["staked"], 690)
+        self.assertAlmostEqual(up["total_rewards"], 69)
+
+    def test_compounding_is_capped_at_the_pool_max(self):
+        result = simulate([{"name": "up", "rates": {self.pool.pk: Decimal("0.05")}}], epochs=2, compound=True)
+
+        baseline, up = result["scenarios"]
+        self.assertEqual(self.user_rewards(baseline), {self.large.pk: 9.849, self.small.pk: 4.02})
+        # 490 grows to the 500 max, the rest of both rewards (14.5 then 25) is paid out
+        self.assertEqual(self.user_rewards(up), {self.large.pk: 49.5, self.small.pk: 20.5})
+
+    def test_endpoint_is_admin_only_and_validates_scenarios(self):
+        client = APIClient()
+        url = reverse("simulate")
+        data = {"epochs": 2, "scenarios": [{"name": "up", "rates": {str(self.pool.pk): "0.05"}}]}
+        client.force_authenticate(self.small)
+        self.assertEqual(client.post(url, data, format="json").status_code, 403)
+
+        client.force_authenticate(self.admin)
+        response = client.post(url, data, format="json")
+        self.assertEqual(response.status_code, 202)  # projected in a job, not inside the request
+        self.assertEqual(queue.work(once=True), 1)
+        job = client.get(reverse("jobs_detail", kwargs={"pk": response.data["job"]})).json()
+        self.assertEqual(job["status"], "succeeded")
+        self.assertEqual([scenario["name"] for scenario in job["result"]["scenarios"]], ["baseline", "up"])
+        self.assertAlmostEqual(job["result"]["scenarios"][1]["total_rewards"], 69)
+
+        for invalid in [{**data, "epochs": 0}, {**data, "scenarios": [{"name": "up", "rates": {"pool": "0.05"}}]}]:
+            self.assertEqual(client.post(url, invalid, format="json").status_code, 412)
+
+
+class GenerateLoadDataTestCase(TestCase):
+    def generate(self, **options):
+        call_command("generate_load_data", users=300, pools=4, conditions=3, batch_size=100, stdout=io.StringIO(),
+                     **options)
+
+    def test_generated_rows_and_capacity_of_capped_pools(self):
+        self.generate(capped_pools=0.5)
+
+        self.assertEqual(User.objects.count(), 300)
+        self.assertEqual(UserWallet.objects.count(), 300)
+        self.assertGreater(UserPosition.objects.count(), 300)
+        capped = StackingPool.objects.filter(capacity__isnull=False)
+        self.assertEqual(capped.count(), 2)
+        for pool in capped:
+            staked = sum(UserPosition.objects.filter(pool=pool).values_list("amount", flat=True))
+            shards = PoolCapacityShard.objects.filter(pool=pool)
+            self.assertLessEqual(staked, pool.capacity)
+            self.assertEqual(sum(shard.reserved for shard in shards), staked)
+            self.assertEqual(sum(shard.quota for shard in shards), pool.capacity)
+        self.assertFalse(PoolCapacityShard.objects.exclude(pool__in=capped).exists())
+
+    def test_same_seed_generates_the_same_positions(self):
+        self.generate(seed=7)
+        first = list(UserPosition.objects.order_by("pk").values_list("amount", flat=True))
+        for model in [UserPosition, UserWallet, User, StackingPool, PoolConditions]:
+            model.objects.all().delete()
+        self.generate(seed=7)
+        self.assertEqual(list(UserPosition.objects.order_by("pk").values_list("amount", flat=True)), first)
+
+
+@override_settings(ALLOWED_HOSTS=["testserver"], AUDIT_ASYNC=False)
+class BatchOperationsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username="staker", email="staker@example.com")
+        cls.user.wallet.replenish(1000)
+        conditions = PoolConditions(min_amount=100, max_amount=500)
+        conditions.save()
+        cls.pool = StackingPool.objects.create(name="Example Pool", conditions=conditions)
+        cls.full_pool = StackingPool.objects.create(name="Full Pool", conditions=conditions, capacity=100)
+        position = UserPosition(user=User.objects.get(pk=cls.user.pk), pool=cls.pool, amount=200)
+        position.save()
+        cls.position_id = position.pk
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.get(pk=self.user.pk))
+
+    def batch(self, *operations):
+        return self.client.post(reverse("batch"), {"operations": list(operations)}, format="json")
+
+    def state(self):
+        return (
+            UserWallet.objects.get(user=self.user).balance,
+            list(UserPosition.objects.order_by("pk").values_list("pk", "amount")),
+            OutboxEvent.objects.count(),
+        )
+
+    def test_operations_run_in_order(self):
+        response = self.batch(
+            {"op": "replenish", "amount": "100"},
+            {"op": "create_position", "pool": self.pool.pk, "amount": "150"},
+            {"op": "increase_position", "position": self.position_id, "amount": "10"},
+        )
+
+        self.assertEqual(response.status_code, 200, response.content)
+        results = response.json()["message"]
+        self.assertEqual([result["balance"] for result in results],
+                         ["900.0000000000", "750.0000000000", "740.0000000000"])
+        self.assertEqual(results[2], {"op": "increase_position", "balance": "740.0000000000",
+                                      "position": self.position_id, "amount": "210.0000000000"})
+        self.assertEqual(UserWallet.objects.get(user=self.user).balance, 740)
+
+    def test_a_failing_operation_rolls_back_the_whole_batch(self):
+        before = self.state()
+        for failing, message in [
+            ({"op": "increase_position", "position": self.position_id, "amount": "1000"}, "Effective amount too large"),
+            ({"op": "decrease_position", "position": 404, "amount": "10"}, "Position not found"),
+            ({"op": "create_position", "pool": self.full_pool.pk, "amount": "150"}, "Pool capacity exceeded"),
+        ]:
+            response = self.batch(
+                {"op": "replenish", "amount": "100"},
+                {"op": "create_position", "pool": self.pool.pk, "amount": "150"},
+                failing,
+            )
+            self.assertEqual(response.status_code, 400, failing)
+            self.assertEqual(response.json()["failed_operation"], 2)
+            self.assertIn(message, response.json()["message"])
+            self.assertEqual(self.state(), before)
+
+    def test_caught_model_exceptions_leave_the_transaction_usable(self):
+        with transaction.atomic():
+            with self.assertRaises(PoolCapacityException):
+                UserPosition(user=User.objects.get(pk=self.user.pk), pool=self.full_pool, amount=150).save()
+            poor = User.objects.create(username="poor", email="poor@example.com")
+            with self.assertRaises(UserPositionException):
+                UserPosition(user=poor, pool=self.pool, amount=150).save()
+            self.assertEqual(UserWallet.objects.get(user=self.user).balance, 800)
+
+
+class EstimatedCountPaginatorTestCase(TestCase):
+    def test_large_unfiltered_tables_are_estimated(self):
+        conditions = [PoolConditions(min_amount=1, max_amount=index + 2) for index in range(5)]
+        PoolConditions.objects.bulk_create(conditions)
+        PoolConditions.objects.filter(max_amount__in=[2, 3]).delete()
+        queryset = PoolConditions.objects.order_by("pk")
+
+        with mock.patch("base.pagination.ESTIMATE_THRESHOLD", 2):
+            # The largest rowid: exact until rows are deleted, then an over-estimate
+            self.assertEqual(EstimatedCountPaginator(queryset, 2).count, 5)
+            self.assertEqual(EstimatedCountPaginator(queryset.filter(max_amount__gt=3), 2).count, 3)
+        self.assertEqual(EstimatedCountPaginator(queryset, 2).count, 3)
+
+
+@override_settings(ALLOWED_HOSTS=["testserver"], AUDIT_ASYNC=False)
+class StakingAdminTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create(username="admin", email="admin@example.com", is_staff=True, is_superuser=True)
+        cls.user = User.objects.create(username="staker", email="staker@example.com")
+        cls.user.wallet.replenish(1000)
+        cls.conditions = PoolConditions(min_amount=100, max_amount=500)
+        cls.conditions.save()
+        cls.pool = StackingPool.objects.create(name="Example Pool", conditions=cls.conditions, capacity=1000)
+        for amount in [200, 300]:
+            UserPosition(user=User.objects.get(pk=cls.user.pk), pool=cls.pool, amount=amount).save()
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def balance(self):
+        return UserWallet.objects.get(user=self.user).balance
+
+    def test_deleting_a_pool_refunds_its_positions(self):
+        response = self.client.post(reverse("admin:staking_app_stackingpool_delete", args=[self.pool.pk]),
+                                    {"post": "yes"})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(StackingPool.objects.filter(pk=self.pool.pk).exists())
+        self.assertEqual(ClosedPosition.objects.count(), 2)
+        # The refunds go through the unstaking queue like any other close
+        self.assertEqual(self.balance(), 500)
+        self.assertEqual(settle(current_epoch() + 1), 2)
+        self.assertEqual(self.balance(), 1000)
+
+    def test_deleting_conditions_refunds_the_positions_of_their_pools(self):
+        response = self.client.post(reverse("admin:staking_app_poolconditions_delete", args=[self.conditions.pk]),
+                                    {"post": "yes"})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(StackingPool.objects.exists())
+        self.assertEqual(settle(current_epoch() + 1), 2)
+        self.assertEqual(self.balance(), 1000)
+
+    def test_bulk_deletes_are_replaced_by_refunding_actions(self):
+        request = self.client.get(reverse("admin:staking_app_userposition_changelist")).wsgi_request
+        for model in [StackingPool, PoolConditions, UserPosition]:
+            self.assertNotIn("delete_selected", admin.site._registry[model].get_actions(request))
+
+        position = UserPosition.objects.order_by("pk").first()
+        response = self.client.post(reverse("admin:staking_app_userposition_changelist"), {
+            "action": "refund_and_close", "_selected_action": [position.pk]})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(capacity.reserved_amount(self.pool.pk), 300)
+        request = UnstakeRequest.objects.get()
+        self.assertEqual((request.user_id, request.amount, request.closes_position), (self.user.pk, 200, True))
+        self.assertEqual(settle(current_epoch() + 1), 1)
+        self.assertEqual(self.balance(), 700)
+
+
+class PoolCapacityTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.conditions = PoolConditions(min_amount=100, max_amount=500)
+        cls.conditions.save()
+        cls.pool = StackingPool.objects.create(name="Capped Pool", conditions=cls.conditions, capacity=1000)
+
+    def shards(self):
+        return list(PoolCapacityShard.objects.filter(pool=self.pool).order_by("shard").values_list("reserved", "quota"))
+
+    def test_reservations_fit_into_the_shard_quotas(self):
+        shards = self.shards()
+        self.assertEqual(len(shards), 8)
+        self.assertEqual(sum(quota for _, quota in shards), 1000)
+
+        capacity.reserve(self.pool, 100)
+        capacity.reserve(self.pool, 100)
+        self.assertEqual(sum(reserved for reserved, _ in self.shards()), 200)
+        self.assertTrue(all(reserved <= quota for reserved, quota in self.shards()))
+
+    def test_a_reservation_larger_than_any_shard_rebalances_the_quotas(self):
+        capacity.reserve(self.pool, 500)  # every shard holds a quota of 125
+
+        shards = self.shards()
+        self.assertEqual(shards[0][0], 500)
+        self.assertEqual(sum(quota for _, quota in shards), 1000)
+        self.assertTrue(all(reserved <= quota for reserved, quota in shards))
+
+    def test_reservations_over_the_capacity_fail(self):
+        capacity.reserve(self.pool, 900)
+        before = self.shards()
+
+        with self.assertRaisesMessage(PoolCapacityException, "Available capacity is 100.0000000000"):
+            capacity.reserve(self.pool, 150)
+        self.assertEqual(self.shards(), before)
+
+    def test_released_amounts_drain_several_shards(self):
+        capacity.reserve(self.pool, 500)
+        capacity.reserve(self.pool, 100)
+
+        capacity.release(self.pool, 550)
+        self.assertEqual(sum(reserved for reserved, _ in self.shards()), 50)
+        capacity.release(self.pool, 50)
+        self.assertEqual(sum(reserved for reserved, _ in self.shards()), 0)
+        capacity.reserve(self.pool, 1000)
+
+    def test_uncapped_pools_skip_the_shard_queries(self):
+        pool = StackingPool.objects.create(name="Open Pool", conditions=self.conditions)
+        with self.assertNumQueries(0):
+            capacity.release(pool, 100)
+            capacity.reserve(pool, 100)
+        pool = StackingPool.objects.get(pk=pool.pk)
+        pool.name = "Renamed Pool"
+        with self.assertNumQueries(1):
+            pool.save()
+
+        self.pool.capacity = None
+        self.pool.save()
+        self.assertEqual(self.shards(), [])
+
+
+class CompoundingTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username="staker", email="staker@example.com")
+        cls.user.wallet.replenish(2000)
+        conditions = PoolConditions(min_amount=100, max_amount=2000, reward_rate=Decimal("0.01"))
+        conditions.save()
+        cls.full_pool = StackingPool.objects.create(name="Full Pool", conditions=conditions, capacity=1000)
+        cls.open_pool = StackingPool.objects.create(name="Open Pool", conditions=conditions)
+        for pool in [cls.full_pool, cls.open_pool]:
+            UserPosition(user=User.objects.get(pk=cls.user.pk), pool=pool, amount=1000).save()
+
+    def test_rewards_are_restaked(self):
+        checkpoint = compound_pool(self.open_pool.pk, epoch=1, chunk_size=10)
+
+        self.assertEqual(UserPosition.objects.get(pool=self.open_pool).amount, 1010)
+        self.assertEqual((checkpoint.compounded, checkpoint.overflowed), (10, 0))
+        self.assertIsNotNone(checkpoint.completed_at)
+
+    def test_rewards_of_a_full_pool_are_paid_to_the_wallet(self):
+        checkpoint = compound_pool(self.full_pool.pk, epoch=1, chunk_size=10)
+
+        self.assertEqual(UserPosition.objects.get(pool=self.full_pool).amount, 1000)
+        self.assertEqual(UserWallet.objects.get(user=self.user).balance, 10)
+        self.assertEqual((checkpoint.compounded, checkpoint.overflowed), (0, 10))
+        self.assertEqual(capacity.reserved_amount(self.full_pool.pk), 1000)
+
+
+@override_settings(ALLOWED_HOSTS=["testserver"], AUDIT_ASYNC=False)
+class MetricsTestCase(TestCase):
+    def setUp(self):
+        self.addCleanup(metrics.metrics.pop, "test_events_total", None)
+        self.addCleanup(metrics.metrics.pop, "test_duration_seconds", None)
+        self.counter = metrics.Counter("test_events_total", "Events by kind", ["kind"])
+        self.histogram = metrics.Histogram("test_duration_seconds", "Durations", buckets=(0.1, 1, float("inf")))
+
+    def test_exposition_format(self):
+        self.counter.inc(kind='say "hi"')
+        self.counter.inc(2, kind='say "hi"')
+        for value in [0.05, 0.5, 5]:
+            self.histogram.observe(value)
+
+        lines = metrics.render().splitlines()
+        for line in [
+            "# HELP test_events_total Events by kind",
+            "# TYPE test_events_total counter",
+            'test_events_total{kind="say \\"hi\\""} 3',
+            "# TYPE test_duration_seconds histogram",
+            'test_duration_seconds_bucket{le="0.1"} 1',
+            'test_duration_seconds_bucket{le="1"} 2',
+            'test_duration_seconds_bucket{le="+Inf"} 3',
+            "test_duration_seconds_sum 5.55",
+            "test_duration_seconds_count 3",
+        ]:
+            self.assertIn(line, lines)
+
+    def test_samples_of_exited_threads_are_kept_once(self):
+        workers = [threading.Thread(target=self.counter.inc, kwargs={"kind": "thread"}) for _ in range(3)]
+        for worker in workers:
+            worker.start()
+            worker.join()
+
+        self.assertEqual(metrics.process_samples()[("test_events_total", ("thread",))], 3)
+        self.assertEqual(metrics.process_samples()[("test_events_total", ("thread",))], 3)
+        self.assertFalse(any(worker in metrics._thread_samples for worker in workers))
+
+    def test_middleware_counts_requests_and_queries(self):
+        key = ("http_requests_total", ("pools", "GET", "200"))
+        before = metrics.process_samples().get(key, 0)
+        queries_before = metrics.process_samples().get(("db_queries_total", ("pools",)), 0)
+
+        admin = User.objects.create(username="admin", email="admin@example.com", is_staff=True)
+        client = APIClient()
+        client.force_authenticate(admin)
+        self.assertEqual(client.get(reverse("pools")).status_code, 200)
+
+        self.assertEqual(metrics.process_samples()[key], before + 1)
+        self.assertGreater(metrics.process_samples()[("db_queries_total", ("pools",))], queries_before)
+        self.assertIn('http_request_duration_seconds_count{view="pools",method="GET"}', metrics.render())
+
+    @override_settings(METRICS_ALLOWED_IPS=[], METRICS_TOKEN="secret")
+    def test_scrapes_need_an_allowed_address_or_the_token(self):
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+        self.assertEqual(self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer wrong").status_code, 403)
+        response = self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"# TYPE http_requests_total counter", response.content)
+        with override_settings(METRICS_ALLOWED_IPS=["127.0.0.1"]):
+            self.assertEqual(self.client.get(reverse("metrics")).status_code, 200)
+
+
+class SlowQueryLogTestCase(SimpleTestCase):
+    def setUp(self):
+        slow_queries._report.clear()
+        self.addCleanup(slow_queries._report.clear)
+
+    def test_statements_are_normalized(self):
+        normalized = slow_queries.normalize(
+            "SELECT * FROM t WHERE a = 'it''s' AND b IN (1, 2,3) AND c = %s\n   AND d > 1.5 LIMIT 21")
+        self.assertEqual(normalized, "SELECT * FROM t WHERE a = ? AND b IN (...) AND c = ? AND d > ? LIMIT ?")
+        self.assertEqual(slow_queries.normalize("SELECT * FROM t2 WHERE id IN (%s, %s)"),
+                         "SELECT * FROM t2 WHERE id IN (...)")
+        self.assertEqual(slow_queries.fingerprint(slow_queries.normalize("SELECT 1 FROM t WHERE a = 'x'")),
+                         slow_queries.fingerprint(slow_queries.normalize("SELECT 2 FROM t WHERE a = 'y'")))
+
+    @override_settings(SLOW_QUERY_THRESHOLD=0, SLOW_QUERY_SAMPLE_RATE=0.5)
+    def test_slow_statements_are_sampled(self):
+        recorder = slow_queries.SlowQueryRecorder(lambda: "pools")
+        execute = mock.Mock(return_value="rows")
+        with mock.patch.object(slow_queries.logger, "info") as info:
+            with mock.patch("base.slow_queries.random.random", return_value=0.7):
+                self.assertEqual(recorder(execute, "SELECT 1", (), False, {}), "rows")
+            info.assert_not_called()
+            with mock.patch("base.slow_queries.random.random", return_value=0.3):
+                recorder(execute, "SELECT * FROM t WHERE id = 5", (), False, {})
+        entry = json.loads(info.call_args.args[0])
+        self.assertEqual((entry["sql"], entry["view"]), ("SELECT * FROM t WHERE id = ?", "pools"))
+
+        with override_settings(SLOW_QUERY_THRESHOLD=10_000), mock.patch.object(slow_queries.logger, "info") as info:
+            recorder(execute, "SELECT 1", (), False, {})
+        info.assert_not_called()
+
+    def test_top_offenders_are_parsed_again_only_when_the_log_changed(self):
+        def entry(sql, duration, view):
+            return json.dumps({"time": "2024-01-01T00:00:00", "fingerprint": slow_queries.fingerprint(sql), "sql": sql,
+                               "duration_ms": duration, "view": view, "stack": [view]}) + "\n"
+
+        with tempfile.TemporaryDirectory() as directory:
+            log = f"{directory}/slow-queries.log"
+            with open(log, "w") as file:
+                file.write(entry("SELECT a", 150, "pools") + "cut by a rotation\n" + entry("SELECT b", 400, "users"))
+            with open(f"{log}.1", "w") as file:
+                file.write(entry("SELECT a", 300, "wallet"))
+
+            with override_settings(SLOW_QUERY_LOG_FILE=log, SLOW_QUERY_REPORT_TTL=60):
+                offenders = slow_queries.top_offenders()
+                self.assertEqual([(group["sql"], group["count"], group["total_ms"]) for group in offenders],
+                                 [("SELECT a", 2, 450), ("SELECT b", 1, 400)])
+                self.assertEqual(offenders[0]["views"], ["pools", "wallet"])
+                self.assertEqual(offenders[0]["slowest_stack"], ["wallet"])
+                self.assertEqual(len(slow_queries.top_offenders(limit=1)), 1)
+
+                with open(log, "a") as file:
+                    file.write(entry("SELECT c", 1000, "pools"))
+                with mock.patch("base.slow_queries.aggregate_log") as aggregate_log:
+                    self.assertEqual(slow_queries.top_offenders(), offenders)
+                aggregate_log.assert_not_called()
+
+            with override_settings(SLOW_QUERY_LOG_FILE=log, SLOW_QUERY_REPORT_TTL=0):
+                self.assertEqual(slow_queries.top_offenders()[0]["sql"], "SELECT c")
+                with mock.patch("base.slow_queries.aggregate_log") as aggregate_log:
+                    slow_queries.top_offenders()
+                aggregate_log.assert_not_called()
@@ -0,0 +1,69 @@
+"""
+Epoch-based settlement of the unstaking queue.
+
+`UserPosition.decrease_position()` and `UserPosition.delete()` take the amount out of the
+position right away but only record an `UnstakeRequest`. Once per epoch `settle()` credits every
+request created before the epoch started: requests are taken in queue order, `chunk_size` per
+transaction, summed per user and credited with one `UPDATE ... CASE` over the wallets, so a
+burst of unstaking costs one wallet write per user per epoch instead of one per request.
+"""
+from collections import defaultdict
+
+from django.db import connection, models, transaction
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from staking_app.epochs import current_epoch, epoch_of, epoch_start
+from staking_app.models import OutboxEvent, UnstakeRequest, credit_wallets
+
+
+def settle(epoch=None, chunk_size=1000):
+    """Credit the wallets of the requests created before `epoch` (the current one by default). Returns their count."""
+    cutoff = epoch_start(current_epoch() if epoch is None else epoch)
+    settled = 0
+    while True:
+        with transaction.atomic():
+            if not connection.features.has_select_for_update:
+                # SQLite: take the write lock before reading, see compounding.lock_checkpoint()
+                UnstakeRequest.objects.filter(pk=0).update(status=UnstakeRequest.PENDING)
+            requests = list(
+                UnstakeRequest.objects.select_for_update()
+                .filter(status=UnstakeRequest.PENDING, created_at__lt=cutoff)
+                .order_by("pk")
+                .values_list("pk", "user_id", "amount")[:chunk_size]
+            )
+            if not requests:
+                return settled
+            credits = defaultdict(int)
+            for _, user_id, amount in requests:
+                credits[user_id] += amount
+            OutboxEvent.objects.bulk_create(credit_wallets(credits))
+            UnstakeRequest.objects.filter(pk__in=[pk for pk, _, _ in requests]).update(
+                status=UnstakeRequest.SETTLED, settled_at=timezone.now())
+        settled += len(requests)
+
+
+def with_queue_position(queryset):
+    """
+    Annotate `queue_position`: the 1-based place of each pending request in the whole queue
+    (NULL once settled), counted on the (status, id) index.
+    """
+    ahead = (
+        UnstakeRequest.objects.filter(status=UnstakeRequest.PENDING, pk__lte=models.OuterRef("pk"))
+        .order_by()
+        .values("status")
+        .annotate(count=models.Count("pk"))
+        .values("count")
+    )
+    return queryset.annotate(queue_position=models.Case(
+        models.When(status=UnstakeRequest.PENDING, then=Coalesce(models.Subquery(ahead), 0)),
+        default=None,
+        output_field=models.IntegerField(),
+    ))
+
+
+def settlement_eta(request):
+    """When the request will be credited: the start of the epoch after the one it was created in."""
+    if request.status != UnstakeRequest.PENDING:
+        return request.settled_at
+    return epoch_start(epoch_of(request.created_at) + 1)
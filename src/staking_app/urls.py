@@ -15,6 +15,8 @@ positions = [
     path("positions/", include([
         path("", views.PositionsListAPIView.as_view(), name="positions"),
         path("create/", views.CreatePositionAPIView.as_view(), name="positions_create"),
+        path("archive/", views.ArchivedPositionsAPIView.as_view(), name="positions_archive"),
+        path("by-ids/", views.PositionDetailAPIView.as_view(http_method_names=["get"]), name="positions_by_ids"),
         path("<int:pk>/", views.PositionDetailAPIView.as_view(), name="positions_detail"),
         path("<int:pk>/", views.PositionDetailAPIView.as_view(), name="positions_delete"),
         path("increase/<int:pk>/", views.PositionIncreaseAPIView.as_view(), name="positions_increase"),
@@ -35,10 +37,27 @@ staking_pools = [
     path("pools/", include([
         path("", views.StackingPoolListAPIView.as_view(), name="pools"),
         path("create/", views.StackingPoolCreateAPIView.as_view(), name="pools_create"),
+        path("by-ids/", views.StackingPoolDetailAPIView.as_view(http_method_names=["get"]), name="pools_by_ids"),
         path("<int:pk>/", views.StackingPoolDetailAPIView.as_view(), name="pools_detail"),
         path("<int:pk>/", views.StackingPoolDetailAPIView.as_view(), name="pools_delete"),
         path("edit/<int:pk>/", views.StackingPoolEditAPIView.as_view(), name="pools_edit"),
     ]))
 ]
 
-urlpatterns = [] + wallets + positions + conditions + staking_pools
+unstaking = [
+    path("unstaking/", views.UnstakeRequestListAPIView.as_view(), name="unstaking"),
+]
+
+batch = [
+    path("batch/", views.BatchOperationsAPIView.as_view(), name="batch"),
+]
+
+stream = [
+    path("stream/", views.EventStreamAPIView.as_view(), name="stream"),
+]
+
+simulation = [
+    path("simulate/", views.SimulateRewardsAPIView.as_view(), name="simulate"),
+]
+
+urlpatterns = [] + wallets + positions + conditions + staking_pools + unstaking + batch + stream + simulation
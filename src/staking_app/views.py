@@ -1,17 +1,34 @@
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from django.utils import timezone
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework import status, permissions
 from rest_framework.generics import ListAPIView, GenericAPIView, CreateAPIView, UpdateAPIView
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from staking_app.models import UserWallet, UserPosition, PoolConditions, StackingPool
+from base.batch_fetch import BatchFetchMixin
+from base.fieldsets import SparseFieldsetMixin
+from base.renderers import FastJSONRenderer
+from base.single_flight import single_flight
+from jobs.queue import enqueue
+from staking_app.models import (
+    UserWallet, UserPosition, PoolConditions, StackingPool, UnstakeRequest,
+)
 from staking_app import serializers as staking_app_serializers
-from staking_app.staking_exceptions import UserPositionException, PoolConditionsException, StackingPoolException
+from staking_app.staking_exceptions import (
+    UserPositionException, PoolConditionsException, StackingPoolException, BatchOperationException,
+    PositionConflictException,
+)
 from users.models import User
+from staking_app import archive
 from staking_app import swagger_schemas
+from staking_app import snapshots
+from staking_app import streaming
+from staking_app.unstaking import with_queue_position
 
 
-class WalletsAPIView(ListAPIView):
+class WalletsAPIView(SparseFieldsetMixin, ListAPIView):
     queryset = UserWallet.objects.all()
     serializer_class = staking_app_serializers.UserWalletSerializer
     permission_classes = [permissions.IsAuthenticated, permissions.IsAdminUser]
@@ -20,7 +37,7 @@ class WalletsAPIView(ListAPIView):
         return self.list(request, *args, **kwargs)
 
 
-class WalletDetailAPIView(GenericAPIView):
+class WalletDetailAPIView(SparseFieldsetMixin, GenericAPIView):
     serializer_class = staking_app_serializers.UserWalletSerializer
     permission_classes = [permissions.IsAuthenticated, permissions.IsAdminUser]
 
@@ -38,16 +55,20 @@ class WalletDetailAPIView(GenericAPIView):
         Raises:
             status.HTTP_404_NOT_FOUND: If the wallet is not found.
         """
-        wallet = UserWallet.objects.filter(pk=pk).first()
+        key = snapshots.wallet_key(pk)
+        data, generation = snapshots.get(key)
+        if data is None:
+            wallet = UserWallet.objects.filter(pk=pk).first()
+            if not wallet:
+                return Response({"message": "Wallet not found"}, status=status.HTTP_404_NOT_FOUND)
+            data = snapshots.wallet_data(wallet)
+            snapshots.fill(key, data, generation)
 
-        if not wallet:
-            return Response({"message": "Wallet not found"}, status=status.HTTP_404_NOT_FOUND)
-        if wallet.user.id != request.user.id:
+        if data["user"] != request.user.id:
             if not request.user.is_staff:
                 return Response({"message": "Wallet not found"}, status=status.HTTP_404_NOT_FOUND)
 
-        serializer = self.get_serializer(wallet)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return Response(self.narrow_data(data), status=status.HTTP_200_OK)
 
 
 class WalletReplenishAPIView(APIView):
@@ -102,6 +123,36 @@ class WalletWithdrawAPIView(APIView):
         )
 
 
+class BatchOperationsAPIView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    @swagger_auto_schema(request_body=staking_app_serializers.BatchSerializer)
+    def post(self, request, *args, **kwargs):
+        """
+        Execute an ordered list of wallet and position operations in a single transaction.
+
+        Parameters:
+            request (HttpRequest): The HTTP request object.
+            request['data']['operations']: The operations, each with an `op` (replenish, withdraw,
+                create_position, increase_position, decrease_position), an `amount` and the
+                `pool` or `position` it applies to.
+
+        Returns:
+            Response: The per-operation results, or the failed operation when everything was rolled back.
+        """
+        serializer = staking_app_serializers.BatchSerializer(data=request.data, context={"request": request})
+        if not serializer.is_valid():
+            return Response({"message": serializer.errors}, status=status.HTTP_412_PRECONDITION_FAILED)
+        try:
+            results = serializer.save()
+        except BatchOperationException as e:
+            return Response(
+                {"message": str(e), "failed_operation": e.index}, status=status.HTTP_400_BAD_REQUEST)
+        except PositionConflictException as e:
+            return Response({"message": str(e)}, status=status.HTTP_409_CONFLICT)
+        return Response({"message": results}, status=status.HTTP_200_OK)
+
+
 class CreatePositionAPIView(CreateAPIView):
     serializer_class = staking_app_serializers.CreatePositionSerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -130,7 +181,7 @@ class CreatePositionAPIView(CreateAPIView):
         return Response({"message": serializer.data}, status=status.HTTP_201_CREATED, headers=headers)
 
 
-class PositionsListAPIView(ListAPIView):
+class PositionsListAPIView(SparseFieldsetMixin, ListAPIView):
     queryset = UserPosition.objects.all()
     serializer_class = staking_app_serializers.UserPositionSerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -148,17 +199,70 @@ class PositionsListAPIView(ListAPIView):
         user = User.objects.filter(pk=self.request.user.id).first()
         if not user:
             return Response({"message": "User not found"}, status=status.HTTP_404_NOT_FOUND)
-        serializer = self.get_serializer(user.positions.all(), many=True)
+        # Not `user.positions`: a related manager reads the user column back even when it is deferred
+        serializer = self.get_serializer(self.filter_queryset(UserPosition.objects.filter(user=user)), many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
 
-class PositionDetailAPIView(GenericAPIView):
+class ArchivedPositionsAPIView(SparseFieldsetMixin, ListAPIView):
+    serializer_class = staking_app_serializers.ArchivedPositionSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        """
+        Get the positions of the user closed in one month (`?month=YYYY-MM`, the current month by
+        default), newest first, whether the archiver already moved them to the archive or not.
+
+        Args:
+            request (HttpRequest): The HTTP request object.
+
+        Returns:
+            Response: The HTTP response containing the serialized archived positions.
+        """
+        month = request.query_params.get("month")
+        try:
+            month = archive.parse_month(month) if month else archive.month_of(timezone.now())
+        except ValueError:
+            return Response({"message": "month must be formatted as YYYY-MM"}, status=status.HTTP_400_BAD_REQUEST)
+        positions = archive.archived_positions(month, request.user.id, project=self.project)
+        page = self.paginate_queryset(positions)
+        return self.get_paginated_response(self.get_serializer(page, many=True).data)
+
+
+class UnstakeRequestListAPIView(SparseFieldsetMixin, ListAPIView):
+    serializer_class = staking_app_serializers.UnstakeRequestSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return with_queue_position(UnstakeRequest.objects.filter(user_id=self.request.user.id).order_by("-id"))
+
+    def get(self, request, *args, **kwargs):
+        """
+        Get the unstake requests of the user, newest first, with their place in the queue and
+        the time they are expected to be credited to the wallet.
+
+        Args:
+            request (HttpRequest): The HTTP request object.
+
+        Returns:
+            Response: The HTTP response containing the serialized unstake requests.
+        """
+        return self.list(request, *args, **kwargs)
+
+
+class PositionDetailAPIView(BatchFetchMixin, SparseFieldsetMixin, GenericAPIView):
+    queryset = UserPosition.objects.all()
     serializer_class = staking_app_serializers.UserPositionSerializer
     permission_classes = [permissions.IsAuthenticated]
 
-    def get(self, request, pk):
+    def batch_queryset(self):
+        if self.request.user.is_staff:
+            return self.get_queryset()
+        return self.get_queryset().filter(user_id=self.request.user.id)
+
+    def get(self, request, pk=None):
         """
-        Get a position detail by its primary key.
+        Get a position detail by its primary key, or the positions of `?ids=` without it.
 
         Args:
             request (HttpRequest): The HTTP request object.
@@ -167,11 +271,17 @@ class PositionDetailAPIView(GenericAPIView):
         Returns:
             Response: The HTTP response containing the serialized position.
         """
-        position = UserPosition.objects.filter(pk=pk).first()
-        if not position:
-            return Response({"message": "Position not found"}, status=status.HTTP_404_NOT_FOUND)
-        serializer = self.get_serializer(position)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        if pk is None:
+            return self.get_batch(request)
+        key = snapshots.position_key(pk)
+        data, generation = snapshots.get(key)
+        if data is None:
+            position = UserPosition.objects.filter(pk=pk).first()
+            if not position:
+                return Response({"message": "Position not found"}, status=status.HTTP_404_NOT_FOUND)
+            data = snapshots.position_data(position)
+            snapshots.fill(key, data, generation)
+        return Response(self.narrow_data(data), status=status.HTTP_200_OK)
 
     def delete(self, request, pk):
         """
@@ -221,7 +331,10 @@ class PositionIncreaseAPIView(APIView):
         if not serializer.is_valid():
             return Response({"message": serializer.errors}, status=status.HTTP_412_PRECONDITION_FAILED)
 
-        updated_obj = serializer.save()
+        try:
+            updated_obj = serializer.save()
+        except PositionConflictException as e:
+            return Response({"message": str(e)}, status=status.HTTP_409_CONFLICT)
 
         if not updated_obj:
             return Response({"message": "Position were not increased"}, status=status.HTTP_404_NOT_FOUND)
@@ -255,7 +368,10 @@ class PositionDecreaseAPIView(APIView):
         if not serializer.is_valid():
             return Response({"message": serializer.errors}, status=status.HTTP_412_PRECONDITION_FAILED)
 
-        updated_obj = serializer.save()
+        try:
+            updated_obj = serializer.save()
+        except PositionConflictException as e:
+            return Response({"message": str(e)}, status=status.HTTP_409_CONFLICT)
 
         if not updated_obj:
             return Response({"message": "Position were not decreased"}, status=status.HTTP_404_NOT_FOUND)
@@ -264,11 +380,12 @@ class PositionDecreaseAPIView(APIView):
         )
 
 
-class ConditionsListAPIView(ListAPIView):
+class ConditionsListAPIView(SparseFieldsetMixin, ListAPIView):
     queryset = PoolConditions.objects.all()
     serializer_class = staking_app_serializers.PoolConditionsSerializer
     permission_classes = [permissions.IsAuthenticated, permissions.IsAdminUser]
 
+    @single_flight()
     def get(self, request, *args, **kwargs):
         """
         Get all conditions.
@@ -309,10 +426,11 @@ class ConditionsCreateAPIView(CreateAPIView):
         return Response({"message": serializer.data}, status=status.HTTP_201_CREATED, headers=headers)
 
 
-class ConditionsDetailAPIView(GenericAPIView):
+class ConditionsDetailAPIView(SparseFieldsetMixin, GenericAPIView):
     serializer_class = staking_app_serializers.PoolConditionsSerializer
     permission_classes = [permissions.IsAuthenticated, permissions.IsAdminUser]
 
+    @single_flight()
     def get(self, request, pk):
         """
         Get a condition.
@@ -324,7 +442,7 @@ class ConditionsDetailAPIView(GenericAPIView):
         Returns:
             Response: The HTTP response containing the serialized condition.
         """
-        conditions = PoolConditions.objects.filter(pk=pk).first()
+        conditions = self.project(PoolConditions.objects.filter(pk=pk)).first()
         if not conditions:
             return Response({"message": "Conditions not found"}, status=status.HTTP_404_NOT_FOUND)
         serializer = self.get_serializer(conditions)
@@ -332,31 +450,30 @@ class ConditionsDetailAPIView(GenericAPIView):
 
     def delete(self, request, pk):
         """
-        Delete a condition.
+        Delete a condition with the pools using it, in a background job (`jobs/<id>/` shows its status).
 
         Args:
             request (HttpRequest): The HTTP request object.
             pk (str): The primary key of the condition.
 
         Returns:
-            Response: The HTTP response object with the result of the operation.
+            Response: The HTTP response object with the id of the job.
         """
         conditions = PoolConditions.objects.filter(pk=pk).first()
         if not conditions:
             return Response({"message": "Conditions not found"}, status=status.HTTP_404_NOT_FOUND)
-        deleted_count, data = conditions.delete()
-        if not deleted_count:
-            return Response(
-                {"message": "Conditions has not been deleted"},
-                status=status.HTTP_417_EXPECTATION_FAILED)
-        return Response({"message": f"Conditions(id={pk}) was deleted successfully"}, status=status.HTTP_200_OK)
+        job = enqueue("staking.delete_conditions", {"conditions_id": conditions.pk}, user=request.user)
+        return Response(
+            {"message": f"Conditions(id={pk}) will be deleted", "job": job.pk},
+            status=status.HTTP_202_ACCEPTED)
 
 
-class StackingPoolListAPIView(ListAPIView):
+class StackingPoolListAPIView(SparseFieldsetMixin, ListAPIView):
     queryset = StackingPool.objects.all()
     serializer_class = staking_app_serializers.StackingPoolSerializer
     permission_classes = [permissions.IsAuthenticated, permissions.IsAdminUser]
 
+    @single_flight()
     def get(self, request, *args, **kwargs):
         """
         Get all stacking pools.
@@ -397,13 +514,15 @@ class StackingPoolCreateAPIView(CreateAPIView):
         return Response({"message": serializer.data}, status=status.HTTP_201_CREATED, headers=headers)
 
 
-class StackingPoolDetailAPIView(GenericAPIView):
+class StackingPoolDetailAPIView(BatchFetchMixin, SparseFieldsetMixin, GenericAPIView):
+    queryset = StackingPool.objects.all()
     serializer_class = staking_app_serializers.StackingPoolSerializer
     permission_classes = [permissions.IsAuthenticated, permissions.IsAdminUser]
 
-    def get(self, request, pk):
+    @single_flight()
+    def get(self, request, pk=None):
         """
-        Get a stacking pool.
+        Get a stacking pool, or the stacking pools of `?ids=` without a primary key.
 
         Args:
             request (HttpRequest): The HTTP request object.
@@ -412,7 +531,9 @@ class StackingPoolDetailAPIView(GenericAPIView):
         Returns:
             Response: The HTTP response containing the serialized stacking pool.
         """
-        stacking_pool = StackingPool.objects.filter(pk=pk).first()
+        if pk is None:
+            return self.get_batch(request)
+        stacking_pool = self.project(StackingPool.objects.filter(pk=pk)).first()
         if not stacking_pool:
             return Response({"message": "Stacking pool not found"}, status=status.HTTP_404_NOT_FOUND)
         serializer = self.get_serializer(stacking_pool)
@@ -420,28 +541,23 @@ class StackingPoolDetailAPIView(GenericAPIView):
 
     def delete(self, request, pk):
         """
-        Delete a stacking pool.
+        Refund and close the positions of a stacking pool and delete it, in a background job
+        (`jobs/<id>/` shows its status).
 
         Args:
             request (HttpRequest): The HTTP request object.
             pk (str): The primary key of the stacking pool.
 
         Returns:
-            Response: The HTTP response object with the result of the operation.
+            Response: The HTTP response object with the id of the job.
         """
         stacking_pool = StackingPool.objects.filter(pk=pk).first()
         if not stacking_pool:
             return Response({"message": "Stacking pool not found"}, status=status.HTTP_404_NOT_FOUND)
-        for position in stacking_pool.positions.all():
-            position.money_back()
-        deleted_count, data = stacking_pool.delete()
-        if not deleted_count:
-            return Response(
-                {"message": "Stacking pool has not been deleted"},
-                status=status.HTTP_417_EXPECTATION_FAILED)
+        job = enqueue("staking.delete_pool", {"pool_id": stacking_pool.pk}, user=request.user)
         return Response(
-            {"message": f"Stacking pool(id={pk}) was deleted successfully"},
-            status=status.HTTP_200_OK)
+            {"message": f"Stacking pool(id={pk}) will be deleted", "job": job.pk},
+            status=status.HTTP_202_ACCEPTED)
 
 
 class StackingPoolEditAPIView(UpdateAPIView):
@@ -472,3 +588,67 @@ class StackingPoolEditAPIView(UpdateAPIView):
         except StackingPoolException as e:
             return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         return Response({"message": serializer.data}, status=status.HTTP_200_OK)
+
+
+class EventStreamAPIView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+    renderer_classes = [streaming.EventStreamRenderer, FastJSONRenderer]
+
+    def get(self, request):
+        """
+        Stream wallet and position changes of the user as Server-Sent Events.
+
+        Args:
+            request (HttpRequest): The HTTP request object.
+            request['headers']['Last-Event-ID']: The id of the last received event to resume from.
+
+        Returns:
+            StreamingHttpResponse: The `text/event-stream` response.
+            status.HTTP_503_SERVICE_UNAVAILABLE: If STAKING_STREAM_MAX_SYNC_STREAMS clients are already
+                connected to this WSGI worker.
+        """
+        last_event_id = request.headers.get("Last-Event-ID") or request.query_params.get("last_event_id")
+        if last_event_id is not None:
+            try:
+                last_event_id = streaming.parse_event_id(last_event_id)
+            except ValueError as e:
+                return Response({"message": str(e)}, status=status.HTTP_412_PRECONDITION_FAILED)
+
+        if isinstance(request._request, ASGIRequest):
+            frames = streaming.async_event_stream(streaming.broadcaster, request.user.id, last_event_id)
+        elif streaming.broadcaster.acquire_sync_stream():
+            frames = streaming.SyncEventStream(streaming.broadcaster, request.user.id, last_event_id)
+        else:
+            return Response({"message": "Too many streams are open, try again later"},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={"Retry-After": "5"})
+        response = StreamingHttpResponse(frames, content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+
+class SimulateRewardsAPIView(APIView):
+    permission_classes = [permissions.IsAuthenticated, permissions.IsAdminUser]
+
+    @swagger_auto_schema(request_body=staking_app_serializers.SimulationSerializer)
+    def post(self, request):
+        """
+        Project rewards of all positions under several "what if" pool rate scenarios, in a background
+        job (`jobs/<id>/` shows its status and, once it succeeded, the projection).
+
+        Args:
+            request (HttpRequest): The HTTP request object.
+            request['data']['epochs']: The number of epochs to project.
+            request['data']['compound']: Whether rewards are restaked every epoch.
+            request['data']['scenarios']: The list of scenarios, each with a name and pool rate overrides.
+
+        Returns:
+            Response: The HTTP response object with the id of the job.
+        """
+        serializer = staking_app_serializers.SimulationSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response({"message": serializer.errors}, status=status.HTTP_412_PRECONDITION_FAILED)
+
+        # A projection is read-only, a failed one is not worth retrying
+        job = enqueue("staking.simulate_rewards", serializer.data, max_attempts=1, user=request.user)
+        return Response({"message": "Rewards will be simulated", "job": job.pk}, status=status.HTTP_202_ACCEPTED)
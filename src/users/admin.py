@@ -1,5 +1,12 @@
 from django.contrib import admin
 
+from base.pagination import EstimatedCountPaginator
 from users.models import User
 
-admin.site.register(User)
+
+@admin.register(User)
+class UserAdmin(admin.ModelAdmin):
+    list_display = ("id", "username", "email", "is_staff")
+    search_fields = ("=username", "=email")
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
@@ -0,0 +1,145 @@
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.contrib.auth.hashers import make_password
+from django.db import close_old_connections
+
+from rest_framework import filters
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from base.benchmarks import register, best_of, speedup
+from users import hashing
+from users.models import User
+from users.search import IndexedSearchFilter
+from users.views import UserListAPIView
+
+LOGINS = 24
+LOGIN_CONCURRENCY = 8  # request workers logging in at once
+PROBE_INTERVAL = 0.01
+
+SYLLABLES = ["ka", "lo", "mi", "ren", "tas", "vo", "zel", "dri", "an", "be", "cor", "fy", "gus", "hal", "ix", "jun"]
+
+
+def fake_username(rng, index):
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) + str(index)
+
+
+def search_request(term, mode=None):
+    params = {"search": term}
+    if mode:
+        params["search_mode"] = mode
+    return Request(APIRequestFactory().get("/users/", params))
+
+
+@register("users.search")
+def user_search(options):
+    rng = random.Random(0)
+    usernames = []
+    for start in range(0, options["rows"], 10_000):
+        batch = [fake_username(rng, index) for index in range(start, min(start + 10_000, options["rows"]))]
+        User.objects.bulk_create([User(username=name, email=f"{name}@example.com") for name in batch])
+        usernames += batch
+
+    view = UserListAPIView()
+    queries = rng.sample(usernames, min(20, len(usernames)))
+
+    def page_and_count(backend, term, mode=None):
+        queryset = backend.filter_queryset(search_request(term, mode), User.objects.order_by("pk"), view)
+        return lambda: (list(queryset[:10]), queryset.count())
+
+    def per_query(backend, make_term, mode=None):
+        timings = [best_of(page_and_count(backend, make_term(name), mode), options["repeat"]) for name in queries]
+        return statistics.median(timings)
+
+    def typo(name):
+        position = rng.randrange(len(name) - 1)
+        return name[:position] + name[position + 1] + name[position] + name[position + 2:]
+
+    plain, indexed = filters.SearchFilter(), IndexedSearchFilter()
+    scan = per_query(plain, lambda name: name[2:-1])
+    substring = per_query(indexed, lambda name: name[2:-1])
+    prefix = per_query(indexed, lambda name: name[:5], "prefix")
+    fuzzy = per_query(indexed, typo, "fuzzy")
+    found = sum(
+        name in [user.username for user in page_and_count(indexed, typo(name), "fuzzy")()[0]] for name in queries
+    )
+    return [
+        ("users", options["rows"]),
+        ("icontains scan, page + count p50 (ms)", f"{scan * 1000:.2f}"),
+        ("trigram index substring, page + count p50 (ms)", f"{substring * 1000:.2f}"),
+        ("substring speedup", speedup(scan, substring)),
+        ("trigram index prefix, page + count p50 (ms)", f"{prefix * 1000:.2f}"),
+        ("trigram index fuzzy (one typo), page + count p50 (ms)", f"{fuzzy * 1000:.2f}"),
+        ("fuzzy matches with the original name on the first page", f"{found}/{len(queries)}"),
+    ]
+
+
+def login_storm(max_concurrency, max_pending):
+    """
+    Run LOGINS logins on LOGIN_CONCURRENCY threads the way `UserLoginView` does, while a probe
+    thread measures the latency of a cheap query.
+    """
+    hashing._limiter = hashing.HashingLimiter(max_concurrency, max_pending)
+    latencies, probe_latencies, rejected = [], [], []
+    storm_running = threading.Event()
+    storm_running.set()
+
+    def login(index):
+        started = time.perf_counter()
+        try:
+            with hashing.hashing_slot():
+                user = authenticate(username=f"login{index % 4}", password="benchmark-password")
+            assert user is not None
+            latencies.append(time.perf_counter() - started)
+        except hashing.HashingBusy:
+            rejected.append(index)
+        finally:
+            close_old_connections()
+
+    def probe():
+        while storm_running.is_set():
+            started = time.perf_counter()
+            User.objects.filter(username="login0").exists()
+            probe_latencies.append(time.perf_counter() - started)
+            time.sleep(PROBE_INTERVAL)
+        close_old_connections()
+
+    probe_thread = threading.Thread(target=probe)
+    probe_thread.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=LOGIN_CONCURRENCY) as executor:
+        list(executor.map(login, range(LOGINS)))
+    elapsed = time.perf_counter() - started
+    storm_running.clear()
+    probe_thread.join()
+    hashing._limiter = None
+
+    label = f"limit({max_concurrency} hashing, {max_pending} pending)"
+    return [
+        (f"{label}: logins/s", f"{len(latencies) / elapsed:.2f}"),
+        (f"{label}: login p50 / max (ms)",
+         f"{statistics.median(latencies) * 1000:.0f} / {max(latencies) * 1000:.0f}" if latencies else "n/a"),
+        (f"{label}: rejected with 503", len(rejected)),
+        (f"{label}: probe query p50 / max (ms)",
+         f"{statistics.median(probe_latencies) * 1000:.2f} / {max(probe_latencies) * 1000:.2f}"),
+    ]
+
+
+@register("users.login_throughput")
+def login_throughput(options):
+    password = make_password("benchmark-password")
+    User.objects.bulk_create(
+        [User(username=f"login{i}", email=f"login{i}@example.com", password=password) for i in range(4)])
+    concurrency = settings.PASSWORD_HASHING_MAX_CONCURRENCY
+    return [
+        ("concurrent logins", f"{LOGINS} ({LOGIN_CONCURRENCY} at a time)"),
+        *login_storm(max_concurrency=LOGIN_CONCURRENCY, max_pending=0),  # every worker hashes at once
+        *login_storm(max_concurrency=concurrency, max_pending=LOGINS),
+        *login_storm(max_concurrency=concurrency, max_pending=concurrency),
+    ]
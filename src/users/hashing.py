@@ -0,0 +1,59 @@
+"""
+Bounded password hashing for the registration, login and password change API views.
+
+Password hashers are deliberately slow. During a login storm every request worker ends up
+hashing and everything else stalls, so the API views hash inside `hashing_slot()`: at most
+PASSWORD_HASHING_MAX_CONCURRENCY hashes run at once, up to PASSWORD_HASHING_MAX_PENDING more
+wait for a slot, and requests beyond that get 503 with Retry-After instead of queueing behind
+slow hashes.
+
+Only the DRF views are limited. Authentication itself stays with `ModelBackend` (which upgrades
+outdated hashes on login), so the Django admin login and `manage.py` commands hash as before.
+"""
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class HashingBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Too many authentication requests, try again later."
+    default_code = "hashing_busy"
+
+
+class HashingLimiter:
+    def __init__(self, max_concurrency, max_pending):
+        self._admitted = threading.BoundedSemaphore(max_concurrency + max_pending)
+        self._running = threading.BoundedSemaphore(max_concurrency)
+
+    @contextmanager
+    def slot(self):
+        if not self._admitted.acquire(blocking=False):
+            raise HashingBusy
+        try:
+            with self._running:
+                yield
+        finally:
+            self._admitted.release()
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter():
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = HashingLimiter(
+                    settings.PASSWORD_HASHING_MAX_CONCURRENCY, settings.PASSWORD_HASHING_MAX_PENDING)
+    return _limiter
+
+
+def hashing_slot():
+    """Context manager around the hashing of one request, raises `HashingBusy` when the queue is full."""
+    return get_limiter().slot()
@@ -0,0 +1,202 @@
+"""
+Indexed search over users.
+
+On SQLite the `username` and `email` columns are indexed by an external-content FTS5 table
+with the trigram tokenizer (`users_user_search`, rowid = user id) for substring and fuzzy
+matches, and by `lower(column)` indexes for prefix matches. Triggers on `users_user` keep the
+FTS5 table in sync with every insert, update and delete, including bulk ones that bypass
+`User.save()`. On PostgreSQL the same columns get pg_trgm GIN indexes, which serve the
+`icontains` / `istartswith` lookups of the plain `SearchFilter` directly.
+"""
+import operator
+from functools import reduce
+
+from django.db import connections, models
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Lower
+from django.db.models.lookups import Exact, GreaterThanOrEqual, LessThan
+from rest_framework import filters
+
+SEARCH_TABLE = "users_user_search"
+INDEXED_FIELDS = ("username", "email")
+MIN_TERM_LENGTH = 3  # the trigram index cannot answer shorter terms
+FUZZY_LIMIT = 100  # best ranked candidates returned by a fuzzy term
+
+SQLITE_INDEXES = [
+    f"CREATE INDEX IF NOT EXISTS users_user_{field}_lower ON users_user (lower({field}))" for field in INDEXED_FIELDS
+]
+
+SQLITE_TRIGGERS = [
+    f"""CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_insert AFTER INSERT ON users_user BEGIN
+        INSERT INTO {SEARCH_TABLE} (rowid, username, email) VALUES (new.id, new.username, new.email);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_delete AFTER DELETE ON users_user BEGIN
+        INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, username, email)
+        VALUES ('delete', old.id, old.username, old.email);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_update AFTER UPDATE OF username, email ON users_user BEGIN
+        INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, username, email)
+        VALUES ('delete', old.id, old.username, old.email);
+        INSERT INTO {SEARCH_TABLE} (rowid, username, email) VALUES (new.id, new.username, new.email);
+    END""",
+]
+
+
+def create_search_index(schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == "sqlite":
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5("
+            f"username, email, content='users_user', content_rowid='id', tokenize='trigram')"
+        )
+        schema_editor.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('rebuild')")
+        for statement in SQLITE_INDEXES + SQLITE_TRIGGERS:
+            schema_editor.execute(statement)
+    elif connection.vendor == "postgresql":
+        schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        for field in INDEXED_FIELDS:
+            schema_editor.execute(
+                f"CREATE INDEX IF NOT EXISTS users_user_{field}_trgm ON users_user USING gin ((UPPER({field}::text)) gin_trgm_ops)"
+            )
+
+
+def drop_search_index(schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == "sqlite":
+        for action in ("insert", "delete", "update"):
+            schema_editor.execute(f"DROP TRIGGER IF EXISTS {SEARCH_TABLE}_{action}")
+        schema_editor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+        for field in INDEXED_FIELDS:
+            schema_editor.execute(f"DROP INDEX IF EXISTS users_user_{field}_lower")
+    elif connection.vendor == "postgresql":
+        for field in INDEXED_FIELDS:
+            schema_editor.execute(f"DROP INDEX IF EXISTS users_user_{field}_trgm")
+
+
+def ensure_search_index(using="default", **kwargs):
+    """
+    Recreate the `lower()` indexes and the sync triggers after migrations: SQLite drops them
+    whenever a later migration rebuilds `users_user` (the FTS5 table itself survives, as the
+    rebuilt table keeps the same ids).
+    """
+    connection = connections[using]
+    if connection.vendor != "sqlite" or SEARCH_TABLE not in connection.introspection.table_names():
+        return
+    with connection.cursor() as cursor:
+        for statement in SQLITE_INDEXES + SQLITE_TRIGGERS:
+            cursor.execute(statement)
+
+
+def trigrams(term):
+    term = term.lower()
+    return sorted({term[i:i + 3] for i in range(len(term) - 2)})
+
+
+def fuzzy_pieces(term):
+    """
+    Return pieces of `term` of which at least one survives a single typo (a substitution,
+    insertion, deletion or swap of two adjacent characters) intact.
+
+    A typo touches at most two neighbouring characters, so the two halves of a long term are
+    taken around its middle character, which neither of them contains. Shorter terms fall back
+    to their trigrams, plus every variant with two adjacent characters swapped back.
+    """
+    if len(term) >= 2 * MIN_TERM_LENGTH + 1:
+        middle = len(term) // 2
+        return [term[:middle], term[middle + 1:]]
+    swapped = [term[:i] + term[i + 1] + term[i] + term[i + 2:] for i in range(len(term) - 1)]
+    return trigrams(term) + sorted(set(swapped) - {term})
+
+
+def quote(text):
+    """Quote `text` as an FTS5 string, so operators and punctuation in search terms are taken literally."""
+    return '"' + text.replace('"', '""') + '"'
+
+
+def fuzzy_matches(field, term, using="default"):
+    """Return the ids of the best FUZZY_LIMIT fuzzy matches of `term` on `field`, with their bm25 rank."""
+    # Rows containing any of the pieces are candidates, ranked by the trigrams of the term they
+    # share: the second group never filters out a candidate, it only adds to the bm25 score
+    candidates = " OR ".join(quote(piece) for piece in fuzzy_pieces(term))
+    scoring = " OR ".join(quote(trigram) for trigram in trigrams(term))
+    expression = f"{field} : (({candidates}) AND ({candidates} OR {scoring}))"
+    sql = f"SELECT rowid, rank FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s ORDER BY rank LIMIT {FUZZY_LIMIT}"
+    with connections[using].cursor() as cursor:
+        cursor.execute(sql, [expression])
+        return cursor.fetchall()
+
+
+def index_lookup(field, mode, term):
+    """Return a condition answering one search term on one field from the search indexes."""
+    lower = term.lower()
+    if mode == "prefix":
+        # Short prefixes share their trigrams with many rows, a range over lower(field) is tighter
+        # and is answered from the lower(field) index by the outer query itself
+        return models.Q(
+            GreaterThanOrEqual(Lower(field), lower), LessThan(Lower(field), lower[:-1] + chr(ord(lower[-1]) + 1))
+        )
+    if mode == "exact":
+        return models.Q(Exact(Lower(field), lower))
+
+    # A trigram phrase query matches the term as a case-insensitive substring
+    sql = f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s"
+    return models.Q(pk__in=RawSQL(sql, [f"{field} : {quote(term)}"]))
+
+
+class IndexedSearchFilter(filters.SearchFilter):
+    """
+    `SearchFilter` that answers searches on indexed user fields from the trigram index.
+
+    Takes the usual `search_fields`: unprefixed fields match substrings, `^` prefixes and `=`
+    whole values, and the new `~` prefix matches fuzzily (typo tolerant, best FUZZY_LIMIT
+    matches, ordered by their bm25 rank). `?search_mode=prefix|fuzzy` switches the unprefixed
+    fields to that mode for one request. Terms shorter than MIN_TERM_LENGTH, other fields and
+    other databases are handled by the plain `SearchFilter` lookups.
+    """
+    lookup_prefixes = {**filters.SearchFilter.lookup_prefixes, "~": "icontains"}
+    index_modes = {"": "substring", "^": "prefix", "=": "exact", "~": "fuzzy"}
+    search_mode_param = "search_mode"
+    search_modes = ("substring", "prefix", "fuzzy")
+
+    def get_search_fields(self, view, request):
+        search_fields = super().get_search_fields(view, request)
+        mode = request.query_params.get(self.search_mode_param)
+        if not search_fields or mode not in self.search_modes or mode == "substring":
+            return search_fields
+        prefix = "^" if mode == "prefix" else "~"
+        return [field if field[0] in self.lookup_prefixes else prefix + field for field in search_fields]
+
+    def filter_queryset(self, request, queryset, view):
+        search_fields = self.get_search_fields(view, request)
+        search_terms = self.get_search_terms(request)
+        if not search_fields or not search_terms or connections[queryset.db].vendor != "sqlite":
+            return super().filter_queryset(request, queryset, view)
+
+        ranks = {}
+        conditions = [
+            reduce(operator.or_, (self.term_condition(str(field), term, queryset, ranks) for field in search_fields))
+            for term in search_terms
+        ]
+        queryset = queryset.filter(reduce(operator.and_, conditions))
+        if not ranks:
+            return queryset
+        # Best fuzzy matches first, a row matched by several fuzzy lookups adds up their ranks
+        # (bm25 ranks are negative, lower is better); an explicit ?ordering= still overrides it
+        rank = models.Case(
+            *(models.When(pk=pk, then=models.Value(value)) for pk, value in ranks.items()),
+            default=models.Value(0.0), output_field=models.FloatField(),
+        )
+        return queryset.alias(search_rank=rank).order_by("search_rank", "pk")
+
+    def term_condition(self, search_field, term, queryset, ranks):
+        prefix = search_field[0] if search_field[0] in self.lookup_prefixes else ""
+        field = search_field[len(prefix):]
+        mode = self.index_modes.get(prefix)
+        if mode and field in INDEXED_FIELDS and len(term) >= MIN_TERM_LENGTH:
+            if mode != "fuzzy":
+                return index_lookup(field, mode, term)
+            matches = fuzzy_matches(field, term, queryset.db)
+            for pk, value in matches:
+                ranks[pk] = ranks.get(pk, 0.0) + value
+            return models.Q(pk__in=[pk for pk, _ in matches])
+        return models.Q(**{self.construct_search(search_field, queryset): term})
@@ -8,6 +8,7 @@ class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ["id", "username", "email", "password"]
+        sparse_fields = ["id", "username", "email"]
         extra_kwargs = {
             "password": {"write_only": True},
         }
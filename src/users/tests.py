@@ -1,3 +1,104 @@
-from django.test import TestCase
+from django.contrib.auth.hashers import make_password
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
 
-# Create your tests here.
+from users import hashing
+from users.models import User
+from users.search import fuzzy_pieces
+
+
+@override_settings(ALLOWED_HOSTS=["testserver"], AUDIT_ASYNC=False)
+class IndexedSearchTestCase(TestCase):
+    def setUp(self):
+        names = ["marathonrunner", "marathon", "runnerbean", "Trailblazer", "zelkaren"]
+        self.users = {name: User.objects.create(username=name, email=f"{name.lower()}@example.com") for name in names}
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(username="admin", email="admin@example.com", is_staff=True))
+
+    def search(self, term, mode=None, **params):
+        params = {"search": term, **params}
+        if mode:
+            params["search_mode"] = mode
+        response = self.client.get(reverse("user_list"), params)
+        self.assertEqual(response.status_code, 200)
+        return [user["username"] for user in response.json()["data"]]
+
+    def test_substring_prefix_and_short_terms(self):
+        self.assertEqual(self.search("BLAZ"), ["Trailblazer"])
+        self.assertEqual(self.search("runner", ordering="id"), ["marathonrunner", "runnerbean"])
+        self.assertEqual(self.search("mara", "prefix", ordering="id"), ["marathonrunner", "marathon"])
+        self.assertEqual(self.search("ze", ordering="id"), ["Trailblazer", "zelkaren"])  # below the trigram length
+        self.assertEqual(self.search("marathon runner"), ["marathonrunner"])
+
+    def test_fuzzy_matches_tolerate_one_typo(self):
+        for typo in ["marahtonrunner", "marathnorunner", "marathonrnuner", "maratonrunner", "marathonxunner"]:
+            with self.subTest(typo=typo):
+                self.assertEqual(self.search(typo, "fuzzy")[0], "marathonrunner")
+        self.assertEqual(self.search("zlekaren", "fuzzy"), ["zelkaren"])
+
+    def test_fuzzy_pieces_survive_a_swap_across_the_middle(self):
+        term = "marathonrunner"
+        middle = len(term) // 2
+        typo = term[:middle - 1] + term[middle] + term[middle - 1] + term[middle + 1:]
+        self.assertTrue(any(piece in term for piece in fuzzy_pieces(typo)))
+
+    def test_fuzzy_matches_are_ordered_by_rank(self):
+        self.assertEqual(self.search("marahtonrunner", "fuzzy"), ["marathonrunner", "runnerbean"])
+        self.assertEqual(self.search("marahtonrunner", "fuzzy", ordering="-id"), ["runnerbean", "marathonrunner"])
+
+    def test_index_follows_updates_and_deletes(self):
+        User.objects.filter(username="Trailblazer").update(username="pathfinder", email="pathfinder@example.com")
+        self.users["zelkaren"].delete()
+
+        self.assertEqual(self.search("blaz"), [])
+        self.assertEqual(self.search("pathfin"), ["pathfinder"])
+        self.assertEqual(self.search("zelkaren", "fuzzy"), [])
+
+
+@override_settings(
+    ALLOWED_HOSTS=["testserver"], AUDIT_ASYNC=False,
+    PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"],
+)
+class HashingLimitTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="hasher", email="hasher@example.com", password=make_password("secret"))
+        hashing._limiter = hashing.HashingLimiter(max_concurrency=1, max_pending=0)
+        self.addCleanup(setattr, hashing, "_limiter", None)
+
+    def login(self, url_name="login"):
+        return APIClient().post(reverse(url_name), {"username": "hasher", "password": "secret"}, format="json")
+
+    def test_login_and_token_views_return_503_when_the_queue_is_full(self):
+        with hashing.hashing_slot():
+            for url_name in ("login", "token_obtain_pair"):
+                with self.subTest(url_name=url_name):
+                    response = self.login(url_name)
+                    self.assertEqual(response.status_code, 503)
+                    self.assertEqual(response["Retry-After"], "1")
+                    self.assertIn("message", response.json())
+        self.assertEqual(self.login().status_code, 200)
+        self.assertEqual(self.login("token_obtain_pair").status_code, 200)
+
+    def test_register_and_change_password_return_503_when_the_queue_is_full(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with hashing.hashing_slot():
+            response = APIClient().post(
+                reverse("register"), {"username": "newcomer", "email": "newcomer@example.com", "password": "secret"},
+                format="json")
+            self.assertEqual(response.status_code, 503)
+            response = client.put(
+                reverse("change_password"),
+                {"old_password": "secret", "new_password": "changed", "confirm_password": "changed"}, format="json")
+            self.assertEqual(response.status_code, 503)
+        self.assertFalse(User.objects.filter(username="newcomer").exists())
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password("secret"))
+
+    def test_login_upgrades_outdated_hashes(self):
+        hashers = ["django.contrib.auth.hashers.SHA1PasswordHasher", "django.contrib.auth.hashers.MD5PasswordHasher"]
+        with override_settings(PASSWORD_HASHERS=hashers):
+            self.assertEqual(self.login().status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith("sha1$"))
@@ -1,5 +1,5 @@
 from django.urls import path, include
-from rest_framework_simplejwt.views import TokenRefreshView, TokenObtainPairView
+from rest_framework_simplejwt.views import TokenRefreshView
 
 from users import views
 
@@ -7,6 +7,7 @@ from users import views
 crud = [
     path("", views.UserListAPIView.as_view(), name="user_list"),
     path("<int:pk>/", views.UserDetailAPIView.as_view(), name="user_detail"),
+    path("by-ids/", views.UserDetailAPIView.as_view(), name="user_by_ids"),
     path("register/", views.UserCreateAPIView.as_view(), name="register"),
     path("delete/<int:pk>/", views.DeleteUserAPIView.as_view(), name="delete_user"),
     path("edit-profile/", views.UserEditAPIView.as_view(), name="edit_profile"),
@@ -14,7 +15,7 @@ crud = [
 ]
 
 auth = [
-    path('token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
+    path('token/', views.UserTokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('login/', views.UserLoginView.as_view(), name='login'),
     path('logout/', views.UserLogoutView.as_view(), name='logout'),
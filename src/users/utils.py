@@ -1,14 +1,19 @@
 from rest_framework.exceptions import PermissionDenied
 from rest_framework.views import exception_handler
 
+from base.batch_fetch import InvalidIds
+from base.fieldsets import InvalidFields
 from staking_app.models import UserWallet
+from users.hashing import HashingBusy
 
 
 def custom_exception_handler(exc, context):
     response = exception_handler(exc, context)
 
-    if isinstance(exc, PermissionDenied):
+    if isinstance(exc, (PermissionDenied, InvalidFields, InvalidIds, HashingBusy)):
         response.data = {"message": exc.detail}
+    if isinstance(exc, HashingBusy):
+        response["Retry-After"] = "1"
 
     return response
 
@@ -5,8 +5,13 @@ from rest_framework.generics import CreateAPIView, ListAPIView, GenericAPIView
 from rest_framework.request import Request
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from rest_framework_simplejwt.views import TokenObtainPairView
 
+from base.batch_fetch import BatchFetchMixin
+from base.fieldsets import SparseFieldsetMixin
+from users.hashing import hashing_slot
 from users.models import User
+from users.search import IndexedSearchFilter
 from users.serializers import UserSerializer, UserEditSerializer, ChangePasswordSerializer, LoginSerializer
 from users.user_permissions import OwnOrAdminPermission
 
@@ -23,7 +28,8 @@ class UserCreateAPIView(CreateAPIView):
 
         validated_data = serializer.validated_data
         password = validated_data.get("password")
-        hashed_password = make_password(password)
+        with hashing_slot():
+            hashed_password = make_password(password)
         serializer.validated_data["password"] = hashed_password
         try:
             serializer.save()
@@ -32,12 +38,12 @@ class UserCreateAPIView(CreateAPIView):
         return Response({"message": "Registration successful"}, status=status.HTTP_201_CREATED)
 
 
-class UserListAPIView(ListAPIView):
+class UserListAPIView(SparseFieldsetMixin, ListAPIView):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [permissions.IsAuthenticated, OwnOrAdminPermission]
     http_method_names = ["get"]
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [IndexedSearchFilter, filters.OrderingFilter]
     search_fields = ["username", "email"]
     ordering_fields = "__all__"
 
@@ -56,15 +62,29 @@ class UserListAPIView(ListAPIView):
         return Response(serializer.data, status=status.HTTP_200_OK)
 
 
-class UserDetailAPIView(GenericAPIView):
+class UserDetailAPIView(BatchFetchMixin, SparseFieldsetMixin, GenericAPIView):
+    queryset = User.objects.all()
+    serializer_class = UserSerializer
     permission_classes = [permissions.IsAuthenticated, OwnOrAdminPermission]
     http_method_names = ["get"]
 
-    def get(self, request, pk):
-        user = User.objects.filter(pk=pk).first()
+    def get_permissions(self):
+        if "pk" not in self.kwargs:
+            return [permissions.IsAuthenticated()]  # by ids: other users are filtered out by `batch_queryset`
+        return super().get_permissions()
+
+    def batch_queryset(self):
+        if self.request.user.is_staff or self.request.user.is_superuser:
+            return self.get_queryset()
+        return self.get_queryset().filter(pk=self.request.user.id)
+
+    def get(self, request, pk=None):
+        if pk is None:
+            return self.get_batch(request)
+        user = self.project(User.objects.filter(pk=pk)).first()
         if not user:
             return Response({"message": "User not found"}, status=status.HTTP_404_NOT_FOUND)
-        serializer = UserSerializer(user)
+        serializer = self.get_serializer(user)
 
         return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -131,14 +151,17 @@ class UserChangePasswordAPIView(mixins.UpdateModelMixin, GenericAPIView):
                 status=status.HTTP_412_PRECONDITION_FAILED,
             )
 
-        if not check_password(old_password, user.password):
+        with hashing_slot():
+            valid_old_password = check_password(old_password, user.password)
+        if not valid_old_password:
             return Response({"message": "Invalid old password"}, status=status.HTTP_412_PRECONDITION_FAILED)
 
         if new_password != confirm_password:
             return Response({"message": "Password mismatch"}, status=status.HTTP_412_PRECONDITION_FAILED)
 
-        try:
+        with hashing_slot():
             user.set_password(new_password)
+        try:
             user.save()
         except Exception:
             return Response(
@@ -164,7 +187,8 @@ class UserLoginView(GenericAPIView):
         if not serializer.is_valid():
             return Response({"message": serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
 
-        user = authenticate(username=serializer.data.get("username"), password=serializer.data.get("password"))
+        with hashing_slot():
+            user = authenticate(username=serializer.data.get("username"), password=serializer.data.get("password"))
 
         if user is None:
             return Response({'message': 'Invalid credentials'}, status=status.HTTP_401_UNAUTHORIZED)
@@ -175,6 +199,12 @@ class UserLoginView(GenericAPIView):
         return Response({'message': 'Login successful'})
 
 
+class UserTokenObtainPairView(TokenObtainPairView):
+    def post(self, request, *args, **kwargs):
+        with hashing_slot():  # the serializer authenticates, which hashes the password
+            return super().post(request, *args, **kwargs)
+
+
 class UserLogoutView(APIView):
     permission_classes = [permissions.IsAuthenticated]
     http_method_names = ["post"]